@@ -0,0 +1,481 @@
+"""Aggregation of impact layers by regions
+
+Provides the functions zonal_statistics() and aggregate_points() which
+summarise values of raster layers and attributes of point layers within
+each polygon of a vector layer of regions such as districts.
+"""
+
+import os
+import numpy
+from collections import OrderedDict
+
+from impact.storage.vector import Vector
+from impact.storage.geometry import expand_ranges
+from impact.storage.spatial_index import PolygonIndex
+
+# Statistics that can be computed for each region
+AGGREGATION_STATISTICS = ['sum', 'mean', 'min', 'max', 'count']
+
+# Number of region layers whose zones are kept by get_zones
+ZONES_CACHE_SIZE = 8
+
+
+class Zones:
+    """Regions of a polygon layer rasterized onto grids
+
+    The cells covered by each region are found once for each grid and
+    kept so that several raster layers on the same grid can be
+    aggregated without rasterizing the regions again. Likewise the index
+    used to locate points in regions is built once.
+
+    Cells are represented as spans of consecutive cells in one row
+    given by four arrays of equal length:
+
+    region: Index of region (polygon feature)
+    row: Row of grid
+    start, stop: Range of columns of cells in the span
+
+    A cell belongs to a region if its centre lies inside the polygon.
+    Spans are ordered by row.
+    """
+
+    def __init__(self, V):
+        """Initialise zones from vector layer
+
+        Input
+            V: Vector layer of polygons
+        """
+
+        msg = ('Regions must be given as a vector layer of polygons. '
+               'I got %s' % V)
+        assert V.is_vector and V.geometry_type == 'polygon', msg
+
+        self.layer = V
+        self.spans = {}
+        self.polygon_index = None
+
+    def __len__(self):
+        """Number of regions
+        """
+        return len(self.layer)
+
+    def get_spans(self, geotransform, rows, columns):
+        """Get cells covered by regions as spans of cells in rows
+
+        Input
+            geotransform: Geotransform of grid (without rotation)
+            rows, columns: Size of grid
+
+        Output
+            region, row, start, stop: Arrays describing spans as
+                                      described in the class documentation
+        """
+
+        key = (tuple(geotransform), rows, columns)
+        if key not in self.spans:
+            self.spans[key] = rasterize_polygons(self.layer.get_geometry(),
+                                                 geotransform, rows, columns)
+
+        return self.spans[key]
+
+    def get_polygon_index(self):
+        """Get index for locating points in regions
+
+        Output
+            PolygonIndex of the regions
+        """
+
+        if self.polygon_index is None:
+            self.polygon_index = PolygonIndex(self.layer.get_geometry())
+
+        return self.polygon_index
+
+
+def get_zones(V):
+    """Get zones of vector layer of regions read from file
+
+    Input
+        V: Vector layer of polygons or Zones instance
+
+    Output
+        Zones instance for V. Zones of layers read from file are kept
+        for the ZONES_CACHE_SIZE most recently used files, identified by
+        their path and modification time, so that regions such as
+        districts are rasterized once for each grid across calls.
+        Layers held in memory get new zones.
+    """
+
+    if isinstance(V, Zones):
+        return V
+
+    if V.filename is None:
+        return Zones(V)
+
+    try:
+        mtime = os.path.getmtime(V.filename)
+    except OSError:
+        # E.g. virtual file systems
+        mtime = None
+
+    key = (os.path.abspath(V.filename), mtime)
+    if key in zones_cache:
+        zones = zones_cache.pop(key)
+    else:
+        zones = Zones(V)
+
+    # Most recently used zones last
+    zones_cache[key] = zones
+    while len(zones_cache) > ZONES_CACHE_SIZE:
+        zones_cache.popitem(last=False)
+
+    return zones
+
+
+# Zones of region layers read from file shared by all calls
+zones_cache = OrderedDict()
+
+
+def rasterize_polygons(G, geotransform, rows, columns):
+    """Find cells of grid with centres inside polygons
+
+    Input
+        G: PackedGeometry of polygons
+        geotransform: Geotransform of grid (without rotation)
+        rows, columns: Size of grid
+
+    Output
+        region, row, start, stop: Arrays describing spans of cells in
+                                  each row covered by each polygon. See
+                                  class Zones for details.
+
+    The polygons are scanned along the rows of cell centres. Crossings of
+    ring edges with each row are paired in order of increasing column
+    within each polygon (even-odd rule) so holes and multipolygons are
+    handled alike.
+    """
+
+    msg = ('Rotated grids are not supported. Geotransform was %s'
+           % str(geotransform))
+    assert geotransform[2] == 0 and geotransform[4] == 0, msg
+
+    # Vertices in fractional grid coordinates. Centre of cell (r, c)
+    # is (c + 0.5, r + 0.5).
+    u = (G.vertices[:, 0] - geotransform[0]) / geotransform[1]
+    v = (G.vertices[:, 1] - geotransform[3]) / geotransform[5]
+
+    # Edges crossing at least one row of cell centres. A row is crossed
+    # if its centre lies in the half open interval spanned by the edge.
+    part, successor = G.get_segments()
+    region = G.get_feature_index()[part]
+
+    v_min = numpy.minimum(v, v[successor])
+    v_max = numpy.maximum(v, v[successor])
+    first = numpy.clip(numpy.ceil(v_min - 0.5), 0, rows).astype('l')
+    last = numpy.clip(numpy.ceil(v_max - 0.5), 0, rows).astype('l')
+    edges = numpy.nonzero(last > first)[0]
+    first = first[edges]
+    last = last[edges]
+
+    # Column of each crossing of an edge with a row
+    counts = last - first
+    edge = numpy.repeat(edges, counts)
+    row = expand_ranges(first, last)
+    a = edge
+    b = successor[edge]
+    crossing = u[a] + (row + 0.5 - v[a]) * (u[b] - u[a]) / (v[b] - v[a])
+    region = region[edge]
+
+    # Pair consecutive crossings of each polygon in each row
+    order = numpy.lexsort((crossing, region, row))
+    crossing = crossing[order]
+    region = region[order][::2]
+    row = row[order][::2]
+
+    start = numpy.clip(numpy.ceil(crossing[::2] - 0.5), 0, columns)
+    stop = numpy.clip(numpy.ceil(crossing[1::2] - 0.5), 0, columns)
+    start = start.astype('l')
+    stop = stop.astype('l')
+
+    nonempty = stop > start
+    return region[nonempty], row[nonempty], start[nonempty], stop[nonempty]
+
+
+def zonal_statistics(R, zones, statistics=None, prefix=''):
+    """Summarise raster values within each region
+
+    Input
+        R: Raster layer, e.g. of impact such as people affected
+        zones: Vector layer of polygon regions or Zones instance.
+               Regions are rasterized once for each grid. See get_zones
+               for how zones of layers are kept across calls.
+        statistics: List of statistics to compute from
+                    AGGREGATION_STATISTICS. Default is all of them.
+        prefix: Optional prefix for names of the new attributes
+
+    Output
+        Vector layer with the regions, their attributes and one new
+        attribute for each statistic, named by its upper case name
+        (e.g. SUM). Cells with NODATA are ignored. Regions without cells
+        of data have a count of zero and NaN for other statistics.
+        New attributes must not have the names of attributes of the
+        regions. Use prefix to tell them apart.
+
+    Values are read in strips of rows (see Raster.get_blocks) so memory
+    use does not depend on the size of the raster.
+    """
+
+    if statistics is None:
+        statistics = AGGREGATION_STATISTICS
+
+    for statistic in statistics:
+        msg = ('Statistic must be one of %s. I got %s'
+               % (', '.join(AGGREGATION_STATISTICS), statistic))
+        assert statistic in AGGREGATION_STATISTICS, msg
+
+    zones = get_zones(zones)
+
+    msg = ('Raster %s and regions %s must have the same projection'
+           % (R, zones.layer))
+    assert R.projection == zones.layer.projection, msg
+
+    check_attribute_names(zones.layer,
+                          [prefix + statistic.upper()
+                           for statistic in statistics])
+
+    N = len(zones)
+    region, row, start, stop = zones.get_spans(R.get_geotransform(),
+                                               R.rows, R.columns)
+
+    sums = numpy.zeros(N)
+    counts = numpy.zeros(N)
+    minima = numpy.empty(N)
+    minima.fill(numpy.nan)
+    maxima = numpy.empty(N)
+    maxima.fill(numpy.nan)
+    extrema = 'min' in statistics or 'max' in statistics
+
+    for window, A in R.get_blocks(nan=True):
+        yoff = window[1]
+        ysize = window[3]
+
+        # Spans in this strip of rows
+        i, j = numpy.searchsorted(row, [yoff, yoff + ysize])
+        if i == j:
+            continue
+
+        r = row[i:j] - yoff
+        c0 = start[i:j]
+        c1 = stop[i:j]
+        k = region[i:j]
+
+        # Sums and counts of spans from cumulative sums along rows
+        valid = ~numpy.isnan(A)
+        for total, X in [(sums, numpy.where(valid, A, 0)),
+                         (counts, valid)]:
+            S = numpy.zeros((ysize, A.shape[1] + 1))
+            numpy.cumsum(X, axis=1, out=S[:, 1:])
+            total += numpy.bincount(k, weights=S[r, c1] - S[r, c0],
+                                    minlength=N)
+
+        # Extrema of spans reduced over the flattened strip
+        if extrema:
+            flat = numpy.append(A.ravel(), numpy.nan)
+            bounds = numpy.empty(2 * len(r), dtype='l')
+            bounds[::2] = r * A.shape[1] + c0
+            bounds[1::2] = r * A.shape[1] + c1
+
+            for extremum, ufunc in [(minima, numpy.fmin),
+                                    (maxima, numpy.fmax)]:
+                values = ufunc.reduceat(flat, bounds)[::2]
+                regions, values = reduce_by_region(k, values, ufunc)
+                extremum[regions] = ufunc(extremum[regions], values)
+
+    # Collect results as attributes of regions
+    data = OrderedDict()
+    if zones.layer.data is not None:
+        for name, column in zones.layer.data.columns.items():
+            data[name] = column
+
+    for statistic in statistics:
+        if statistic == 'sum':
+            values = sums
+        elif statistic == 'count':
+            values = counts.astype('i')
+        elif statistic == 'mean':
+            values = numpy.empty(N)
+            values.fill(numpy.nan)
+            nonzero = counts > 0
+            values[nonzero] = sums[nonzero] / counts[nonzero]
+        elif statistic == 'min':
+            values = minima
+        else:
+            values = maxima
+
+        if statistic in ['sum', 'mean', 'min', 'max']:
+            values[counts == 0] = numpy.nan
+
+        data[prefix + statistic.upper()] = values
+
+    return Vector(data=data,
+                  projection=zones.layer.get_projection(),
+                  geometry=zones.layer.get_geometry(),
+                  name='%s by %s' % (R.get_name(), zones.layer.get_name()))
+
+
+def aggregate_points(V, zones, attributes=None, statistic='sum',
+                     prefix=''):
+    """Summarise attributes of point features within each region
+
+    Input
+        V: Vector layer of points (or lines and polygons which are
+           located by their centroids). Layers read in chunks are
+           aggregated one chunk at a time.
+        zones: Vector layer of polygon regions or Zones instance
+        attributes: List of names of attributes to aggregate. Default is
+                    all numerical attributes of V.
+        statistic: One of AGGREGATION_STATISTICS applied to all attributes
+        prefix: Optional prefix for names of the new attributes
+
+    Output
+        Vector layer with the regions, their attributes, one new attribute
+        for each aggregated attribute with the same name and the attribute
+        COUNT with the number of features in each region. Features outside
+        all regions are left out and NaN values are ignored. Regions
+        without values get NaN except for counts and sums which are zero.
+        New attributes must not have the names of attributes of the
+        regions. Use prefix to tell them apart.
+    """
+
+    msg = ('Statistic must be one of %s. I got %s'
+           % (', '.join(AGGREGATION_STATISTICS), statistic))
+    assert statistic in AGGREGATION_STATISTICS, msg
+
+    zones = get_zones(zones)
+
+    msg = ('Layer %s and regions %s must have the same projection'
+           % (V, zones.layer))
+    assert V.projection == zones.layer.projection, msg
+
+    N = len(zones)
+    index = zones.get_polygon_index()
+
+    # Running reductions of each attribute
+    counts = numpy.zeros(N)
+    sums = OrderedDict()
+    valid_counts = OrderedDict()
+    minima = OrderedDict()
+    maxima = OrderedDict()
+
+    # Refuse to overwrite attributes of regions before features are read.
+    # Attributes found in the first chunk are checked as it is read.
+    names = [prefix + 'COUNT']
+    if attributes is not None:
+        names += [prefix + name for name in attributes]
+    check_attribute_names(zones.layer, names)
+
+    for chunk in V.get_chunks():
+        data = chunk.get_data()
+        if attributes is None:
+            attributes = [name for name, column in data.columns.items()
+                          if column.dtype.kind in 'biuf']
+            check_attribute_names(zones.layer,
+                                  [prefix + name for name in attributes])
+
+        for name in attributes:
+            if name not in sums:
+                sums[name] = numpy.zeros(N)
+                valid_counts[name] = numpy.zeros(N)
+                minima[name] = numpy.empty(N)
+                minima[name].fill(numpy.nan)
+                maxima[name] = numpy.empty(N)
+                maxima[name].fill(numpy.nan)
+
+        # Region of each feature
+        region = index.query_points(chunk.get_centroids())
+        inside = region >= 0
+        region = region[inside]
+        counts += numpy.bincount(region, minlength=N)
+
+        for name in attributes:
+            values = numpy.array(chunk.get_data(name)[inside], dtype='d')
+            valid = ~numpy.isnan(values)
+            k = region[valid]
+            values = values[valid]
+
+            sums[name] += numpy.bincount(k, weights=values, minlength=N)
+            valid_counts[name] += numpy.bincount(k, minlength=N)
+
+            if statistic in ['min', 'max'] and len(k) > 0:
+                for extremum, ufunc in [(minima[name], numpy.fmin),
+                                        (maxima[name], numpy.fmax)]:
+                    regions, reduced = reduce_by_region(k, values, ufunc)
+                    extremum[regions] = ufunc(extremum[regions], reduced)
+
+    # Collect results as attributes of regions
+    data = OrderedDict()
+    if zones.layer.data is not None:
+        for name, column in zones.layer.data.columns.items():
+            data[name] = column
+
+    for name in sums:
+        if statistic == 'sum':
+            values = sums[name]
+        elif statistic == 'count':
+            values = valid_counts[name].astype('i')
+        elif statistic == 'mean':
+            values = numpy.empty(N)
+            values.fill(numpy.nan)
+            nonzero = valid_counts[name] > 0
+            values[nonzero] = sums[name][nonzero] / valid_counts[name][nonzero]
+        elif statistic == 'min':
+            values = minima[name]
+        else:
+            values = maxima[name]
+
+        data[prefix + name] = values
+
+    data[prefix + 'COUNT'] = counts.astype('i')
+
+    return Vector(data=data,
+                  projection=zones.layer.get_projection(),
+                  geometry=zones.layer.get_geometry(),
+                  name='%s by %s' % (V.get_name(), zones.layer.get_name()))
+
+
+def check_attribute_names(layer, names):
+    """Check that new attributes do not replace attributes of regions
+
+    Input
+        layer: Vector layer of regions
+        names: List of names of new attributes
+    """
+
+    if layer.data is None:
+        return
+
+    clashes = [name for name in names if name in layer.data.columns]
+    msg = ('Attributes %s of regions %s would be overwritten by aggregated '
+           'values. Use a prefix for the new attributes.'
+           % (', '.join(clashes), layer))
+    assert len(clashes) == 0, msg
+
+
+def reduce_by_region(region, values, ufunc):
+    """Reduce values of spans for each region
+
+    Input
+        region: Array of region indices
+        values: Array of values, one per region index
+        ufunc: Binary ufunc such as numpy.fmax
+
+    Output
+        regions: Array of unique region indices
+        values: Array of reduced values for each of those regions
+    """
+
+    order = numpy.argsort(region, kind='mergesort')
+    region = region[order]
+    starts = numpy.concatenate([[0],
+                                numpy.nonzero(numpy.diff(region))[0] + 1])
+
+    return region[starts], ufunc.reduceat(values[order], starts)
@@ -1,17 +1,25 @@
 """Computational engine for Risk in a Box core.
 
-Provides the function calculate_impact()
+Provides the functions calculate_impact() and
+calculate_impact_with_aggregation()
 """
 
+import os
 import numpy
 
 from impact.storage.projection import Projection
+from impact.storage.vector import Vector, VectorWriter
+from impact.storage.io import read_layer
 from impact.storage.utilities import unique_filename
 from impact.storage.utilities import DEFAULT_PROJECTION
+from impact.engine.aggregation import zonal_statistics, aggregate_points
+from impact.engine.aggregation import get_zones
 
+# Number of exposure features passed at a time to plugins supporting chunks
+FEATURE_CHUNK_SIZE = 10000
 
-def calculate_impact(layers, impact_function,
-                     comment=''):
+
+def calculate_impact(layers, impact_function, comment=''):
     """Calculate impact levels as a function of list of input layers
 
     Input
@@ -34,12 +42,64 @@ def calculate_impact(layers, impact_function,
     Assumptions
         1. All layers are in WGS84 geographic coordinates
         2. Layers are equipped with metadata such as names and categories
+
+    Vector layers read with a chunk size (see read_layer) are passed to
+    impact functions with the attribute supports_chunks set one chunk at
+    a time and the result is written chunk by chunk. Other impact functions
+    get the entire layer.
+    """
+
+    output_filename, _ = run_impact_function(layers, impact_function)
+    return output_filename
+
+
+def calculate_impact_with_aggregation(layers, impact_function,
+                                      aggregation_layer, comment=''):
+    """Calculate impact and summarise it by regions
+
+    Input
+        layers, impact_function, comment: See calculate_impact
+        aggregation_layer: Vector layer of polygon regions (e.g. districts)
+                           by which to summarise the impact
+
+    Output
+        filename: Name of resulting impact layer as for calculate_impact
+        aggregation_filename: Name of shapefile of the regions with the
+                              impact summarised over each region. See
+                              aggregate_impact for details.
+    """
+
+    output_filename, F = run_impact_function(layers, impact_function)
+    return output_filename, aggregate_impact(F, aggregation_layer)
+
+
+def run_impact_function(layers, impact_function):
+    """Run impact function and write result and its style to file
+
+    Input
+        layers: List of Raster and Vector layer objects
+        impact_function: Function of the form f(layers)
+
+    Output
+        filename: Name of file the result was written to
+        F: Resulting layer. Results computed in chunks are read back
+           with a chunk size (see calculate_impact_in_chunks).
     """
 
+    # Resample raster layers onto a common grid if needed
+    layers = align_raster_layers(layers)
+
     # Input checks
     check_data_integrity(layers)
 
     # Pass input layers to plugin
+    if getattr(impact_function, 'supports_chunks', False):
+        F = calculate_impact_in_chunks(layers, impact_function)
+        if F is not None:
+            write_style(F, impact_function, F.filename)
+            return F.filename, F
+
+    layers = [read_all_features(layer) for layer in layers]
 
     # FIXME (Ole): When issue #21 has been fully implemented, this
     #              return value should be a list of layers.
@@ -56,15 +116,168 @@ def calculate_impact(layers, impact_function,
         # use default style for vector
 
     output_filename = unique_filename(suffix=extension)
-    F.write_to_file(output_filename)
+    if F.is_raster:
+        # Compressed and tiled with overviews for fast upload and rendering
+        F.write_to_file(output_filename, compression='DEFLATE',
+                        tiled=True, overviews=True)
+    else:
+        F.write_to_file(output_filename)
+
+    write_style(F, impact_function, output_filename)
+    return output_filename, F
+
+
+def aggregate_impact(F, aggregation_layer):
+    """Summarise impact layer by regions and write result to file
+
+    Input
+        F: Raster or Vector impact layer
+        aggregation_layer: Vector layer of polygon regions
+
+    Output
+        Name of shapefile with the regions and their summarised impact.
+
+    Raster impacts are summarised by the statistics in
+    AGGREGATION_STATISTICS of their cell values (see zonal_statistics).
+    Numerical attributes of vector impacts are summed over the features
+    located in each region (see aggregate_points). The rasterized regions
+    of aggregation layers read from file are kept across calls (see
+    get_zones).
+    """
+
+    # Regions read from file are rasterized once for each grid
+    zones = get_zones(aggregation_layer)
+    if F.is_raster:
+        A = zonal_statistics(F, zones)
+    else:
+        A = aggregate_points(F, zones)
+
+    aggregation_filename = unique_filename(suffix='.shp')
+    A.write_to_file(aggregation_filename)
+    return aggregation_filename
+
+
+def calculate_impact_in_chunks(layers, impact_function):
+    """Calculate impact one chunk of exposure features at a time
+
+    Input
+        layers: List of Raster and Vector layer objects. One vector layer
+                may have been read with a chunk size.
+        impact_function: Function of the form f(layers) returning a
+                         vector layer with one feature per exposure feature
+
+    Output
+        F: Vector layer of the result read back from the shapefile it was
+           written to with chunk size FEATURE_CHUNK_SIZE and named as the
+           layers returned by impact_function. None if no layer was read
+           in chunks.
+
+    Peak memory is bounded by the chunk size rather than the number of
+    features as each chunk is written to file before the next is read.
+    The result is read back in chunks too so that styles and summaries
+    reflect all features without holding them in memory.
+    """
+
+    chunked = [i for i, layer in enumerate(layers)
+               if layer.is_vector and layer.chunk_size is not None]
+    if len(chunked) == 0:
+        return None
+
+    msg = ('Only one layer can be read in chunks. Layers %s were'
+           % ', '.join([str(layers[i]) for i in chunked]))
+    assert len(chunked) == 1, msg
+    k = chunked[0]
+
+    writer = None
+    for chunk in layers[k].get_chunks():
+        chunk_layers = list(layers)
+        chunk_layers[k] = chunk
+
+        F = impact_function.run(chunk_layers)
+
+        msg = ('Impact functions run in chunks must return vector layers. '
+               '%s returned %s' % (impact_function, F))
+        assert F.is_vector, msg
+
+        if writer is None:
+            # Output file only exists once there is a result to write
+            output_filename = unique_filename(suffix='.shp')
+            writer = VectorWriter(output_filename, F.get_projection(),
+                                  F.geometry_type)
+            name = F.get_name()
+        writer.write(F)
+
+    msg = ('Impact function %s produced no result as layer %s read in '
+           'chunks has no features' % (impact_function, layers[k]))
+    assert writer is not None, msg
+    writer.close()
+
+    F = read_layer(output_filename, chunk_size=FEATURE_CHUNK_SIZE)
+    F.name = name
+
+    return F
+
+
+def read_all_features(layer):
+    """Read all features of vector layer read with a chunk size
+
+    Input
+        layer: Raster or Vector layer object
+
+    Output
+        The layer itself unless it is a vector layer read with a chunk size
+        in which case all its features are read into a new vector layer
+    """
+
+    if layer.is_vector and layer.chunk_size is not None:
+        return Vector(layer.filename)
+    else:
+        return layer
+
+
+def write_style(F, impact_function, output_filename):
+    """Write style generated by impact_function for result F
+
+    The style is written next to the output file with extension .sld
+    """
 
     # Generate style as defined by the impact_function
     style = impact_function.generate_style(F)
-    f = open(output_filename.replace(extension, '.sld'), 'w')
+    basename, _ = os.path.splitext(output_filename)
+    f = open(basename + '.sld', 'w')
     f.write(style)
     f.close()
 
-    return output_filename
+
+def align_raster_layers(layers, method='bilinear'):
+    """Resample raster layers onto a common grid
+
+    Input
+        layers: List of Raster and Vector layer objects
+        method: Resampling method used for misaligned raster layers.
+                See Raster.interpolate.
+
+    Output
+        List of layers where all raster layers share the grid of the
+        last raster layer in the list (the exposure layer by convention).
+        Layers already on that grid and vector layers are returned as is.
+    """
+
+    rasters = [layer for layer in layers if layer.is_raster]
+    if len(rasters) < 2:
+        return layers
+
+    # Use grid of exposure layer so that e.g. population counts are
+    # left untouched and only the hazard levels are interpolated.
+    target = rasters[-1]
+
+    aligned = []
+    for layer in layers:
+        if layer.is_raster:
+            layer = layer.interpolate(target, method=method)
+        aligned.append(layer)
+
+    return aligned
 
 
 def check_data_integrity(layer_files):
@@ -105,8 +318,8 @@ def check_data_integrity(layer_files):
                 assert geotransform == layer.get_geotransform(), msg
 
         # In case of vector layers, we check that the coordinates
-        # are the same
-        if layer.is_vector:
+        # are the same. Layers read in chunks have no coordinates in memory.
+        if layer.is_vector and layer.chunk_size is None:
             if coordinates is None:
                 coordinates = layer.get_geometry()
             else:
@@ -1,12 +1,49 @@
-"""Wrapper around SciPy interpolation.
+"""Interpolation from raster layers to points.
 
 This module takes care of differences in assumptions about axes and
 ordering of dimensions between raster files and numpy arrays.
+
+Available interpolation methods are
+    nearest:  Value of the grid cell containing each point
+    bilinear: Bilinear interpolation between the four nearest pixel centers
+    spline:   Bivariate spline fitted to the grid (using SciPy)
+
+Raster layers can also be resampled onto the grid of another raster layer.
+Besides nearest and bilinear, the available resampling methods are
+    average:  Mean of source cells weighted by their overlap with each cell
+    sum:      Sum of source cells weighted by the fraction of each source
+              cell covered. This preserves totals such as population counts.
 """
 
+import os
+import hashlib
 import numpy
+from collections import OrderedDict
+from scipy import sparse
 from scipy.interpolate import RectBivariateSpline
 from impact.storage.vector import Vector
+from impact.storage.utilities import geotransform_to_axes
+from impact.storage.utilities import bbox_to_window
+from impact.storage.utilities import window_geotransform
+
+# Recognised interpolation methods
+INTERPOLATION_METHODS = ['nearest', 'bilinear', 'spline']
+DEFAULT_INTERPOLATION_METHOD = 'bilinear'
+
+# Recognised methods for resampling between grids
+RESAMPLING_METHODS = ['nearest', 'bilinear', 'average', 'sum']
+
+# Maximal number of points processed at a time by grid interpolators.
+# This bounds the size of temporary index and weight arrays.
+POINTS_PER_BLOCK = 1000000
+
+# Number of grid cells added on each side of the points when only a window
+# of the raster is used. The spline needs a wider margin to approximate
+# the fit over the full grid.
+WINDOW_MARGIN = {'nearest': 1, 'bilinear': 1, 'spline': 4}
+
+# Default memory budget for cached interpolators in bytes
+INTERPOLATOR_CACHE_BYTES = 512 * 1024 * 1024
 
 
 def raster_spline(longitudes, latitudes, values):
@@ -22,8 +59,8 @@ def raster_spline(longitudes, latitudes, values):
         Callable object F that returns interpolated values for arbitrary
         points within the specified domain.
         F is called as F(lon, lat) where lon and lat are either
-        single valued or vector valued. Values outside domain raises an
-        exception. (NOT YET IMPLEMENTED)
+        single valued or vector valued. Values outside domain are
+        returned as NaN.
     """
 
     # Input checks
@@ -55,45 +92,470 @@ class Interpolator:
         self.minlat = latitudes[0]
         self.maxlat = latitudes[-1]
 
+    @property
+    def nbytes(self):
+        """Approximate memory used by the fitted spline in bytes
+        """
+        tx, ty = self.F.get_knots()
+        return tx.nbytes + ty.nbytes + self.F.get_coeffs().nbytes
+
     def __call__(self, lon, lat):
-        """Interpolate to specified location
+        """Interpolate to specified location(s)
+
+        Input
+            lon, lat: Location(s) in WGS84 geographic coordinates where
+                      interpolated values are sought. These can be either
+                      single values or arrays of equal length.
+
+        Output
+            interpolated value(s) at lon, lat. Points outside the
+            interpolator bounds are assigned NaN.
+        """
+
+        scalar, lon, lat = check_points(lon, lat)
+
+        # Mask points outside bounds. They will be assigned NaN.
+        inside = ((self.minlon <= lon) & (lon <= self.maxlon) &
+                  (self.minlat <= lat) & (lat <= self.maxlat))
+
+        values = numpy.empty(lon.shape, dtype='d')
+        values.fill(numpy.nan)
+
+        # Evaluate spline at all remaining points in one call
+        if numpy.any(inside):
+            values[inside] = self.F.ev(lat[inside], lon[inside])
+
+        if scalar:
+            return values[0]
+        else:
+            return values
+
+
+class GridInterpolator:
+    """Class providing callable 2D interpolator computed directly from grid
+
+    Values are calculated from the geotransform index math without
+    fitting anything to the grid, so the only memory used is that of
+    the grid itself and of the points being interpolated.
+
+    To instantiate run GridInterpolator(A, geotransform, method), where
+        A: 2d array of values with rows running north to south
+           as returned by Raster.get_data()
+        geotransform: GDAL geotransform associated with A
+        method: Either 'nearest' or 'bilinear'
+        offset: Optional (xoffset, yoffset) if A is a window of a larger
+                grid. In this case geotransform is that of the larger grid.
+                Grid indices are then computed exactly as for the full grid.
+    """
+
+    def __init__(self, A, geotransform, method=DEFAULT_INTERPOLATION_METHOD,
+                 offset=(0, 0)):
+
+        msg = ('Grid interpolation method must be either nearest or '
+               'bilinear. I got %s' % method)
+        assert method in ['nearest', 'bilinear'], msg
+
+        msg = 'Grid must be a 2d array. I got shape %s' % str(A.shape)
+        assert len(A.shape) == 2, msg
+
+        self.A = A
+        self.geotransform = geotransform
+        self.method = method
+        self.offset = offset
+
+    @property
+    def nbytes(self):
+        """Memory used by the grid in bytes
+        """
+        return self.A.nbytes
+
+    def __call__(self, lon, lat):
+        """Interpolate to specified location(s)
+
+        Input
+            lon, lat: Location(s) in WGS84 geographic coordinates where
+                      interpolated values are sought. These can be either
+                      single values or arrays of equal length.
+
+        Output
+            interpolated value(s) at lon, lat. Points outside the
+            grid are assigned NaN.
+        """
+
+        scalar, lon, lat = check_points(lon, lat)
+
+        values = numpy.empty(lon.shape, dtype='d')
+        for start in range(0, len(lon), POINTS_PER_BLOCK):
+            end = start + POINTS_PER_BLOCK
+            values[start:end] = self.interpolate_block(lon[start:end],
+                                                       lat[start:end])
+
+        if scalar:
+            return values[0]
+        else:
+            return values
+
+    def interpolate_block(self, lon, lat):
+        """Interpolate to arrays of points
+
+        Input
+            lon, lat: Arrays of locations of equal length
+
+        Output
+            array of interpolated values. Points outside the grid are NaN.
+        """
+
+        A = self.A
+        g = self.geotransform
+        rows, columns = A.shape
+
+        # Fractional grid indices of points measured from the upper left
+        # corner of the grid. Rows run north to south as g[5] < 0.
+        x = (lon - g[0]) / g[1] - self.offset[0]
+        y = (lat - g[3]) / g[5] - self.offset[1]
+
+        values = numpy.empty(lon.shape, dtype='d')
+        values.fill(numpy.nan)
+
+        if self.method == 'nearest':
+            # Points must lie within the outer boundary of the grid
+            inside = (0 <= x) & (x <= columns) & (0 <= y) & (y <= rows)
+
+            j = numpy.minimum(x[inside].astype('i'), columns - 1)
+            i = numpy.minimum(y[inside].astype('i'), rows - 1)
+
+            values[inside] = A[i, j]
+        else:
+            # Indices relative to pixel centers
+            x -= 0.5
+            y -= 0.5
+
+            # Points must lie within the pixel centers of the grid.
+            # Allow for rounding errors in the geotransform arithmetic.
+            eps = 1.0e-9
+            inside = ((-eps <= x) & (x <= columns - 1 + eps) &
+                      (-eps <= y) & (y <= rows - 1 + eps))
+
+            x = numpy.clip(x[inside], 0, columns - 1)
+            y = numpy.clip(y[inside], 0, rows - 1)
+
+            # Indices of upper left neighbour and weights
+            j0 = numpy.minimum(x.astype('i'), max(columns - 2, 0))
+            i0 = numpy.minimum(y.astype('i'), max(rows - 2, 0))
+            j1 = numpy.minimum(j0 + 1, columns - 1)
+            i1 = numpy.minimum(i0 + 1, rows - 1)
+
+            wx = x - j0
+            wy = y - i0
+
+            values[inside] = ((1 - wy) * ((1 - wx) * A[i0, j0] +
+                                          wx * A[i0, j1]) +
+                              wy * ((1 - wx) * A[i1, j0] +
+                                    wx * A[i1, j1]))
+
+        return values
+
+
+def check_points(lon, lat):
+    """Convert point locations to arrays for interpolation
+
+    Input
+        lon, lat: Single values or arrays of equal length
+
+    Output
+        scalar: True if lon and lat were single values
+        lon, lat: 1d arrays of locations
+    """
+
+    scalar = numpy.ndim(lon) == 0 and numpy.ndim(lat) == 0
+
+    lon = numpy.array(lon, dtype='d', copy=False, ndmin=1)
+    lat = numpy.array(lat, dtype='d', copy=False, ndmin=1)
+
+    msg = ('Longitudes and latitudes must have the same length. '
+           'I got %i and %i' % (len(lon), len(lat)))
+    assert lon.shape == lat.shape, msg
+
+    return scalar, lon, lat
+
+
+def raster_interpolator(R, method=DEFAULT_INTERPOLATION_METHOD, window=None):
+    """Create callable interpolator for raster layer
+
+    Input
+        R: Raster data set (grid)
+        method: Interpolation method. One of INTERPOLATION_METHODS
+        window: Optional window (xoffset, yoffset, xsize, ysize) of R.
+                If specified, only this part of the grid is read and used.
+
+    Output
+        Callable object F that returns interpolated values for arbitrary
+        points as F(lon, lat). See class Interpolator.
+    """
+
+    msg = ('Interpolation method must be one of %s. '
+           'I got %s' % (', '.join(INTERPOLATION_METHODS), method))
+    assert method in INTERPOLATION_METHODS, msg
+
+    # FIXME (Ole): Replace NODATA with 0 until we can handle proper NaNs
+    A = R.get_data(nan=0.0, window=window, copy=False)
+
+    if window is None:
+        window = (0, 0, R.columns, R.rows)
+
+    if method == 'spline':
+        geotransform = window_geotransform(R.get_geotransform(), window)
+        longitudes, latitudes = geotransform_to_axes(geotransform,
+                                                     A.shape[0], A.shape[1])
+
+        return raster_spline(longitudes, latitudes, A)
+    else:
+        return GridInterpolator(A, R.get_geotransform(), method,
+                                offset=window[:2])
+
+
+class InterpolatorCache:
+    """Least recently used cache of raster interpolators
+
+    Interpolators are keyed by the identity of the raster, the window
+    used and the interpolation method. Raster files are identified by
+    their path and modification time so that changed files are refitted.
+    Rasters held in memory are identified by a hash of their content.
+
+    To instantiate run InterpolatorCache(max_bytes), where
+        max_bytes: Memory budget for cached interpolators in bytes.
+                   Least recently used interpolators are discarded once the
+                   budget is exceeded. Use 0 to disable caching.
+
+    The attributes hits and misses count the outcome of calls to get().
+    """
+
+    def __init__(self, max_bytes=INTERPOLATOR_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.clear()
+
+    def __len__(self):
+        return len(self.interpolators)
+
+    def clear(self):
+        """Discard all cached interpolators and reset counters
+        """
+
+        self.interpolators = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, R, method=DEFAULT_INTERPOLATION_METHOD, window=None):
+        """Get interpolator for raster layer
 
         Input
-            lon, lat: Location in WGS84 geographic coordinates where
-                      interpolated value is sought
+            R: Raster data set (grid)
+            method: Interpolation method. One of INTERPOLATION_METHODS
+            window: Optional window (xoffset, yoffset, xsize, ysize) of R.
 
         Output
-            interpolated value at lon, lat
+            Callable interpolator as returned by raster_interpolator.
+            For the nearest and bilinear methods an interpolator cached for
+            a window containing the requested one may be returned as their
+            values do not depend on the window.
+        """
+
+        if window is None:
+            window = (0, 0, R.columns, R.rows)
+        window = tuple([int(w) for w in window])
+
+        key = raster_key(R, method, window)
+        if key is None:
+            # Not worth caching
+            return raster_interpolator(R, method, window)
+
+        f = self.lookup(key)
+        if f is not None:
+            self.hits += 1
+            return f
+
+        self.misses += 1
+        f = raster_interpolator(R, method, window)
+        self.store(key, f)
+
+        return f
+
+    def lookup(self, key):
+        """Find cached interpolator for key and mark it as recently used
         """
 
-        msg = ('Requested interpolation longitude %f lies outside '
-               'interpolator bounds [%f, %f]. '
-               'Assigning NaN.' % (lon, self.minlon, self.maxlon))
-        if not self.minlon <= lon <= self.maxlon:
-            #print msg
-            return numpy.nan
+        identity, method, window = key
+
+        if key in self.interpolators:
+            match = key
+        elif method == 'spline':
+            return None
+        else:
+            # Any window containing the requested one will do
+            match = None
+            for k in self.interpolators:
+                if k[:2] == (identity, method) and contains(k[2], window):
+                    match = k
+                    break
+
+            if match is None:
+                return None
+
+        f = self.interpolators.pop(match)
+        self.interpolators[match] = f
+        return f
+
+    def store(self, key, f):
+        """Store interpolator and discard least recently used ones if needed
+        """
+
+        if f.nbytes > self.max_bytes:
+            return
+
+        self.interpolators[key] = f
+        self.nbytes += f.nbytes
+
+        while self.nbytes > self.max_bytes:
+            _, g = self.interpolators.popitem(last=False)
+            self.nbytes -= g.nbytes
+
+
+def raster_key(R, method, window):
+    """Key identifying interpolator of raster layer in InterpolatorCache
+
+    Input
+        R: Raster data set (grid)
+        method: Interpolation method
+        window: Window (xoffset, yoffset, xsize, ysize) of R
+
+    Output
+        Tuple (identity, method, window) or None if the interpolator
+        should not be cached.
+    """
+
+    if R.filename is not None:
+        try:
+            mtime = os.path.getmtime(R.filename)
+        except OSError:
+            # E.g. virtual file systems
+            mtime = None
+
+        identity = (os.path.abspath(R.filename), mtime)
+    elif method == 'spline':
+        # Hash only the window that the spline is fitted to
+        A = numpy.ascontiguousarray(R.get_data(window=window, copy=False))
+        identity = (hashlib.md5(A).hexdigest(), str(A.dtype),
+                    tuple(R.get_geotransform()))
+    else:
+        # Grid interpolators for rasters in memory are cheap to create
+        return None
+
+    return (identity + (R.get_nodata_value(),), method, window)
+
+
+def contains(outer, inner):
+    """Test if window inner lies within window outer
+    """
+
+    return (outer[0] <= inner[0] and outer[1] <= inner[1] and
+            inner[0] + inner[2] <= outer[0] + outer[2] and
+            inner[1] + inner[3] <= outer[1] + outer[3])
+
+
+# Interpolators shared by all raster layers
+interpolator_cache = InterpolatorCache()
+
+
+def points_window(R, coordinates, method=DEFAULT_INTERPOLATION_METHOD):
+    """Find window of raster layer needed to interpolate to points
+
+    Input
+        R: Raster data set (grid)
+        coordinates: Nx2 array of longitudes and latitudes
+        method: Interpolation method. One of INTERPOLATION_METHODS
+
+    Output
+        window: Tuple (xoffset, yoffset, xsize, ysize) of grid cells
+                covering the bounding box of the points plus a margin
+                depending on the interpolation method.
+                None if no points overlap the raster.
+    """
+
+    lon = coordinates[:, 0]
+    lat = coordinates[:, 1]
+
+    # Ignore undefined coordinates
+    valid = numpy.isfinite(lon) & numpy.isfinite(lat)
+    if not numpy.any(valid):
+        return None
+
+    lon = lon[valid]
+    lat = lat[valid]
+
+    bbox = [numpy.min(lon), numpy.min(lat), numpy.max(lon), numpy.max(lat)]
+    return bbox_to_window(R.get_geotransform(), R.rows, R.columns,
+                          bbox, margin=WINDOW_MARGIN[method])
+
+
+def interpolate_raster_points(R, coordinates,
+                              method=DEFAULT_INTERPOLATION_METHOD):
+    """Interpolate from raster layer to array of points
+
+    Only the window of the raster covering the points is read and used
+    for the interpolation.
+
+    Input
+        R: Raster data set (grid)
+        coordinates: Nx2 array of longitudes and latitudes
+        method: Interpolation method. One of INTERPOLATION_METHODS
+
+    Output
+        values: Array of N values interpolated from R.
+                Points outside the grid are assigned NaN.
+    """
+
+    # Input checks
+    assert R.is_raster
+
+    coordinates = numpy.array(coordinates, dtype='d', copy=False)
+    msg = ('Coordinates must be an Nx2 array of longitudes and latitudes. '
+           'I got shape %s' % str(coordinates.shape))
+    assert len(coordinates.shape) == 2 and coordinates.shape[1] == 2, msg
+
+    msg = ('Interpolation method must be one of %s. '
+           'I got %s' % (', '.join(INTERPOLATION_METHODS), method))
+    assert method in INTERPOLATION_METHODS, msg
 
-        msg = ('Requested interpolation latitude %f lies outside '
-               'interpolator bounds [%f, %f]. '
-               'Assigning NaN.' % (lat, self.minlat, self.maxlat))
-        if not self.minlat <= lat <= self.maxlat:
-            #print msg
-            return numpy.nan
+    # Find part of raster that is needed
+    window = points_window(R, coordinates, method)
+    if window is None:
+        # No points overlap the raster
+        values = numpy.empty(coordinates.shape[0], dtype='d')
+        values.fill(numpy.nan)
+        return values
 
-        return self.F(lat, lon)
+    # Create interpolator or reuse one fitted earlier
+    f = interpolator_cache.get(R, method, window)
 
+    # Interpolate all points in one call
+    return f(coordinates[:, 0], coordinates[:, 1])
 
-def interpolate_raster_vector(R, V, name=None):
+
+def interpolate_raster_vector(R, V, name=None,
+                              method=DEFAULT_INTERPOLATION_METHOD):
     """Interpolate from raster layer to point data
 
     Input
         R: Raster data set (grid)
-        V: Vector data set (points)
+        V: Vector data set (points, lines or polygons)
         name: Name for new attribute.
               If None (default) the name of R is used
+        method: Interpolation method. One of INTERPOLATION_METHODS
 
     Output
-        I: Vector data set; points located as V with values interpolated from R
+        I: Vector data set; features located as V with values interpolated
+           from R. Lines and polygons get the value at their centroid.
 
     """
 
@@ -104,34 +566,245 @@ def interpolate_raster_vector(R, V, name=None):
     assert R.is_raster
     assert V.is_vector
 
-    # Get raster data and corresponding x and y axes
+    # Get vector geometry and one point for each feature
+    geometry = V.get_geometry()
+    coordinates = V.get_centroids()
+
+    # Interpolate all points in one batch. Points outside the raster
+    # or with undefined coordinates get NaN.
+    values = interpolate_raster_points(R, coordinates, method)
+
+    # Create new attribute using layer name from raster
+    if name is None:
+        name = R.get_name()
+
+    attributes = {name: values}
+
+    return Vector(data=attributes, projection=V.get_projection(),
+                  geometry=geometry)
 
-    # FIXME (Ole): Replace NODATA with 0 until we can handle proper NaNs
-    A = R.get_data(nan=0.0)
-    longitudes, latitudes = R.get_geometry()
-    assert len(longitudes) == A.shape[1]
-    assert len(latitudes) == A.shape[0]
 
-    # Create interpolator
-    f = raster_spline(longitudes, latitudes, A)
+def interpolate_raster_raster(R, X, name=None,
+                              method=DEFAULT_INTERPOLATION_METHOD):
+    """Resample raster layer onto the grid of another raster layer
 
-    # Get vector geometry
-    coordinates = V.get_geometry()
+    Input
+        R: Raster data set (grid) to be resampled
+        X: Raster data set defining target grid. Its data is not used.
+        name: Name for resampled layer.
+              If None (default) the name of R is used
+        method: Resampling method. One of RESAMPLING_METHODS
+
+    Output
+        Raster layer with the geotransform and dimensions of X and values
+        resampled from R. Cells of X outside R are assigned NaN.
+
+    The target grid is processed in blocks of rows and only the window of
+    R needed for each block is read, so the full source grid is never held
+    in memory along with the result.
+    """
+
+    # Avoid circular import
+    from impact.storage.raster import Raster
+
+    # Input checks
+    assert R.is_raster
+    assert X.is_raster
+
+    msg = ('Resampling method must be one of %s. '
+           'I got %s' % (', '.join(RESAMPLING_METHODS), method))
+    assert method in RESAMPLING_METHODS, msg
+
+    msg = ('Projections of rasters %s and %s must be the same for '
+           'resampling' % (R.get_name(), X.get_name()))
+    assert R.projection == X.projection, msg
+
+    gs = R.get_geotransform()
+    gt = X.get_geotransform()
+    for g in [gs, gt]:
+        msg = 'Rotated grids are not supported. I got geotransform %s' % str(g)
+        assert g[2] == 0 and g[4] == 0, msg
+
+    if method in ['average', 'sum']:
+        # Overlap of target cells with source cells along each axis
+        Wx = overlap_matrix(gt[0], gt[1], X.columns,
+                            gs[0], gs[1], R.columns)
+        Wy = overlap_matrix(gt[3], gt[5], X.rows,
+                            gs[3], gs[5], R.rows)
+
+        # Source columns needed by any target cell
+        columns = numpy.flatnonzero(numpy.diff(Wx.indptr) > 0)
+        used = numpy.unique(Wx.indices)
+    else:
+        # Fractional source indices of target pixel centers along each axis
+        x = ((gt[0] + (numpy.arange(X.columns) + 0.5) * gt[1] - gs[0]) /
+             gs[1])
+        y = ((gt[3] + (numpy.arange(X.rows) + 0.5) * gt[5] - gs[3]) /
+             gs[5])
+        jx = axis_indices(x, R.columns, method)
+        iy = axis_indices(y, R.rows, method)
+
+        columns = numpy.flatnonzero(jx[0] >= 0)
+        used = numpy.concatenate([jx[0][columns], jx[1][columns]])
+
+    values = numpy.empty((X.rows, X.columns), dtype='d')
+    values.fill(numpy.nan)
+
+    if len(columns) == 0:
+        # No overlap between grids
+        return Raster(values, projection=X.get_projection(),
+                      geotransform=gt, name=name or R.get_name())
+
+    # Window of source columns common to all blocks
+    c0 = numpy.min(used)
+    c1 = numpy.max(used) + 1
+
+    # Size blocks so that both target and source blocks are bounded
+    ratio = max(abs(gt[5] / gs[5]), 1.0)
+    rows_per_block = max(1, POINTS_PER_BLOCK // max(X.columns,
+                                                    int(ratio * (c1 - c0))))
+
+    for start in range(0, X.rows, rows_per_block):
+        end = min(start + rows_per_block, X.rows)
+
+        if method in ['average', 'sum']:
+            Wb = Wy[start:end]
+            if Wb.nnz == 0:
+                continue
+
+            r0 = numpy.min(Wb.indices)
+            r1 = numpy.max(Wb.indices) + 1
+
+            # NODATA cells do not contribute to sums or averages
+            A = R.get_data(nan=True, window=(c0, r0, c1 - c0, r1 - r0),
+                           copy=False)
+            valid = numpy.isfinite(A)
+            A = numpy.where(valid, A, 0.0)
+
+            # Weighted sums over the overlap of each target cell
+            Wr = Wb[:, r0:r1]
+            Wc = Wx[:, c0:c1]
+            S = Wc.dot(Wr.dot(A).T).T
+            C = Wc.dot(Wr.dot(valid.astype('d')).T).T
+
+            block = values[start:end]
+            covered = C > 0
+            if method == 'sum':
+                block[covered] = S[covered]
+            else:
+                # Normalise by the area of valid source cells
+                block[covered] = S[covered] / C[covered]
+        else:
+            i0, i1, wy = [v[start:end] for v in iy]
+            rows = numpy.flatnonzero(i0 >= 0)
+            if len(rows) == 0:
+                continue
+
+            r0 = numpy.min(i0[rows])
+            r1 = numpy.max(i1[rows]) + 1
+
+            # FIXME (Ole): Replace NODATA with 0 until we can handle NaNs
+            A = R.get_data(nan=0.0, window=(c0, r0, c1 - c0, r1 - r0),
+                           copy=False)
+
+            I0 = i0[rows] - r0
+            J0 = jx[0][columns] - c0
+            if method == 'nearest':
+                B = A[numpy.ix_(I0, J0)]
+            else:
+                I1 = i1[rows] - r0
+                J1 = jx[1][columns] - c0
+                wx = jx[2][columns][numpy.newaxis, :]
+                w = wy[rows][:, numpy.newaxis]
+
+                B = ((1 - w) * ((1 - wx) * A[numpy.ix_(I0, J0)] +
+                                wx * A[numpy.ix_(I0, J1)]) +
+                     w * ((1 - wx) * A[numpy.ix_(I1, J0)] +
+                          wx * A[numpy.ix_(I1, J1)]))
+
+            values[numpy.ix_(rows + start, columns)] = B
 
-    # Interpolate and create new attribute
-    N = len(V)
-    attributes = []
     if name is None:
         name = R.get_name()
 
-    # FIXME (Ole): Profiling may suggest that his loop should be written in C
-    for i in range(N):
-        xi = coordinates[i, 0]   # Longitude
-        eta = coordinates[i, 1]  # Latitude
+    return Raster(values, projection=X.get_projection(),
+                  geotransform=gt, name=name)
 
-        # Use layer name from raster for new attribute
-        value = float(f(xi, eta))
-        attributes.append({name: value})
 
-    return Vector(data=attributes, projection=V.get_projection(),
-                  geometry=coordinates)
+def axis_indices(x, n, method):
+    """Source indices and weights along one axis for point resampling
+
+    Input
+        x: Fractional source grid indices of target pixel centers
+        n: Number of source grid cells along this axis
+        method: Either 'nearest' or 'bilinear'
+
+    Output
+        i0, i1: Indices of source cells to combine. Both are -1 for
+                target cells outside the source grid.
+        w: Weight of i1 in linear interpolation between i0 and i1
+    """
+
+    i0 = numpy.empty(len(x), dtype='i')
+    i0.fill(-1)
+    i1 = i0.copy()
+    w = numpy.zeros(len(x), dtype='d')
+
+    if method == 'nearest':
+        inside = (0 <= x) & (x <= n)
+        i0[inside] = numpy.minimum(x[inside].astype('i'), n - 1)
+        i1[inside] = i0[inside]
+    else:
+        # Indices relative to pixel centers
+        x = x - 0.5
+
+        eps = 1.0e-9
+        inside = (-eps <= x) & (x <= n - 1 + eps)
+        xi = numpy.clip(x[inside], 0, n - 1)
+
+        i0[inside] = numpy.minimum(xi.astype('i'), max(n - 2, 0))
+        i1[inside] = numpy.minimum(i0[inside] + 1, n - 1)
+        w[inside] = xi - i0[inside]
+
+    return i0, i1, w
+
+
+def overlap_matrix(origin_t, step_t, n_t, origin_s, step_s, n_s):
+    """Overlap between target and source grid cells along one axis
+
+    Input
+        origin_t, step_t, n_t: Origin, (signed) cell size and number of
+                               cells of the target axis
+        origin_s, step_s, n_s: Origin, (signed) cell size and number of
+                               cells of the source axis
+
+    Output
+        Sparse n_t x n_s matrix W where W[k, m] is the fraction of source
+        cell m covered by target cell k.
+    """
+
+    # Target cell edges in units of source cells
+    edges = (origin_t + numpy.arange(n_t + 1) * step_t - origin_s) / step_s
+    lo = numpy.minimum(edges[:-1], edges[1:])
+    hi = numpy.maximum(edges[:-1], edges[1:])
+
+    # Each target cell overlaps at most this many source cells
+    span = int(numpy.ceil(abs(step_t / step_s))) + 1
+
+    first = numpy.floor(lo).astype('i')
+    rows = []
+    cols = []
+    data = []
+    for d in range(span):
+        m = first + d
+        overlap = numpy.minimum(hi, m + 1) - numpy.maximum(lo, m)
+        keep = (overlap > 0) & (m >= 0) & (m < n_s)
+
+        rows.append(numpy.flatnonzero(keep))
+        cols.append(m[keep])
+        data.append(overlap[keep])
+
+    return sparse.csr_matrix((numpy.concatenate(data),
+                              (numpy.concatenate(rows),
+                               numpy.concatenate(cols))),
+                             shape=(n_t, n_s))
@@ -3,13 +3,12 @@ Basic plugin framework based on::
 http://martyalchin.com/2008/jan/10/simple-plugin-framework/
 """
 
-# FIXME (Ole): Surely we can do better than this.
-# What if a new hazard category appears?
-# It took me over one hour to find this
-from impact.plugins.earthquake import *
-from impact.plugins.tsunami import *
-from impact.plugins.flood import *
-from impact.plugins.tephra import *
 from impact.plugins.core import FunctionProvider
 from impact.plugins.core import get_plugins
 from impact.plugins.core import compatible_layers
+from impact.plugins.core import load_plugins
+
+# Plugin packages are listed in impact.plugins.manifest.PLUGIN_PACKAGES.
+# Their modules are imported here unless a plugin manifest was written
+# at install time in which case they are imported when used.
+load_plugins()
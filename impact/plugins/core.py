@@ -1,5 +1,9 @@
 from django.template.loader import render_to_string
 import types
+import ast
+
+from impact.plugins.manifest import PLUGIN_PACKAGES
+from impact.plugins.manifest import pretty_name, read_manifest
 
 ## See http://effbot.org/zone/metaclass-plugins.htm
 ## for a description of plugins
@@ -9,6 +13,26 @@ import types
 # FIXME (Ole): I think we should pass the module name to get_function to
 #              keep things together
 
+# Expressions allowed in plugin requirements
+REQUIREMENT_NODES = (ast.Expression, ast.BoolOp, ast.And, ast.Or,
+                     ast.UnaryOp, ast.Not, ast.Compare, ast.Eq, ast.NotEq,
+                     ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+                     ast.Is, ast.IsNot, ast.Name, ast.Load, ast.Str,
+                     ast.Num, ast.List, ast.Tuple)
+
+# String methods that can be called in plugin requirements
+REQUIREMENT_METHODS = ['startswith', 'endswith', 'lower', 'upper', 'strip']
+
+# Names available in plugin requirements besides layer keywords
+REQUIREMENT_GLOBALS = {'__builtins__': {},
+                       'True': True, 'False': False, 'None': None}
+
+# Index of the layers last matched against plugins (see get_layer_index)
+LAYER_INDEX_CACHE = {}
+
+# Plugins listed in the manifest (see load_plugins)
+LAZY_PLUGINS = []
+
 
 class PluginMount(type):
     def __init__(cls, name, bases, attrs):
@@ -37,9 +61,16 @@ class FunctionProvider:
     layers           A list of layers
     result           A list of layers
     ===============  =========================
+
+    Plugins computing one output feature per exposure feature independently
+    of the other features can set supports_chunks = True. They are then
+    run on chunks of exposure features so large layers need not be held
+    in memory.
     """
     __metaclass__ = PluginMount
 
+    supports_chunks = False
+
     @staticmethod
     def generate_style(data):
         params = {
@@ -60,16 +91,20 @@ def get_plugins(name=None):
        Or all of them if no name is passed.
     """
 
-    plugins_dict = dict([(pretty_function_name(p), p)
-                         for p in FunctionProvider.plugins])
+    # Plugins from the manifest are used until their modules are imported
+    plugins = list(FunctionProvider.plugins)
+    registered = set([(p.__module__, p.__name__) for p in plugins])
+    plugins.extend([p for p in LAZY_PLUGINS
+                    if (p.module, p.__name__) not in registered])
+
+    plugins_dict = dict([(pretty_function_name(p), p) for p in plugins])
 
     if name is None:
         return plugins_dict
 
     if isinstance(name, basestring):
         #Add the names
-        plugins_dict.update(dict([(p.__name__, p)
-                                  for p in FunctionProvider.plugins]))
+        plugins_dict.update(dict([(p.__name__, p) for p in plugins]))
 
         msg = ('No plugin named "%s" was found. '
                'List of available plugins is: %s'
@@ -90,18 +125,87 @@ def pretty_function_name(func):
     otherwise turn underscores to spaces and Caps to spaces """
 
     if not hasattr(func, 'plugin_name'):
-        nounderscore_name = func.__name__.replace('_', ' ')
-        func_name = ''
-        for i, c in enumerate(nounderscore_name):
-            if c.isupper() and i > 0:
-                func_name += ' ' + c
-            else:
-                func_name += c
+        func_name = pretty_name(func.__name__)
     else:
         func_name = func.plugin_name
     return func_name
 
 
+class LazyPlugin:
+    """Plugin listed in the manifest whose module is imported when used
+
+    The name, doc string (and thus requirements) and supports_chunks are
+    taken from the manifest so the plugin can be listed and matched
+    against layers without importing its module. Running the plugin or
+    accessing any other attribute imports the module and uses the plugin
+    class registered by it.
+    """
+
+    def __init__(self, entry):
+        """Create plugin from manifest entry (see impact.plugins.manifest)
+        """
+
+        self.__name__ = str(entry['class_name'])
+        self.__doc__ = entry['doc']
+        self.plugin_name = str(entry['name'])
+        self.module = str(entry['module'])
+        self.supports_chunks = entry['supports_chunks']
+        self.plugin = None
+
+    def __getattr__(self, name):
+        # Special names are looked up by Python itself, e.g. for hashing
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        return '<plugin %s.%s>' % (self.module, self.__name__)
+
+    def load(self):
+        """Import module of plugin
+
+        Output
+            Plugin class registered by the module
+        """
+
+        if self.plugin is None:
+            __import__(self.module)
+            for plugin in FunctionProvider.plugins:
+                if (plugin.__module__ == self.module and
+                    plugin.__name__ == self.__name__):
+                    self.plugin = plugin
+
+            msg = ('Plugin %s was not found in module %s. The plugin '
+                   'manifest may be out of date.'
+                   % (self.__name__, self.module))
+            assert self.plugin is not None, msg
+
+        return self.plugin
+
+    def run(self, layers):
+        return self.load().run(layers)
+
+    def generate_style(self, data):
+        return self.load().generate_style(data)
+
+
+def load_plugins():
+    """Make plugins available to get_plugins
+
+    If there is a plugin manifest (see impact.plugins.manifest), plugins
+    are taken from it and their modules are imported when the plugins are
+    run. Otherwise all plugin modules are imported now.
+    """
+
+    manifest = read_manifest()
+    if manifest is None:
+        for package in PLUGIN_PACKAGES:
+            __import__('impact.plugins.%s' % package)
+    else:
+        LAZY_PLUGINS[:] = [LazyPlugin(entry) for entry in manifest]
+
+
 def requirements_collect(func):
     """ Collect the requirements from the plugin function doc
 
@@ -116,14 +220,13 @@ def requirements_collect(func):
     Example of valid requires
     :param requires category=="impact" and subcategory.startswith("population"
     """
-    requireslines = None
+    requires_lines = []
     if hasattr(func, '__doc__') and func.__doc__:
         docstr = func.__doc__
 
         require_cmd = ':param requires'
 
         lines = docstr.split('\n')
-        requires_lines = []
 
         join_line = False
 
@@ -143,13 +246,152 @@ def requirements_collect(func):
     return requires_lines
 
 
-def requirement_check(params, require_str, verbose=False):
-    """Checks a dictionary params against the requirements defined
-    in require_str. Require_str must be a valid python expression
-    and evaluate to True or False"""
+def compile_requirement(require_str):
+    """Compile requirement expression to code evaluating it
+
+    Input
+        require_str: Python expression using layer keywords as names,
+                     e.g. category=="hazard" and layer_type=="raster"
+
+    Output
+        Code object to be evaluated by requirement_check
+
+    Only boolean operations, comparisons, names, literals and calls of
+    the string methods in REQUIREMENT_METHODS are allowed so evaluating
+    the expression cannot have side effects. Other expressions raise a
+    SyntaxError.
+    """
+
+    try:
+        tree = ast.parse(require_str.strip(), '<requirement>', 'eval')
+    except SyntaxError:
+        msg = 'Syntax error in plugin requirements header: %s' % require_str
+        raise SyntaxError(msg)
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            ok = (isinstance(node.func, ast.Attribute) and
+                  node.func.attr in REQUIREMENT_METHODS and
+                  len(node.keywords) == 0 and
+                  node.starargs is None and node.kwargs is None)
+        elif isinstance(node, ast.Attribute):
+            # Attributes are only allowed as methods checked above
+            ok = node.attr in REQUIREMENT_METHODS
+        else:
+            ok = isinstance(node, REQUIREMENT_NODES)
+
+        if not ok:
+            msg = ('Expression %s is not allowed in plugin requirements '
+                   'header: %s' % (node.__class__.__name__, require_str))
+            raise SyntaxError(msg)
+
+    return compile(tree, '<requirement>', 'eval')
+
+
+def get_requirements(func):
+    """Get compiled requirements of plugin
+
+    The requirements are collected from the plugin doc string and
+    compiled the first time and then kept on the plugin class.
+    """
+
+    # Look in the class itself as subclasses have their own doc strings
+    if 'compiled_requirements' not in func.__dict__:
+        func.compiled_requirements = [compile_requirement(requires)
+                                      for requires in
+                                      requirements_collect(func)]
+
+    return func.compiled_requirements
+
+
+def requirement_terms(require_str):
+    """Find keyword values required by requirement expression
+
+    Input
+        require_str: Requirement expression
+
+    Output
+        Dictionary mapping keyword names to sets of values. A layer can
+        only meet the requirement if the value of each of these keywords
+        is in its set. This holds for terms of the forms name == value
+        and name in [values] joined by 'and' at the top level of the
+        expression. Other terms are not included.
+    """
+
+    tree = ast.parse(require_str.strip(), '<requirement>', 'eval')
+    if (isinstance(tree.body, ast.BoolOp) and
+        isinstance(tree.body.op, ast.And)):
+        conditions = tree.body.values
+    else:
+        conditions = [tree.body]
+
+    terms = {}
+    for condition in conditions:
+        if not (isinstance(condition, ast.Compare) and
+                len(condition.ops) == 1):
+            continue
+
+        left = condition.left
+        op = condition.ops[0]
+        right = condition.comparators[0]
+
+        if isinstance(op, ast.Eq) and isinstance(right, ast.Name):
+            left, right = right, left
+
+        if not isinstance(left, ast.Name):
+            continue
+
+        if isinstance(op, ast.Eq):
+            values = [right]
+        elif (isinstance(op, ast.In) and
+              isinstance(right, (ast.List, ast.Tuple))):
+            values = right.elts
+        else:
+            continue
+
+        if not all([isinstance(value, (ast.Str, ast.Num))
+                    for value in values]):
+            continue
+
+        values = set([literal_value(value) for value in values])
+        if left.id in terms:
+            terms[left.id] &= values
+        else:
+            terms[left.id] = values
+
+    return terms
 
-    execstr = 'def check():\n'
 
+def literal_value(node):
+    """Value of string or number in syntax tree
+    """
+
+    if isinstance(node, ast.Str):
+        return node.s
+    else:
+        return node.n
+
+
+def get_requirement_terms(func):
+    """Get keyword values required by each requirement of plugin
+
+    Terms (see requirement_terms) are found the first time and then kept
+    on the plugin class.
+    """
+
+    if 'requirement_terms' not in func.__dict__:
+        func.requirement_terms = [requirement_terms(requires)
+                                  for requires in
+                                  requirements_collect(func)]
+
+    return func.requirement_terms
+
+
+def requirement_namespace(params):
+    """Get names for evaluating requirements from layer keywords
+    """
+
+    namespace = {}
     for key in params.keys():
         if key == '':
             if params[''] != '':
@@ -160,27 +402,34 @@ def requirement_check(params, require_str, verbose=False):
             else:
                 continue
 
-        if type(params[key]) == type(''):  # is it a string param
-            execstr += '  %s = "%s" \n' % (key.strip(), params[key])
-        else:
-            execstr += '  %s = %s \n' % (key.strip(), params[key])
+        namespace[key.strip()] = params[key]
+
+    return namespace
+
+
+def requirement_check(params, require_str, verbose=False):
+    """Checks a dictionary params against the requirements defined
+    in require_str. Require_str must be a valid python expression
+    and evaluate to True or False. It can also be a requirement compiled
+    with compile_requirement.
 
-    execstr += '  return ' + require_str
+    Keyword values are looked up as names rather than written into
+    source code so any value is safe to use.
+    """
+
+    if isinstance(require_str, basestring):
+        require_str = compile_requirement(require_str)
 
     if verbose:
-        print execstr
+        print params
+
     try:
-        exec(compile(execstr, '<string>', 'exec'))
-        return check()
-    except NameError:
-        pass
-    except SyntaxError:
-        # TODO(Ted and Ole): This exceptions should be handle by the callee
-        #                    as we don't want errors in plugins to
-        #                    crash the system.
-        msg = 'Syntax error in plugin requirements header: %s' % execstr
-        raise SyntaxError(msg)
-    return False
+        return bool(eval(require_str, REQUIREMENT_GLOBALS,
+                         requirement_namespace(params)))
+    except (NameError, AttributeError, TypeError):
+        # Missing keywords or keywords with values of the wrong type
+        # do not meet the requirement
+        return False
 
 
 def requirements_met(requirements, params, verbose=False):
@@ -197,7 +446,7 @@ def requirements_met(requirements, params, verbose=False):
         return True
 
     for requires in requirements:
-        if requirement_check(params, requires):
+        if requirement_check(params, requires, verbose=verbose):
             return True
 
     # If none of the conditions above is met, return False.
@@ -212,10 +461,125 @@ def compatible_layers(func, layers_data):
            Array of compatible layers, can be an empty list.
     """
     layers = []
-    requirements = requirements_collect(func)
+    requirements = get_requirements(func)
 
     for layer_name, layer_params in layers_data:
         if requirements_met(requirements, layer_params):
             layers.append(layer_name)
 
     return layers
+
+
+class LayerIndex:
+    """Index of layers by their keywords for matching plugins
+
+    Layers are indexed by the values of their keywords (e.g. category,
+    subcategory, layer_type, unit and title). Only layers with the values
+    required by a plugin requirement (see requirement_terms) are
+    candidates for it and the requirement is evaluated for these only.
+    Compatible layers are kept for each plugin.
+    """
+
+    def __init__(self, layers_data):
+        """Build index
+
+        Input
+            layers_data: List of pairs of layer name and dictionary of
+                         keywords as given by get_layers_metadata
+        """
+
+        self.names = []
+        self.namespaces = []
+        self.index = {}
+        self.results = {}
+
+        for i, (name, params) in enumerate(layers_data):
+            namespace = requirement_namespace(params)
+            self.names.append(name)
+            self.namespaces.append(namespace)
+
+            for key, value in namespace.items():
+                values = self.index.setdefault(key, {})
+                values.setdefault(value, []).append(i)
+
+    def __len__(self):
+        """Number of layers
+        """
+        return len(self.names)
+
+    def get_candidates(self, terms):
+        """Get layers with keyword values required by terms
+
+        Input
+            terms: Dictionary of keyword names and sets of values
+
+        Output
+            Sorted list of indices of layers
+        """
+
+        candidates = None
+        for key, values in terms.items():
+            layers = set()
+            for value in values:
+                layers.update(self.index.get(key, {}).get(value, []))
+
+            if candidates is None:
+                candidates = layers
+            else:
+                candidates &= layers
+
+        if candidates is None:
+            return range(len(self))
+        else:
+            return sorted(candidates)
+
+    def compatible_layers(self, func):
+        """Fetches all the layers that match the plugin requirements.
+
+           Returns:
+
+               Array of compatible layers, can be an empty list.
+        """
+
+        if func not in self.results:
+            requirements = get_requirements(func)
+            if len(requirements) == 0:
+                # If the function has no requirements, all layers match
+                matches = range(len(self))
+            else:
+                matches = set()
+                for requires, terms in zip(requirements,
+                                           get_requirement_terms(func)):
+                    for i in self.get_candidates(terms):
+                        if i in matches:
+                            continue
+
+                        if requirement_check(self.namespaces[i], requires):
+                            matches.add(i)
+
+            self.results[func] = [self.names[i] for i in sorted(matches)]
+
+        return self.results[func]
+
+
+def get_layer_index(layers_data):
+    """Get index of layers reusing the last index for the same layers
+
+    Input
+        layers_data: List of pairs of layer name and dictionary of
+                     keywords as given by get_layers_metadata
+
+    Output
+        LayerIndex of layers. The index and thus the compatible layers
+        found for each plugin are reused as long as the layers and their
+        keywords are unchanged.
+    """
+
+    snapshot = tuple([(name, tuple(sorted(params.items())))
+                      for name, params in layers_data])
+
+    if LAYER_INDEX_CACHE.get('snapshot') != snapshot:
+        LAYER_INDEX_CACHE['snapshot'] = snapshot
+        LAYER_INDEX_CACHE['index'] = LayerIndex(layers_data)
+
+    return LAYER_INDEX_CACHE['index']
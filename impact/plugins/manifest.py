@@ -0,0 +1,183 @@
+"""Manifest of plugins
+
+The manifest lists the name, doc string (with the requirements), module
+and class of each plugin. It is found by parsing the plugin modules
+without importing them, written at install time (see setup.py) and read
+at startup so that plugins can be listed and matched against layers
+before their modules are imported.
+
+This module only uses the standard library so that setup.py can load it
+without the dependencies of the plugins.
+"""
+
+import os
+import ast
+import json
+
+# Packages of plugins. Their plugin modules are those imported by
+# the __init__.py of each package.
+PLUGIN_PACKAGES = ['earthquake', 'tsunami', 'flood', 'tephra']
+
+# Default location of manifest
+PLUGINS_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_FILENAME = os.path.join(PLUGINS_DIR, 'plugin_manifest.json')
+
+
+def pretty_name(class_name):
+    """Turn class name into human readable name
+
+    Underscores and capital letters are turned into spaces,
+    e.g. FloodImpactFunction becomes Flood Impact Function
+    """
+
+    nounderscore_name = class_name.replace('_', ' ')
+    name = ''
+    for i, c in enumerate(nounderscore_name):
+        if c.isupper() and i > 0:
+            name += ' ' + c
+        else:
+            name += c
+    return name
+
+
+def find_plugin_modules(plugins_dir=PLUGINS_DIR):
+    """Find modules of plugins in plugin packages
+
+    Input
+        plugins_dir: Directory of package impact.plugins
+
+    Output
+        List of pairs of module name and filename
+    """
+
+    modules = []
+    for package in PLUGIN_PACKAGES:
+        package_name = 'impact.plugins.%s' % package
+        package_dir = os.path.join(plugins_dir, package)
+        tree = parse_file(os.path.join(package_dir, '__init__.py'))
+
+        for node in tree.body:
+            if (isinstance(node, ast.ImportFrom) and
+                node.module == package_name):
+                for alias in node.names:
+                    modules.append(('%s.%s' % (package_name, alias.name),
+                                    os.path.join(package_dir,
+                                                 alias.name + '.py')))
+
+    return modules
+
+
+def find_plugins(filename, module):
+    """Find plugins defined in module
+
+    Input
+        filename: Name of Python source file of module
+        module: Name of module
+
+    Output
+        List of manifest entries. Each entry is a dictionary with keys
+        name, class_name, module, doc and supports_chunks.
+
+    Plugins are classes deriving directly from FunctionProvider. Class
+    attributes plugin_name and supports_chunks are read if they are
+    given as literals.
+    """
+
+    entries = []
+    for node in parse_file(filename).body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+
+        bases = [base.id if isinstance(base, ast.Name) else
+                 getattr(base, 'attr', None) for base in node.bases]
+        if 'FunctionProvider' not in bases:
+            continue
+
+        attributes = {}
+        for statement in node.body:
+            if (isinstance(statement, ast.Assign) and
+                len(statement.targets) == 1 and
+                isinstance(statement.targets[0], ast.Name)):
+                try:
+                    value = ast.literal_eval(statement.value)
+                except ValueError:
+                    continue
+                attributes[statement.targets[0].id] = value
+
+        entries.append({'name': attributes.get('plugin_name',
+                                               pretty_name(node.name)),
+                        'class_name': node.name,
+                        'module': module,
+                        'doc': ast.get_docstring(node, clean=False),
+                        'supports_chunks': bool(attributes.get(
+                            'supports_chunks', False))})
+
+    return entries
+
+
+def build_manifest(plugins_dir=PLUGINS_DIR):
+    """Build manifest of all plugins
+
+    Input
+        plugins_dir: Directory of package impact.plugins
+
+    Output
+        List of manifest entries (see find_plugins)
+    """
+
+    manifest = []
+    for module, filename in find_plugin_modules(plugins_dir):
+        manifest.extend(find_plugins(filename, module))
+
+    return manifest
+
+
+def write_manifest(filename=MANIFEST_FILENAME, plugins_dir=PLUGINS_DIR):
+    """Build manifest of plugins and write it to file
+
+    Input
+        filename: Name of manifest file
+        plugins_dir: Directory of package impact.plugins
+    """
+
+    manifest = build_manifest(plugins_dir)
+
+    fid = open(filename, 'w')
+    try:
+        json.dump(manifest, fid, indent=4, sort_keys=True)
+    finally:
+        fid.close()
+
+
+def read_manifest(filename=MANIFEST_FILENAME):
+    """Read manifest of plugins
+
+    Input
+        filename: Name of manifest file
+
+    Output
+        List of manifest entries (see find_plugins) or None if there
+        is no manifest
+    """
+
+    if not os.path.isfile(filename):
+        return None
+
+    fid = open(filename)
+    try:
+        return json.load(fid)
+    finally:
+        fid.close()
+
+
+def parse_file(filename):
+    """Parse Python source file into syntax tree
+    """
+
+    fid = open(filename)
+    try:
+        source = fid.read()
+    finally:
+        fid.close()
+
+    return ast.parse(source, filename)
@@ -1,12 +1,13 @@
 
 import numpy
 import scipy
+from collections import OrderedDict
 
 from django.template.loader import render_to_string
 from impact.plugins.core import FunctionProvider
 
 from impact.engine.utilities import MAXFLOAT
-from impact.plugins.utilities import Damage_curve
+from impact.plugins.utilities import Damage_curve, Damage_curve_family
 from impact.storage.vector import Vector
 
 #------------------------------------------------------------
@@ -39,6 +40,10 @@ struct_damage_curve = {'Double brick': Damage_curve([[-MAXFLOAT, 0.0],
                                                [2.0, 0.955],
                                                [MAXFLOAT, 99.4]])}
 
+# Curves by wall type. Unknown wall types get the curve for Brick veneer.
+struct_damage_curves = Damage_curve_family(struct_damage_curve,
+                                           default='Brick veneer')
+
 contents_damage_curve = Damage_curve([[-MAXFLOAT, 0.0],
                                       [0.0, 0.013],
                                       [0.1, 0.102],
@@ -61,6 +66,9 @@ class TsunamiBuildingLossFunction(FunctionProvider):
                     layer_type=="feature"
     """
 
+    # Buildings are assessed independently of each other
+    supports_chunks = True
+
     @staticmethod
     def run(layers):
         """Risk plugin for tsunami building damage
@@ -73,84 +81,72 @@ class TsunamiBuildingLossFunction(FunctionProvider):
         E = layers[1]  # Building locations
 
         # Interpolate hazard level to building locations
-        H = H.interpolate(E)
+        H = H.interpolate(E, name='DEPTH')
 
-        # Extract relevant numerical data
+        # Extract relevant numerical data for all buildings
         coordinates = E.get_geometry()
-        inundation = H.get_data()
-
-        # Calculate
-        N = len(H)
-        impact = []
-        for i in range(N):
-
-            #-------------------
-            # Extract parameters
-            #-------------------
-            depth = float(inundation[i].values()[0])
-            shore_distance = E.get_data('SHORE_DIST', i)
-
-            # FIXME: Get rid of the type casting when
-            #        issue #66 is done
-            number_of_people_in_building = int(E.get_data('NEXIS_PEOP', i))
-            wall_type = E.get_data('WALL_TYPE', i)
-            contents_value = E.get_data('CONT_VALUE', i)
-            structure_value = E.get_data('STR_VALUE', i)
-
-            #------------------------
-            # Compute people affected
-            #------------------------
-            if 0.01 < depth < 1.0:
-                people_affected = number_of_people_in_building
-            else:
-                people_affected = 0
-
-            if depth >= 1.0:
-                people_severely_affected = number_of_people_in_building
-            else:
-                people_severely_affected = 0
-
-            #----------------------------------------
-            # Compute impact on buldings and contents
-            #----------------------------------------
-            depth_floor = depth - 0.3  # Adjust for floor height
-
-            if depth_floor >= 0.0:
-                buildings_inundated = 1
-            else:
-                buildings_inundated = 0
-
-            if depth_floor < 0.0:
-                structural_damage = contents_damage = 0.0
-            else:
-                # Water is deep enough to cause damage
-                if wall_type in struct_damage_curve:
-                    curve = struct_damage_curve[wall_type]
-                else:
-                    # Establish default for unknown wall type
-                    curve = struct_damage_curve['Brick veneer']
-
-                structural_damage = curve(depth_floor)
-                contents_damage = contents_damage_curve(depth_floor)
-
-            #---------------
-            # Compute losses
-            #---------------
-            structural_loss = structural_damage * structure_value
-            contents_loss = contents_damage * contents_value
-
-            #-------
-            # Return
-            #-------
-            impact.append({'NEXIS_PEOP': number_of_people_in_building,
-                           'PEOPLE_AFFECTED': people_affected,
-                           'PEOPLE_SEV_AFFECTED': people_severely_affected,
-                           'STRUCT_INUNDATED': buildings_inundated,
-                           'STRUCT_DAMAGE_fraction': structural_damage,
-                           'CONTENTS_DAMAGE_fraction': contents_damage,
-                           'STRUCT_LOSS_AUD': structural_loss,
-                           'CONTENTS_LOSS_AUD': contents_loss,
-                           'DEPTH': depth})
+        depth = numpy.array(H.get_data('DEPTH'), dtype='d')
+
+        # FIXME: Get rid of the type casting when
+        #        issue #66 is done
+        number_of_people_in_building = numpy.array(E.get_data('NEXIS_PEOP'),
+                                                   dtype='i')
+        wall_type = E.get_data('WALL_TYPE')
+        contents_value = numpy.array(E.get_data('CONT_VALUE'), dtype='d')
+        structure_value = numpy.array(E.get_data('STR_VALUE'), dtype='d')
+
+        # Buildings where the depth is unknown (NaN) are neither affected
+        # nor inundated and their damage is unknown
+        unknown = numpy.isnan(depth)
+        known_depth = numpy.where(unknown, -MAXFLOAT, depth)
+
+        #------------------------
+        # Compute people affected
+        #------------------------
+        people_affected = numpy.where((0.01 < known_depth) &
+                                      (known_depth < 1.0),
+                                      number_of_people_in_building, 0)
+        people_severely_affected = numpy.where(known_depth >= 1.0,
+                                               number_of_people_in_building,
+                                               0)
+
+        #----------------------------------------
+        # Compute impact on buldings and contents
+        #----------------------------------------
+        depth_floor = known_depth - 0.3  # Adjust for floor height
+        wet = depth_floor >= 0.0
+        buildings_inundated = wet.astype('i')
+
+        # Water is deep enough to cause damage where wet
+        structural_damage = numpy.zeros(len(depth))
+        structural_damage[wet] = struct_damage_curves(depth_floor[wet],
+                                                      wall_type[wet])
+
+        contents_damage = numpy.zeros(len(depth))
+        contents_damage[wet] = contents_damage_curve(depth_floor[wet])
+
+        structural_damage[unknown] = numpy.nan
+        contents_damage[unknown] = numpy.nan
+
+        #---------------
+        # Compute losses
+        #---------------
+        structural_loss = structural_damage * structure_value
+        contents_loss = contents_damage * contents_value
+
+        #-------
+        # Return
+        #-------
+        impact = OrderedDict()
+        impact['NEXIS_PEOP'] = number_of_people_in_building
+        impact['PEOPLE_AFFECTED'] = people_affected
+        impact['PEOPLE_SEV_AFFECTED'] = people_severely_affected
+        impact['STRUCT_INUNDATED'] = buildings_inundated
+        impact['STRUCT_DAMAGE_fraction'] = structural_damage
+        impact['CONTENTS_DAMAGE_fraction'] = contents_damage
+        impact['STRUCT_LOSS_AUD'] = structural_loss
+        impact['CONTENTS_LOSS_AUD'] = contents_loss
+        impact['DEPTH'] = depth
 
         # FIXME (Ole): Need helper to generate new layer using
         #              correct spatial reference
@@ -2,17 +2,23 @@
 """
 
 import numpy
-from scipy.interpolate import interp1d
 
 
 class Damage_curve:
     """Class for implementation of damage curves based on point data
+
+    The curve is piecewise linear between the points and is evaluated
+    for scalars or whole arrays with numpy.interp. Values outside the
+    range of the points are not allowed while NaN gives NaN.
+
+    Curves hold only numpy arrays so they can be pickled and passed to
+    worker processes.
     """
 
     def __init__(self, data):
 
         try:
-            data = numpy.array(data)
+            data = numpy.array(data, dtype='d')
         except:
             msg = 'Could not convert data %s to damage curve' % str(data)
             raise Exception(msg)
@@ -23,10 +29,149 @@ class Damage_curve:
         msg = 'Damage curve data must have two columns'
         assert data.shape[1] == 2, msg
 
-        x = data[:, 0]
-        y = data[:, 1]
+        # Points ordered by increasing x
+        order = numpy.argsort(data[:, 0], kind='mergesort')
+        self.x = data[order, 0]
+        self.y = data[order, 1]
+
+    def __call__(self, x):
+        x = numpy.asarray(x, dtype='d')
+        check_range(x, self.x[0], self.x[-1])
+        return numpy.interp(x, self.x, self.y)
+
+    def tabulate(self, start, stop, step):
+        """Get lookup table of curve for inputs of fixed resolution
+
+        Input
+            start, stop: Range of inputs covered by the table
+            step: Resolution of inputs, e.g. of depths stored in cm
 
-        self.curve = interp1d(x, y)
+        Output
+            Damage_lookup_table with the curve evaluated at start,
+            start + step, ..., stop
+        """
+
+        return Damage_lookup_table(self, start, stop, step)
+
+
+class Damage_lookup_table:
+    """Damage curve tabulated at inputs of fixed resolution
+
+    Inputs are rounded to the nearest tabulated input so evaluation is
+    a single array lookup. This is exact for inputs on the grid, such as
+    depths measured in whole centimetres, and approximate otherwise.
+    """
+
+    def __init__(self, curve, start, stop, step):
+
+        msg = ('Lookup table must have a positive step and stop after '
+               'start. I got start=%s, stop=%s, step=%s'
+               % (start, stop, step))
+        assert step > 0 and stop > start, msg
+
+        self.start = float(start)
+        self.step = float(step)
+        n = int(numpy.round((stop - start) / self.step)) + 1
+        self.values = curve(self.start + self.step * numpy.arange(n))
 
     def __call__(self, x):
-        return self.curve(x)
+        x = numpy.asarray(x, dtype='d')
+        check_range(x, self.start,
+                    self.start + self.step * (len(self.values) - 1))
+
+        index = numpy.rint((x.ravel() - self.start) / self.step)
+        missing = numpy.isnan(index)
+        index[missing] = 0
+        result = self.values.take(index.astype('l'))
+        result[missing] = numpy.nan
+
+        if x.ndim == 0:
+            return result.item()
+        return result.reshape(x.shape)
+
+
+class Damage_curve_family:
+    """Damage curves for categories such as wall types of buildings
+
+    The family is evaluated for arrays of inputs and categories at once
+    with each curve applied to the inputs of its category.
+    """
+
+    def __init__(self, curves, default=None):
+        """Initialise family of curves
+
+        Input
+            curves: Dictionary of Damage_curve (or Damage_lookup_table)
+                    instances keyed by category
+            default: Optional category whose curve is used for categories
+                     not in curves. If None, such categories are an error.
+        """
+
+        msg = ('Default category %s was not among the categories %s'
+               % (default, curves.keys()))
+        assert default is None or default in curves, msg
+
+        self.curves = curves
+        self.default = default
+
+    def __getitem__(self, category):
+        return self.curves[category]
+
+    def __call__(self, x, categories):
+        """Evaluate curves of categories
+
+        Input
+            x: Array of inputs
+            categories: Array of categories of same length as x
+
+        Output
+            Array of values of the curve of each category
+        """
+
+        x = numpy.asarray(x, dtype='d')
+        categories = numpy.asarray(categories)
+
+        msg = ('Inputs and categories must have the same length. I got '
+               '%i and %i' % (len(x), len(categories)))
+        assert len(x) == len(categories), msg
+
+        result = numpy.empty(len(x))
+        unmatched = numpy.ones(len(x), dtype=bool)
+        for name, curve in self.curves.items():
+            mask = categories == name
+            unmatched &= ~mask
+            result[mask] = curve(x[mask])
+
+        if numpy.any(unmatched):
+            msg = ('No damage curve for categories %s. Categories are %s'
+                   % (', '.join([str(c) for c in
+                                 set(categories[unmatched])]),
+                      ', '.join([str(c) for c in self.curves.keys()])))
+            assert self.default is not None, msg
+
+            curve = self.curves[self.default]
+            result[unmatched] = curve(x[unmatched])
+
+        return result
+
+
+def check_range(x, lower, upper):
+    """Check that values are within range of damage curve
+
+    NaN is allowed and gives NaN.
+    """
+
+    if x.size == 0:
+        return
+
+    # Extrema are NaN if there are NaN values
+    if numpy.isnan(numpy.min(x)):
+        x = x[~numpy.isnan(x)]
+        if x.size == 0:
+            return
+
+    if numpy.min(x) < lower or numpy.max(x) > upper:
+        msg = ('Damage curve defined for values between %f and %f was '
+               'evaluated for values between %f and %f'
+               % (lower, upper, numpy.min(x), numpy.max(x)))
+        raise ValueError(msg)
@@ -0,0 +1,218 @@
+"""Class AttributeTable
+"""
+
+import numpy
+from collections import OrderedDict
+
+
+class AttributeTable:
+    """Columnar storage of vector layer attributes
+
+    Each field is held as one numpy array with one entry per feature.
+    Numeric fields are stored in typed arrays while other fields (strings,
+    fields with missing values etc) are stored in arrays of Python objects.
+
+    Indexing and iteration present the table as the list of dictionaries
+    of fields, one per feature, used by earlier versions of Vector.
+    These dictionaries are created on demand so modifying them does not
+    change the table.
+    """
+
+    def __init__(self, data=None):
+        """Initialise table from columns or records
+
+        Input
+            data: Can be either
+                * an AttributeTable (columns are shared)
+                * a dictionary of field names and sequences of values
+                * a sequence of dictionaries of fields, one per feature
+                * None
+        """
+
+        self.columns = OrderedDict()
+        self.size = 0
+
+        if data is None:
+            return
+
+        if isinstance(data, AttributeTable):
+            columns = data.columns
+            self.size = data.size
+        elif isinstance(data, dict):
+            columns = data
+        else:
+            # Sequence of dictionaries
+            data = list(data)
+            if len(data) == 0:
+                return
+
+            msg = ('Attributes must be given as dictionaries of fields. '
+                   'The first element is %s' % str(data[0]))
+            assert isinstance(data[0], dict), msg
+
+            columns = OrderedDict()
+            for name in data[0]:
+                columns[name] = [record.get(name) for record in data]
+
+        for name in columns:
+            column = make_column(columns[name])
+
+            if len(self.columns) == 0:
+                self.size = len(column)
+
+            msg = ('Field %s has %i values but other fields have %i'
+                   % (name, len(column), self.size))
+            assert len(column) == self.size, msg
+
+            self.columns[name] = column
+
+    def __len__(self):
+        """Number of features
+        """
+        return self.size
+
+    def __getitem__(self, i):
+        """Get dictionary of fields of feature i
+
+        If i is a slice, a list of dictionaries is returned.
+        """
+
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.size))]
+
+        if i < 0:
+            i += self.size
+
+        if not 0 <= i < self.size:
+            msg = ('Feature index %i out of range for table with %i '
+                   'features' % (i, self.size))
+            raise IndexError(msg)
+
+        fields = {}
+        for name, column in self.columns.items():
+            fields[name] = python_value(column[i])
+
+        return fields
+
+    def __iter__(self):
+        """Iterate over dictionaries of fields, one per feature
+        """
+
+        names = self.keys()
+        values = [column.tolist() for column in self.columns.values()]
+        for row in zip(*values):
+            yield dict(zip(names, row))
+
+    def keys(self):
+        """Get field names
+        """
+        return self.columns.keys()
+
+    def take(self, indices):
+        """Get new table with selected features
+
+        Input
+            indices: Array of feature indices or boolean mask
+
+        Output
+            AttributeTable with the selected features in the given order
+        """
+
+        columns = OrderedDict()
+        for name, column in self.columns.items():
+            columns[name] = column[indices]
+
+        return AttributeTable(columns)
+
+
+def make_column(values, dtype=None):
+    """Convert sequence of values to column of attribute table
+
+    Input
+        values: Sequence of values of one field
+        dtype: Optional numpy data type of field, e.g. from its OGR type.
+               If None, the type is inferred from the values.
+
+    Output
+        1d numpy array. Integers, floats and booleans are stored in typed
+        arrays. Any other values are stored in an array of objects where
+        strings are interned so that repeated values share memory.
+        This includes fields of given dtype with missing values (None).
+    """
+
+    if isinstance(values, numpy.ndarray) and values.ndim == 1:
+        return values
+
+    values = list(values)
+    if dtype is not None and None not in values:
+        return numpy.array(values, dtype=dtype)
+
+    if len(values) > 0:
+        A = numpy.array(values)
+        if A.ndim == 1 and A.dtype.kind in 'biuf':
+            return A
+
+    column = numpy.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        if type(value) is str:
+            value = intern(value)
+        column[i] = value
+
+    return column
+
+
+def python_value(value):
+    """Convert numpy scalar to the corresponding Python value
+    """
+
+    if isinstance(value, numpy.generic):
+        return value.item()
+    else:
+        return value
+
+
+def compare_columns(x, y, rtol=1.0e-5, atol=1.0e-8):
+    """Find entries that differ between two columns of equal length
+
+    Input
+        x, y: Columns of attribute tables
+        rtol, atol: Relative and absolute tolerance for floating point
+                    values. See numpy.allclose for details
+
+    Output
+        Boolean array which is True where values differ.
+
+    Integer, boolean and string values must be equal. Floating point values
+    are compared with tolerances and NaN is equal to NaN so that missing
+    values compare equal.
+    """
+
+    msg = ('Columns must have the same length. I got %i and %i'
+           % (len(x), len(y)))
+    assert len(x) == len(y), msg
+
+    if x.dtype.kind in 'biu' and y.dtype.kind in 'biu':
+        return x != y
+
+    if x.dtype.kind in 'biuf' and y.dtype.kind in 'biuf':
+        return ~numpy.isclose(x, y, rtol=rtol, atol=atol, equal_nan=True)
+
+    # Columns of objects. Compare exactly and then compare the few
+    # unequal numbers with tolerances.
+    differ = numpy.asarray(numpy.not_equal(x, y), dtype=bool)
+    for i in numpy.nonzero(differ)[0]:
+        a = x[i]
+        b = y[i]
+        if is_number(a) and is_number(b):
+            differ[i] = not numpy.isclose(a, b, rtol=rtol, atol=atol,
+                                          equal_nan=True)
+
+    return differ
+
+
+def is_number(value):
+    """Check if value is an integer or floating point number
+    """
+
+    return (isinstance(value, (int, long, float, numpy.number)) and
+            not isinstance(value, bool))
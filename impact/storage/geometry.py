@@ -0,0 +1,581 @@
+"""Class PackedGeometry
+"""
+
+import numpy
+from osgeo import ogr
+
+# Map between OGR geometry types and geometry types of vector layers
+GEOMETRY_TYPE_MAP = {ogr.wkbPoint: 'point',
+                     ogr.wkbLineString: 'line',
+                     ogr.wkbMultiLineString: 'line',
+                     ogr.wkbPolygon: 'polygon',
+                     ogr.wkbMultiPolygon: 'polygon'}
+
+# Map between geometry types of vector layers and OGR layer types
+OGR_GEOMETRY_MAP = {'point': ogr.wkbPoint,
+                    'line': ogr.wkbLineString,
+                    'polygon': ogr.wkbPolygon}
+
+
+class PackedGeometry:
+    """Line or polygon geometries of vector layer stored in flat arrays
+
+    All vertices are held in one Mx2 array of longitudes and latitudes.
+    Each feature consists of one or more parts (line strings or polygon
+    rings) with consecutive vertices:
+
+    * Vertices of part j are vertices[part_offsets[j]:part_offsets[j + 1]]
+    * Parts of feature i are parts feature_offsets[i]:feature_offsets[i + 1]
+    * holes[j] is True if part j is an interior ring of a polygon
+
+    The exterior ring of a polygon comes before its holes so a feature
+    with several exterior rings is a multipolygon.
+
+    Indexing with an integer gives the list of parts of one feature as
+    Kx2 arrays. Indexing with a slice, an index array or a boolean mask
+    gives a new PackedGeometry with the selected features.
+    """
+
+    def __init__(self, vertices, part_offsets, feature_offsets,
+                 geometry_type, holes=None):
+        """Initialise geometry from packed arrays
+
+        Input
+            vertices: Mx2 array of vertex coordinates
+            part_offsets: Array of P + 1 indices into vertices
+            feature_offsets: Array of N + 1 indices into parts
+            geometry_type: Either 'line' or 'polygon'
+            holes: Optional boolean array of P entries flagging interior
+                   rings. If None, no part is a hole.
+        """
+
+        msg = ('Geometry type must be either line or polygon. '
+               'I got %s' % geometry_type)
+        assert geometry_type in ['line', 'polygon'], msg
+
+        self.geometry_type = geometry_type
+        self.vertices = numpy.array(vertices, dtype='d',
+                                    copy=False).reshape((-1, 2))
+        self.part_offsets = numpy.array(part_offsets, dtype='l', copy=False)
+        self.feature_offsets = numpy.array(feature_offsets, dtype='l',
+                                           copy=False)
+
+        P = len(self.part_offsets) - 1
+        if holes is None:
+            self.holes = numpy.zeros(P, dtype=bool)
+        else:
+            self.holes = numpy.array(holes, dtype=bool, copy=False)
+
+        msg = ('Part offsets must start at 0 and end at the number of '
+               'vertices %i. I got %s' % (len(self.vertices),
+                                          self.part_offsets))
+        assert self.part_offsets[0] == 0, msg
+        assert self.part_offsets[-1] == len(self.vertices), msg
+
+        msg = ('Feature offsets must start at 0 and end at the number of '
+               'parts %i. I got %s' % (P, self.feature_offsets))
+        assert self.feature_offsets[0] == 0, msg
+        assert self.feature_offsets[-1] == P, msg
+
+        msg = 'Hole flags must be given for all %i parts' % P
+        assert len(self.holes) == P, msg
+
+    def __len__(self):
+        """Number of features
+        """
+        return len(self.feature_offsets) - 1
+
+    def __getitem__(self, i):
+        """Get parts of feature i
+
+        If i is a slice or an array, a PackedGeometry is returned.
+        """
+
+        if not isinstance(i, (int, long, numpy.integer)):
+            return self.take(i)
+
+        if i < 0:
+            i += len(self)
+
+        if not 0 <= i < len(self):
+            msg = ('Feature index %i out of range for geometry with %i '
+                   'features' % (i, len(self)))
+            raise IndexError(msg)
+
+        parts = []
+        for j in range(self.feature_offsets[i], self.feature_offsets[i + 1]):
+            start, stop = self.part_offsets[j], self.part_offsets[j + 1]
+            parts.append(self.vertices[start:stop])
+
+        return parts
+
+    def __iter__(self):
+        """Iterate over lists of parts, one per feature
+        """
+
+        for i in range(len(self)):
+            yield self[i]
+
+    def take(self, indices):
+        """Get new geometry with selected features
+
+        Input
+            indices: Slice, array of feature indices or boolean mask
+
+        Output
+            PackedGeometry with the selected features in the given order
+        """
+
+        indices = numpy.arange(len(self))[indices]
+
+        part_starts = self.feature_offsets[indices]
+        part_stops = self.feature_offsets[indices + 1]
+        parts = expand_ranges(part_starts, part_stops)
+
+        vertex_starts = self.part_offsets[parts]
+        vertex_stops = self.part_offsets[parts + 1]
+        vertices = expand_ranges(vertex_starts, vertex_stops)
+
+        return PackedGeometry(self.vertices[vertices],
+                              cumulative_offsets(vertex_stops -
+                                                 vertex_starts),
+                              cumulative_offsets(part_stops - part_starts),
+                              self.geometry_type,
+                              holes=self.holes[parts])
+
+    def allclose(self, other, rtol=1.0e-5, atol=1.0e-8):
+        """Check that geometries have the same structure and vertices
+
+        Input
+            other: PackedGeometry instance to compare to
+            rtol, atol: Relative and absolute tolerance.
+                        See numpy.allclose for details
+        """
+
+        return (self.geometry_type == other.geometry_type and
+                numpy.array_equal(self.part_offsets, other.part_offsets) and
+                numpy.array_equal(self.feature_offsets,
+                                  other.feature_offsets) and
+                numpy.array_equal(self.holes, other.holes) and
+                numpy.allclose(self.vertices, other.vertices,
+                               rtol=rtol, atol=atol))
+
+    def get_differences(self, other, rtol=1.0e-5, atol=1.0e-8):
+        """Find features differing from features of other geometry
+
+        Input
+            other: PackedGeometry instance with the same number of features
+            rtol, atol: Relative and absolute tolerance.
+                        See numpy.allclose for details
+
+        Output
+            Boolean array which is True for features that differ in their
+            parts, holes or vertices from the feature at the same index of
+            other.
+        """
+
+        msg = ('Geometries must have the same number of features. '
+               'I got %i and %i' % (len(self), len(other)))
+        assert len(self) == len(other), msg
+
+        N = len(self)
+        if self.geometry_type != other.geometry_type:
+            return numpy.ones(N, dtype=bool)
+
+        # Features with the same number of parts and vertices
+        a_parts = numpy.diff(self.feature_offsets)
+        b_parts = numpy.diff(other.feature_offsets)
+        a_start = self.part_offsets[self.feature_offsets[:-1]]
+        b_start = other.part_offsets[other.feature_offsets[:-1]]
+        a_count = self.part_offsets[self.feature_offsets[1:]] - a_start
+        b_count = other.part_offsets[other.feature_offsets[1:]] - b_start
+
+        differ = (a_parts != b_parts) | (a_count != b_count)
+        features = numpy.nonzero(~differ)[0]
+
+        # Compare parts of these features
+        a_part = expand_ranges(self.feature_offsets[features],
+                               self.feature_offsets[features + 1])
+        b_part = expand_ranges(other.feature_offsets[features],
+                               other.feature_offsets[features + 1])
+        feature = numpy.repeat(features, a_parts[features])
+        mismatch = ((numpy.diff(self.part_offsets)[a_part] !=
+                     numpy.diff(other.part_offsets)[b_part]) |
+                    (self.holes[a_part] != other.holes[b_part]))
+        differ[feature[mismatch]] = True
+
+        # Compare vertices of these features
+        a_vertex = expand_ranges(a_start[features],
+                                 a_start[features] + a_count[features])
+        b_vertex = expand_ranges(b_start[features],
+                                 b_start[features] + a_count[features])
+        feature = numpy.repeat(features, a_count[features])
+        close = numpy.isclose(self.vertices[a_vertex],
+                              other.vertices[b_vertex],
+                              rtol=rtol, atol=atol).all(axis=1)
+        differ[feature[~close]] = True
+
+        return differ
+
+    def get_part_index(self):
+        """Get index of part for each vertex
+        """
+        return numpy.repeat(numpy.arange(len(self.part_offsets) - 1),
+                            numpy.diff(self.part_offsets))
+
+    def get_feature_index(self):
+        """Get index of feature for each part
+        """
+        return numpy.repeat(numpy.arange(len(self)),
+                            numpy.diff(self.feature_offsets))
+
+    def get_segments(self):
+        """Get segments as index of each vertex and its successor
+
+        Output
+            part: Index of part for each vertex
+            successor: Index of next vertex in the same part. Rings are
+                       closed by joining their last vertex to their first.
+                       The last vertex of a line is its own successor so
+                       its segment has length zero.
+        """
+
+        part = self.get_part_index()
+        successor = numpy.arange(1, len(self.vertices) + 1)
+
+        starts = self.part_offsets[:-1]
+        stops = self.part_offsets[1:]
+        nonempty = stops > starts
+        if self.geometry_type == 'polygon':
+            successor[stops[nonempty] - 1] = starts[nonempty]
+        else:
+            successor[stops[nonempty] - 1] = stops[nonempty] - 1
+
+        return part, successor
+
+    def get_areas(self):
+        """Get area of each feature computed with the shoelace formula
+
+        Output
+            Array of N areas in units of the coordinates squared
+            (square degrees for geographic coordinates). Holes are
+            subtracted. Areas of lines are zero.
+        """
+
+        if self.geometry_type != 'polygon':
+            return numpy.zeros(len(self))
+
+        areas, _, _ = self.get_ring_moments()
+        return self.sum_over_features(signed_areas(areas, self.holes))
+
+    def get_lengths(self):
+        """Get length of each feature
+
+        Output
+            Array of N lengths in units of the coordinates. For polygons
+            this is the perimeter including that of holes.
+        """
+
+        part, successor = self.get_segments()
+        x = self.vertices[:, 0]
+        y = self.vertices[:, 1]
+        segment_lengths = numpy.hypot(x[successor] - x, y[successor] - y)
+
+        P = len(self.part_offsets) - 1
+        part_lengths = numpy.bincount(part, weights=segment_lengths,
+                                      minlength=P)
+        return self.sum_over_features(part_lengths)
+
+    def get_centroids(self):
+        """Get centroid of each feature
+
+        Output
+            Nx2 array of coordinates. Centroids of polygons are area
+            weighted and centroids of lines are length weighted.
+            Features with no area or length get the mean of their vertices.
+        """
+
+        x = self.vertices[:, 0]
+        y = self.vertices[:, 1]
+        part, successor = self.get_segments()
+        P = len(self.part_offsets) - 1
+
+        if self.geometry_type == 'polygon':
+            # Area weighted centroids of rings
+            areas, mx, my = self.get_ring_moments()
+            weights = signed_areas(areas, self.holes)
+            denominator = 6 * areas
+            with_area = areas != 0
+            cx = numpy.zeros(P)
+            cy = numpy.zeros(P)
+            cx[with_area] = mx[with_area] / denominator[with_area]
+            cy[with_area] = my[with_area] / denominator[with_area]
+        else:
+            # Length weighted centroids of segments
+            lengths = numpy.hypot(x[successor] - x, y[successor] - y)
+            weights = numpy.bincount(part, weights=lengths, minlength=P)
+            with_length = weights > 0
+            cx = numpy.zeros(P)
+            cy = numpy.zeros(P)
+            sx = numpy.bincount(part, weights=lengths * (x + x[successor]),
+                                minlength=P)
+            sy = numpy.bincount(part, weights=lengths * (y + y[successor]),
+                                minlength=P)
+            cx[with_length] = sx[with_length] / (2 * weights[with_length])
+            cy[with_length] = sy[with_length] / (2 * weights[with_length])
+
+        total = self.sum_over_features(weights)
+        centroids = numpy.zeros((len(self), 2))
+        centroids[:, 0] = self.sum_over_features(weights * cx)
+        centroids[:, 1] = self.sum_over_features(weights * cy)
+
+        ok = total != 0
+        centroids[ok] /= total[ok, numpy.newaxis]
+
+        # Degenerate features get the mean of their vertices
+        if not numpy.all(ok):
+            feature = self.get_feature_index()[part]
+            count = numpy.bincount(feature, minlength=len(self))
+            count = numpy.maximum(count, 1)
+            for k, z in enumerate([x, y]):
+                mean = numpy.bincount(feature, weights=z,
+                                      minlength=len(self)) / count
+                centroids[~ok, k] = mean[~ok]
+
+        return centroids
+
+    def get_bounding_boxes(self):
+        """Get bounding box of each feature
+
+        Output
+            Nx4 array with rows [West, South, East, North].
+            Features without vertices get NaN.
+        """
+
+        N = len(self)
+        boxes = numpy.empty((N, 4))
+        boxes.fill(numpy.nan)
+
+        # First vertex of each feature with vertices. Vertices of a
+        # feature run to the first vertex of the next such feature as
+        # reduceat can not reduce empty ranges.
+        starts = self.part_offsets[self.feature_offsets]
+        nonempty = numpy.nonzero(numpy.diff(starts) > 0)[0]
+        if len(nonempty) == 0:
+            return boxes
+
+        starts = starts[nonempty]
+        x = self.vertices[:, 0]
+        y = self.vertices[:, 1]
+        boxes[nonempty, 0] = numpy.minimum.reduceat(x, starts)
+        boxes[nonempty, 1] = numpy.minimum.reduceat(y, starts)
+        boxes[nonempty, 2] = numpy.maximum.reduceat(x, starts)
+        boxes[nonempty, 3] = numpy.maximum.reduceat(y, starts)
+        return boxes
+
+    def get_ring_moments(self):
+        """Get signed area and first moments of each part as a ring
+
+        Output
+            areas: Signed area of each ring (positive if anticlockwise)
+            mx, my: Sums of (x_i + x_j) c and (y_i + y_j) c over the
+                    edges (i, j) of each ring where c is the cross
+                    product of the two vertices
+        """
+
+        x = self.vertices[:, 0]
+        y = self.vertices[:, 1]
+        part, successor = self.get_segments()
+        P = len(self.part_offsets) - 1
+
+        cross = x * y[successor] - x[successor] * y
+        areas = 0.5 * numpy.bincount(part, weights=cross, minlength=P)
+        mx = numpy.bincount(part, weights=(x + x[successor]) * cross,
+                            minlength=P)
+        my = numpy.bincount(part, weights=(y + y[successor]) * cross,
+                            minlength=P)
+
+        return areas, mx, my
+
+    def sum_over_features(self, values):
+        """Sum values given per part for each feature
+        """
+
+        return numpy.bincount(self.get_feature_index(), weights=values,
+                              minlength=len(self))
+
+
+def pack_geometry(features, geometry_type, holes=None):
+    """Pack list of line or polygon features
+
+    Input
+        features: List of features each given as a list of parts.
+                  Each part is a sequence of (longitude, latitude) vertices.
+        geometry_type: Either 'line' or 'polygon'
+        holes: Optional list with a list of flags for the parts of each
+               feature. If None, the first ring of each polygon is its
+               exterior and any other rings are holes.
+
+    Output
+        PackedGeometry
+    """
+
+    vertices = []
+    part_offsets = [0]
+    feature_offsets = [0]
+    flags = []
+    for i, parts in enumerate(features):
+        for j, part in enumerate(parts):
+            vertices.extend(part)
+            part_offsets.append(len(vertices))
+
+            if holes is not None:
+                flags.append(holes[i][j])
+            else:
+                flags.append(geometry_type == 'polygon' and j > 0)
+
+        feature_offsets.append(len(part_offsets) - 1)
+
+    return PackedGeometry(numpy.array(vertices, dtype='d').reshape((-1, 2)),
+                          part_offsets, feature_offsets, geometry_type,
+                          holes=flags)
+
+
+def get_geometry_type(ogr_type):
+    """Get geometry type of vector layer from OGR geometry type
+
+    Input
+        ogr_type: OGR geometry type of layer or feature. 2.5D and
+                  measured variants map to the same type as 2D ones.
+
+    Output
+        One of 'point', 'line' and 'polygon' or None if not supported
+    """
+
+    # Strip 25D bit and ISO offsets for Z and M coordinates
+    return GEOMETRY_TYPE_MAP.get((ogr_type & 0x7fffffff) % 1000)
+
+
+def get_ogr_parts(G):
+    """Get parts of OGR line or polygon geometry
+
+    Input
+        G: OGR geometry of type (multi)linestring or (multi)polygon
+
+    Output
+        parts: List of parts each a list of (longitude, latitude) vertices
+        holes: List of flags that are True for interior rings
+    """
+
+    G.FlattenTo2D()
+    geometry_type = G.GetGeometryType()
+
+    if geometry_type == ogr.wkbLineString:
+        return [G.GetPoints() or []], [False]
+
+    if geometry_type == ogr.wkbPolygon:
+        polygons = [G]
+    else:
+        # Multilinestring or multipolygon
+        polygons = [G.GetGeometryRef(k)
+                    for k in range(G.GetGeometryCount())]
+
+    parts = []
+    holes = []
+    for polygon in polygons:
+        if polygon.GetGeometryType() == ogr.wkbLineString:
+            parts.append(polygon.GetPoints() or [])
+            holes.append(False)
+            continue
+
+        for k in range(polygon.GetGeometryCount()):
+            ring = polygon.GetGeometryRef(k)
+            parts.append(ring.GetPoints() or [])
+            holes.append(k > 0)
+
+    return parts, holes
+
+
+def make_ogr_geometry(parts, holes, geometry_type):
+    """Create OGR geometry from parts of one feature
+
+    Input
+        parts: List of Kx2 arrays of vertices
+        holes: Flags that are True for interior rings
+        geometry_type: Either 'line' or 'polygon'
+
+    Output
+        OGR linestring or polygon if the feature has one part or exterior
+        ring. Otherwise OGR multilinestring or multipolygon.
+    """
+
+    if geometry_type == 'line':
+        lines = []
+        for part in parts:
+            line = ogr.Geometry(ogr.wkbLineString)
+            for x, y in part.tolist():
+                line.AddPoint_2D(x, y)
+            lines.append(line)
+
+        if len(lines) == 1:
+            return lines[0]
+
+        G = ogr.Geometry(ogr.wkbMultiLineString)
+        for line in lines:
+            G.AddGeometry(line)
+        return G
+
+    # Group rings into polygons each starting with its exterior ring
+    polygons = []
+    for part, hole in zip(parts, holes):
+        ring = ogr.Geometry(ogr.wkbLinearRing)
+        for x, y in part.tolist():
+            ring.AddPoint_2D(x, y)
+
+        if not hole or len(polygons) == 0:
+            polygons.append(ogr.Geometry(ogr.wkbPolygon))
+        polygons[-1].AddGeometry(ring)
+
+    if len(polygons) == 1:
+        return polygons[0]
+
+    G = ogr.Geometry(ogr.wkbMultiPolygon)
+    for polygon in polygons:
+        G.AddGeometry(polygon)
+    return G
+
+
+def signed_areas(areas, holes):
+    """Areas of rings counted negative for holes
+
+    Input
+        areas: Signed areas of rings in any orientation
+        holes: Flags that are True for interior rings
+    """
+
+    return numpy.where(holes, -1.0, 1.0) * numpy.abs(areas)
+
+
+def expand_ranges(starts, stops):
+    """Concatenate ranges of integers
+
+    Input
+        starts, stops: Arrays with start and stop of each range
+
+    Output
+        Array equal to concatenation of range(starts[i], stops[i])
+    """
+
+    lengths = stops - starts
+    offsets = numpy.cumsum(lengths) - lengths
+    return (numpy.arange(numpy.sum(lengths), dtype='l') +
+            numpy.repeat(starts - offsets, lengths))
+
+
+def cumulative_offsets(lengths):
+    """Offsets of consecutive ranges of given lengths starting at 0
+    """
+
+    offsets = numpy.zeros(len(lengths) + 1, dtype='l')
+    numpy.cumsum(lengths, out=offsets[1:])
+    return offsets
@@ -16,16 +16,19 @@ from impact.storage.raster import Raster
 from impact.storage.utilities import get_layers_metadata
 
 
-def read_layer(filename):
+def read_layer(filename, chunk_size=None):
     """Read spatial layer from file.
     This can be either raster or vector data.
+
+    If chunk_size is specified, features of vector data are read
+    that many at a time when iterating over Vector.get_chunks.
     """
 
     _, ext = os.path.splitext(filename)
     if ext in ['.asc', '.tif']:
         return Raster(filename)
-    elif ext in ['.shp', '.gml']:
-        return Vector(filename)
+    elif ext in ['.shp', '.gml', '.gpkg']:
+        return Vector(filename, chunk_size=chunk_size)
     else:
         msg = ('Could not read %s. '
                'Extension "%s" has not been implemented' % (filename, ext))
@@ -63,8 +66,8 @@ def write_point_data(data, projection, geometry, filename):
                   N is the number of points (features).
         filename: Output filename
 
-    Note: The only format implemented is GML and SHP so the extension
-    must be either .gml or .shp
+    Note: The only formats implemented are GML, SHP and GeoPackage so the
+    extension must be either .gml, .shp or .gpkg
 
     # FIXME (Ole): When the GML driver is used,
     #              the spatial reference is not stored.
@@ -167,7 +170,7 @@ def get_file(download_url, suffix):
     return filename
 
 
-def download(server_url, layer_name, bbox):
+def download(server_url, layer_name, bbox, chunk_size=None):
     """Download the source data of a given layer.
 
        Input
@@ -176,7 +179,8 @@ def download(server_url, layer_name, bbox):
            bbox: Bounding box for layer. This can either be a string or a list
                  with format [west, south, east, north], e.g.
                  '87.998242,-8.269822,117.046094,5.097895'
-
+           chunk_size: Optional number of features to read at a time
+                       from vector data. See read_layer.
 
        Layer type can be either 'vector' or 'raster'
     """
@@ -225,7 +229,7 @@ def download(server_url, layer_name, bbox):
         filename = get_file(download_url, suffix)
 
     # Instantiate layer from file
-    lyr = read_layer(filename)
+    lyr = read_layer(filename, chunk_size=chunk_size)
 
     #FIXME (Ariel) Don't monkeypatch the layer object
     lyr.metadata = layer_metadata
@@ -6,7 +6,26 @@ import numpy
 from osgeo import gdal
 from impact.storage.projection import Projection
 from impact.storage.utilities import DRIVER_MAP
+from impact.storage.utilities import gdal_data_type
+from impact.storage.utilities import numpy_data_type
+from impact.storage.utilities import geotransform_to_axes
 from impact.engine.interpolation import interpolate_raster_vector
+from impact.engine.interpolation import interpolate_raster_raster
+from impact.engine.interpolation import DEFAULT_INTERPOLATION_METHOD
+
+# Minimal number of grid cells in each block returned by get_blocks
+BLOCK_CELLS = 1000000
+
+# Compression methods supported by write_to_file
+COMPRESSION_METHODS = ['DEFLATE', 'LZW']
+
+# Size of internal tiles and of the smallest overview in pixels
+TILE_SIZE = 256
+
+# Maximal number of values for which quantiles are computed exactly.
+# Larger rasters use a histogram with the given number of bins.
+QUANTILE_EXACT_CELLS = 10000000
+HISTOGRAM_BINS = 65536
 
 
 class Raster:
@@ -20,7 +39,7 @@ class Raster:
         Input
             data: Can be either
                 * a filename of a raster file format known to GDAL
-                * an MxN array of raster data
+                * an MxN array of raster data. Its data type is kept.
                 * None
             projection: Geospatial reference in WKT format.
                         Only used if data is provide as a numeric array,
@@ -41,6 +60,8 @@ class Raster:
             # Instantiate empty object
             self.name = name
             self.data = None
+            self.nodata_mask = None
+            self.statistics = {}
             self.projection = None
             self.coordinates = None
             self.filename = None
@@ -52,7 +73,9 @@ class Raster:
             # Assume that data is provided as an array
             # with extra keyword arguments supplying metadata
 
-            self.data = numpy.array(data, dtype='d', copy=False)
+            self.data = numpy.array(data, copy=False)
+            self.nodata_mask = None
+            self.statistics = {}
 
             self.filename = None
             self.name = name
@@ -60,8 +83,8 @@ class Raster:
             self.projection = Projection(projection)
             self.geotransform = geotransform
 
-            self.rows = data.shape[0]
-            self.columns = data.shape[1]
+            self.rows = self.data.shape[0]
+            self.columns = self.data.shape[1]
 
             self.number_of_bands = 1
 
@@ -71,7 +94,7 @@ class Raster:
     def __len__(self):
         """Size of data set defined as total number of grid points
         """
-        return len(self.get_data().flat)
+        return self.rows * self.columns
 
     def __eq__(self, other, rtol=1.0e-5, atol=1.0e-8):
         """Override '==' to allow comparison with other raster objecs
@@ -96,12 +119,15 @@ class Raster:
         if self.get_geotransform() != other.get_geotransform():
             return False
 
-        # Check data
-        if not numpy.allclose(self.get_data(),
-                              other.get_data(),
-                              rtol=rtol, atol=atol):
+        # Check data block by block
+        if (self.rows, self.columns) != (other.rows, other.columns):
             return False
 
+        for window, A in self.get_blocks():
+            if not numpy.allclose(A, other.get_data(window=window, copy=False),
+                                  rtol=rtol, atol=atol):
+                return False
+
         # Raster layers are identical up to the specified tolerance
         return True
 
@@ -166,11 +192,29 @@ class Raster:
             msg = 'Could not read raster band from %s' % filename
             raise Exception(msg)
 
-    def write_to_file(self, filename):
+        # Data is read from file when first needed
+        self.data = None
+        self.nodata_mask = None
+        self.statistics = {}
+
+    def write_to_file(self, filename, compression=None, tiled=False,
+                      overviews=False):
         """Save raster data to file
 
         Input
             filename: filename with extension .tif
+            compression: Optional compression method. One of
+                         COMPRESSION_METHODS. A predictor suited to the
+                         data type is used.
+            tiled: If True, data is stored in internal tiles of
+                   TILE_SIZE x TILE_SIZE pixels rather than strips.
+            overviews: If True, internal overviews are generated at
+                       successive factors of 2 until they are smaller than
+                       a tile. Can also be a list of overview factors.
+                       Overviews are averaged, except for integer data
+                       where nearest neighbour is used to keep categories.
+
+        Files that may exceed 4GB are written as BigTIFF.
         """
 
         # Check file format
@@ -181,15 +225,37 @@ class Raster:
         assert extension == '.tif', msg
         format = DRIVER_MAP[extension]
 
-        # Get raster data
-        A = self.get_data()
-
         # Get Dimensions. Note numpy and Gdal swap order
-        N, M = A.shape
+        N, M = self.rows, self.columns
+
+        # Store data using the GDAL type matching that of the data
+        dtype, gdal_type = gdal_data_type(self.get_data_type())
+
+        # Creation options
+        options = ['BIGTIFF=IF_SAFER']
+        if compression is not None:
+            msg = ('Compression must be one of %s. I got '
+                   '%s' % (', '.join(COMPRESSION_METHODS), compression))
+            assert compression in COMPRESSION_METHODS, msg
+
+            # Horizontal differencing for integers, floating point
+            # predictor otherwise
+            if dtype.kind == 'f':
+                predictor = 3
+            else:
+                predictor = 2
+
+            options.append('COMPRESS=%s' % compression)
+            options.append('PREDICTOR=%i' % predictor)
+
+        if tiled:
+            options.append('TILED=YES')
+            options.append('BLOCKXSIZE=%i' % TILE_SIZE)
+            options.append('BLOCKYSIZE=%i' % TILE_SIZE)
 
         # Create empty file
         driver = gdal.GetDriverByName(format)
-        fid = driver.Create(filename, M, N, 1, gdal.GDT_Float64)
+        fid = driver.Create(filename, M, N, 1, gdal_type, options)
         if fid is None:
             msg = ('Gdal could not create filename %s using '
                    'format %s' % (filename, format))
@@ -199,16 +265,57 @@ class Raster:
         fid.SetProjection(str(self.projection))
         fid.SetGeoTransform(self.geotransform)
 
-        # Write data
-        fid.GetRasterBand(1).WriteArray(A)
+        # Write data block by block
+        band = fid.GetRasterBand(1)
+        for window, A in self.get_blocks():
+            A = numpy.asarray(A, dtype=dtype)
+            band.WriteArray(A, window[0], window[1])
+
+        # Generate internal overviews
+        if overviews is True:
+            overviews = []
+            factor = 2
+            while max(M, N) / factor >= TILE_SIZE:
+                overviews.append(factor)
+                factor *= 2
+
+        if overviews:
+            if dtype.kind == 'f':
+                resampling = 'AVERAGE'
+            else:
+                resampling = 'NEAREST'
+
+            # Compress overviews like the data
+            config = {}
+            if compression is not None:
+                config = {'COMPRESS_OVERVIEW': compression,
+                          'PREDICTOR_OVERVIEW': str(predictor)}
+
+            previous = {}
+            for key in config:
+                previous[key] = gdal.GetConfigOption(key)
+                gdal.SetConfigOption(key, config[key])
 
-    def interpolate(self, X, name=None):
+            try:
+                fid.BuildOverviews(resampling, list(overviews))
+            finally:
+                for key in config:
+                    gdal.SetConfigOption(key, previous[key])
+
+        fid.FlushCache()
+
+    def interpolate(self, X, name=None,
+                    method=DEFAULT_INTERPOLATION_METHOD):
         """Interpolate values of this raster layer to other layer
 
         Input
             X: Layer object defining target
             name: Optional name of interpolated layer.
                   If name is None, the name of self is used.
+            method: Interpolation method. Either 'nearest', 'bilinear'
+                    (default) or 'spline'. If X is a raster layer, the
+                    methods are 'nearest', 'bilinear', 'average' or 'sum'.
+                    Use 'sum' to preserve totals of e.g. population counts.
 
         Output
             Y: Layer object with values of this raster layer interpolated to
@@ -216,55 +323,209 @@ class Raster:
         """
 
         if X.is_raster:
-            if self.get_geotransform() != X.get_geotransform():
-                # Need interpolation between grids
-                msg = 'Intergrid interpolation not yet implemented'
-                raise Exception(msg)
+            if (self.get_geotransform() != X.get_geotransform() or
+                (self.rows, self.columns) != (X.rows, X.columns)):
+                # Resample this raster onto the grid of X
+                return interpolate_raster_raster(self, X, name, method)
             else:
                 # Rasters are aligned, no need to interpolate
                 return self
         else:
             # Interpolate this raster layer to geometry of X
-            return interpolate_raster_vector(self, X, name)
+            return interpolate_raster_vector(self, X, name, method)
 
-    def get_data(self, nan=False):
+    def get_data(self, nan=False, window=None, dtype=None, copy=True):
         """Get raster data as numeric array
         If keyword nan is True, nodata values will be replaced with NaN
         If keyword nan has a numeric value, that will be used for NODATA
+
+        Data is returned in its native data type, e.g. as stored in the
+        raster file. If keyword dtype is specified, data is converted to
+        that type. Use e.g. dtype='f' to compute in single precision.
+        Integer data is returned as floating point if NODATA is replaced
+        with NaN.
+
+        If keyword window is specified as (xoffset, yoffset, xsize, ysize)
+        only that part of the grid is returned. For raster files only the
+        window is read from disk.
+
+        The full grid of a raster file is read once and kept until
+        release() is called. By default a copy is returned which can be
+        modified freely as before. If keyword copy is False, the cached
+        grid (or a view of it) is returned read-only without copying.
+        Use this when data is only read. NODATA values are replaced
+        in a copy using the mask from get_nodata_mask().
         """
 
         # FIXME (Ole): Once we have the ability to use numpy.nan throughout,
         #              make that the default and name everything better
 
-        if hasattr(self, 'data'):
+        if window is None:
+            window = (0, 0, self.columns, self.rows)
+
+        xoff, yoff, xsize, ysize = window
+        msg = ('Window %s must lie within raster of dimensions '
+               '(%i, %i)' % (str(window), self.rows, self.columns))
+        assert 0 <= xoff and xoff + xsize <= self.columns, msg
+        assert 0 <= yoff and yoff + ysize <= self.rows, msg
+
+        full = (xsize, ysize) == (self.columns, self.rows)
+
+        # Flag whether A is a new array that can be modified in place
+        owned = False
+
+        if self.data is not None:
             A = self.data
             assert A.shape[0] == self.rows and A.shape[1] == self.columns
+
+            if not full:
+                A = A[yoff:yoff + ysize, xoff:xoff + xsize]
         else:
             # Read from raster file
-            A = self.band.ReadAsArray()
+            A = self.band.ReadAsArray(xoff, yoff, xsize, ysize)
 
             M, N = A.shape
             msg = ('Dimensions of raster array do not match those of '
                    'raster file %s' % self.filename)
-            assert M == self.rows, msg
-            assert N == self.columns, msg
+            assert M == ysize, msg
+            assert N == xsize, msg
+
+            if full:
+                # Keep decoded grid for subsequent calls
+                A.flags.writeable = False
+                self.data = A
+            else:
+                owned = True
 
         if nan is False:
-            pass
+            mask = None
         else:
             if nan is True:
                 NAN = numpy.nan
             else:
                 NAN = nan
 
-            # Replace NODATA_VALUE with NaN
-            nodata = self.get_nodata_value()
+            # Locate NODATA values before any conversion of data type
+            if owned:
+                mask = find_nodata(A, self.get_nodata_value())
+            else:
+                mask = self.get_nodata_mask(window)
+
+        if dtype is not None:
+            B = numpy.asarray(A, dtype=dtype)
+            owned = owned or B is not A
+            A = B
 
-            NaN = numpy.ones(A.shape, A.dtype) * NAN
-            A = numpy.where(A == nodata, NaN, A)
+        if mask is not None:
+            # Integer data can only hold NaN as floating point
+            if A.dtype.kind in 'biu' and not float(NAN).is_integer():
+                A = A.astype('d')
+                owned = True
+
+            if numpy.any(mask):
+                if not owned:
+                    A = A.copy()
+
+                # Replace NODATA_VALUE with NaN in a single pass
+                numpy.putmask(A, mask, NAN)
+                owned = True
+
+        if copy and not owned and not A.flags.writeable:
+            # Leave cached grid of raster file untouched
+            A = A.copy()
 
         return A
 
+    def get_nodata_mask(self, window=None):
+        """Get boolean array which is True where raster data is NODATA
+
+        Input
+            window: Optional window (xoffset, yoffset, xsize, ysize)
+
+        Output
+            Mask with the dimensions of the grid or window
+
+        The mask of a raster file is computed once from the full grid and
+        kept until release() is called. Masks of rasters held in memory
+        are computed on each call as their data may have changed.
+        """
+
+        if self.nodata_mask is None:
+            if self.data is not None and not self.data.flags.writeable:
+                # Cached data of raster file
+                mask = find_nodata(self.data, self.get_nodata_value())
+                mask.flags.writeable = False
+                self.nodata_mask = mask
+            else:
+                return find_nodata(self.get_data(window=window, copy=False),
+                                   self.get_nodata_value())
+
+        mask = self.nodata_mask
+        if window is not None:
+            xoff, yoff, xsize, ysize = window
+            mask = mask[yoff:yoff + ysize, xoff:xoff + xsize]
+
+        return mask
+
+    def get_data_type(self):
+        """Get numpy data type of raster data without reading it
+        """
+
+        if self.data is not None:
+            return self.data.dtype
+        else:
+            return numpy_data_type(self.band.DataType)
+
+    def get_block_size(self):
+        """Get native block size of raster
+
+        Output
+            xsize, ysize: Size of blocks in which the raster file is stored.
+                          For rasters held in memory rows are used as blocks.
+        """
+
+        if hasattr(self, 'band'):
+            xsize, ysize = self.band.GetBlockSize()
+        else:
+            xsize, ysize = self.columns, 1
+
+        return xsize, ysize
+
+    def get_blocks(self, nan=False):
+        """Iterate over raster data in strips of rows
+
+        Input
+            nan: Replacement of NODATA values as for get_data()
+
+        Output
+            Iterator of (window, A) where A is the array of values in
+            window (xoffset, yoffset, xsize, ysize). Strips are whole
+            multiples of the native block height and contain at least
+            BLOCK_CELLS grid cells where possible. Only one strip is read
+            from file at a time unless the full grid has been read already.
+            Strips are not copied, so strips of a cached grid are read-only
+            (see get_data).
+        """
+
+        _, ysize = self.get_block_size()
+        ysize = max(ysize, 1)
+        rows = ysize * max(1, BLOCK_CELLS // (ysize * self.columns))
+
+        for yoff in range(0, self.rows, rows):
+            window = (0, yoff, self.columns, min(rows, self.rows - yoff))
+            yield window, self.get_data(nan=nan, window=window, copy=False)
+
+    def release(self):
+        """Release cached data of raster file
+
+        Data will be read from the file again when needed.
+        Rasters held in memory are not affected.
+        """
+
+        if self.filename is not None:
+            self.data = None
+            self.nodata_mask = None
+
     def get_projection(self, proj4=False):
         """Return projection of this layer as a string.
         """
@@ -298,44 +559,14 @@ class Raster:
         latitudes = [0.5, 1.5, ..., 9.5]
         """
 
-        # Get parameters for axes
-        g = self.get_geotransform()
-
-        lon_ul = g[0]  # Longitude of upper left corner
-        lat_ul = g[3]  # Latitude of upper left corner
-        dx = g[1]      # Longitudinal resolution
-        dy = - g[5]    # Latitudinal resolution (always(?) negative)
-        nx = self.columns
-        ny = self.rows
-
-        assert dx > 0
-        assert dy > 0
-
-        # Coordinates of lower left corner
-        lon_ll = lon_ul
-        lat_ll = lat_ul - ny * dy
-
-        # Coordinates of upper right corner
-        lon_ur = lon_ul + nx * dx
-
-        # Define pixel centers along each directions
-        dy2 = dy / 2
-        dx2 = dx / 2
-
-        # Define longitudes and latitudes for each axes
-        x = numpy.linspace(lon_ll + dx2,
-                           lon_ur - dx2, nx)
-        y = numpy.linspace(lat_ll + dy2,
-                           lat_ul - dy2, ny)
-
-        # Return
-        return x, y
+        return geotransform_to_axes(self.get_geotransform(),
+                                    self.rows, self.columns)
 
     def __mul__(self, other):
-        return self.get_data() * other.get_data()
+        return self.get_data(copy=False) * other.get_data(copy=False)
 
     def __add__(self, other):
-        return self.get_data() + other.get_data()
+        return self.get_data(copy=False) + other.get_data(copy=False)
 
     def get_extrema(self):
         """Get min and max from raster
@@ -344,19 +575,106 @@ class Raster:
         Return min, max
         """
 
-        A = self.get_data(nan=True)
-        min = numpy.nanmin(A.flat[:])
-        max = numpy.nanmax(A.flat[:])
-
+        min, max, _ = self.get_statistics()
         return min, max
 
+    def get_statistics(self):
+        """Get min, max and number of valid values in one pass over raster
+
+        NaN and NODATA values are ignored. The raster is processed block
+        by block. For raster files the result is cached.
+
+        Return min, max, count
+        """
+
+        if 'extrema' in self.statistics:
+            return self.statistics['extrema']
+
+        # Accumulate statistics block by block
+        min = max = numpy.nan
+        count = 0
+        for _, A in self.get_blocks(nan=True):
+            A = A[numpy.logical_not(numpy.isnan(A))]  # Omit NaN's
+            if len(A) == 0:
+                continue
+
+            if count == 0:
+                min, max = numpy.min(A), numpy.max(A)
+            else:
+                min = numpy.minimum(min, numpy.min(A))
+                max = numpy.maximum(max, numpy.max(A))
+            count += len(A)
+
+        result = (min, max, count)
+        if self.filename is not None:
+            # Data of raster files can not change
+            self.statistics['extrema'] = result
+
+        return result
+
+    def get_ranked_values(self, ranks):
+        """Get values of given ranks among the sorted valid values
+
+        Input
+            ranks: List of integer ranks between 0 and count - 1 where
+                   count is the number of valid values (see get_statistics)
+
+        Output
+            values: Array of values with the given ranks.
+
+        If there are no more than QUANTILE_EXACT_CELLS valid values, they
+        are collected and the exact values are found with numpy.partition.
+        Otherwise values are estimated from a histogram of HISTOGRAM_BINS
+        bins accumulated block by block, assuming values to be uniformly
+        distributed within each bin.
+        """
+
+        min, max, count = self.get_statistics()
+        if count == 0 or min == max:
+            # All values are the same or undefined
+            return numpy.ones(len(ranks)) * min
+
+        ranks = numpy.clip(numpy.array(ranks, dtype='i'), 0, count - 1)
+
+        if count <= QUANTILE_EXACT_CELLS:
+            # Collect valid values and select ranks
+            A = numpy.empty(count, dtype='d')
+            i = 0
+            for _, B in self.get_blocks(nan=True):
+                B = B[numpy.logical_not(numpy.isnan(B))]
+                A[i:i + len(B)] = B
+                i += len(B)
+
+            A = numpy.partition(A, numpy.unique(ranks))
+            return A[ranks]
+
+        # Histogram of valid values
+        edges = numpy.linspace(min, max, HISTOGRAM_BINS + 1)
+        counts = numpy.zeros(HISTOGRAM_BINS, dtype='int64')
+        for _, B in self.get_blocks(nan=True):
+            B = B[numpy.logical_not(numpy.isnan(B))]
+            counts += numpy.histogram(B, bins=edges)[0]
+
+        # Locate bins containing ranks and interpolate within them
+        cumulative = numpy.cumsum(counts)
+        bins = numpy.searchsorted(cumulative, ranks, side='right')
+        before = cumulative[bins] - counts[bins]
+        fraction = (ranks - before + 0.5) / counts[bins]
+
+        values = edges[bins] + fraction * (edges[bins + 1] - edges[bins])
+        return numpy.clip(values, min, max)
+
     def get_nodata_value(self):
         """Get the internal representation of NODATA
 
         If the internal value is None, the standard -9999 is assumed
         """
 
-        nodata = self.band.GetNoDataValue()
+        if hasattr(self, 'band'):
+            nodata = self.band.GetNoDataValue()
+        else:
+            # Raster was created from an array
+            nodata = None
 
         # Use common default in case nodata was not registered in raster file
         if nodata is None:
@@ -373,12 +691,16 @@ class Raster:
         If quantiles is False, they represent equidistant interval boundaries.
         """
 
-        min, max = self.get_extrema()
+        key = ('bins', N, quantiles)
+        if key in self.statistics:
+            return list(self.statistics[key])
+
+        min, max, count = self.get_statistics()
 
         levels = []
         if quantiles is False:
             # Linear intervals
-            d = (max - min) / N
+            d = float(max - min) / N
 
             for i in range(N):
                 levels.append(min + i * d)
@@ -387,22 +709,16 @@ class Raster:
             # FIXME (Ole): Not 100% sure about this algorithm,
             # but it is close enough
 
-            A = self.get_data(nan=True).flat[:]
-
-            mask = numpy.logical_not(numpy.isnan(A))  # Omit NaN's
-            A = A.compress(mask)
-
-            A.sort()
-
-            assert len(A) == A.shape[0]
-
-            d = float(len(A) + 0.5) / N
-            for i in range(N):
-                levels.append(A[int(i * d)])
+            d = float(count + 0.5) / N
+            ranks = [int(i * d) for i in range(N)]
+            levels = self.get_ranked_values(ranks).tolist()
 
         levels.append(max)
+        if self.filename is not None:
+            # Data of raster files can not change
+            self.statistics[key] = levels
 
-        return levels
+        return list(levels)
 
     def get_bounding_box(self):
         """Get bounding box coordinates for raster layer
@@ -433,3 +749,20 @@ class Raster:
     @property
     def is_vector(self):
         return False
+
+
+def find_nodata(A, nodata):
+    """Find NODATA values in array
+
+    Input
+        A: Array of raster data
+        nodata: Value representing NODATA. Can be NaN.
+
+    Output
+        Boolean array which is True where A is NODATA
+    """
+
+    if numpy.isnan(nodata):
+        return numpy.isnan(A)
+    else:
+        return A == nodata
@@ -0,0 +1,399 @@
+"""Class SpatialIndex
+"""
+
+import numpy
+from impact.storage.geometry import expand_ranges, cumulative_offsets
+
+# Average number of features in each cell of the index grid
+FEATURES_PER_CELL = 8
+
+# Average number of polygon edges in each band of polygon index
+EDGES_PER_BAND = 8
+
+# Maximal number of pairs of points and edges tested at a time
+PAIRS_PER_BLOCK = 1000000
+
+
+class SpatialIndex:
+    """Grid index of bounding boxes of vector features
+
+    The extent of the features is divided into square cells holding
+    FEATURES_PER_CELL features on average. Each feature is registered
+    in all cells its bounding box overlaps. Features of each cell are
+    stored consecutively in one array with offsets for each cell.
+
+    Queries return arrays of feature indices in increasing order,
+    except query_nearest which orders features by distance.
+    Distances are measured in units of the coordinates to the bounding
+    box of each feature. This is exact for points and a lower bound of
+    the distance to lines and polygons.
+    """
+
+    def __init__(self, boxes, features_per_cell=FEATURES_PER_CELL):
+        """Build index
+
+        Input
+            boxes: Nx4 array of feature bounding boxes with rows
+                   [West, South, East, North]. Points are boxes of no size.
+            features_per_cell: Average number of features per cell
+        """
+
+        self.boxes = numpy.array(boxes, dtype='d', copy=False).reshape((-1, 4))
+
+        # Features with undefined (NaN) coordinates are not registered
+        # and never found
+        self.valid = numpy.nonzero(numpy.all(numpy.isfinite(self.boxes),
+                                             axis=1))[0]
+        N = len(self.valid)
+
+        if N == 0:
+            self.extent = None
+            self.features = numpy.zeros(0, dtype='l')
+            return
+
+        # Extent of all features
+        boxes = self.boxes[self.valid]
+        west = numpy.min(boxes[:, 0])
+        south = numpy.min(boxes[:, 1])
+        east = numpy.max(boxes[:, 2])
+        north = numpy.max(boxes[:, 3])
+        self.extent = [west, south, east, north]
+
+        # Square cells with the required number of features on average.
+        # Very elongated extents get one row or column of cells.
+        width = east - west
+        height = north - south
+        cells = max(1.0, float(N) / features_per_cell)
+        self.cell_size = max(numpy.sqrt(width * height / cells),
+                             width / cells, height / cells, 1.0e-12)
+
+        self.columns = int(width / self.cell_size) + 1
+        self.rows = int(height / self.cell_size) + 1
+
+        # Register each feature in all cells overlapped by its box
+        c0, r0, c1, r1 = self.get_cells(boxes)
+        ncols = c1 - c0 + 1
+        counts = ncols * (r1 - r0 + 1)
+        feature = numpy.repeat(self.valid, counts)
+        k = expand_ranges(numpy.zeros(N, dtype='l'), counts)
+        ncols = numpy.repeat(ncols, counts)
+        cell = ((numpy.repeat(r0, counts) + k // ncols) * self.columns +
+                numpy.repeat(c0, counts) + k % ncols)
+
+        order = numpy.argsort(cell, kind='mergesort')
+        self.features = feature[order]
+        self.cell_offsets = cumulative_offsets(
+            numpy.bincount(cell, minlength=self.rows * self.columns))
+
+        # Only features spanning several cells can be found more than once
+        self.unique = numpy.all(counts == 1)
+
+    def __len__(self):
+        """Number of features
+        """
+        return len(self.boxes)
+
+    def get_bounding_box(self):
+        """Get bounding box of all features
+
+        Format is [West, South, East, North] or None if there are
+        no features with defined coordinates.
+        """
+        return self.extent
+
+    def get_cells(self, boxes):
+        """Get ranges of cells overlapped by bounding boxes
+
+        Input
+            boxes: Nx4 array of bounding boxes [West, South, East, North]
+
+        Output
+            c0, r0, c1, r1: Arrays of first and last column and row of
+                            cells overlapped by each box, clipped to the grid
+        """
+
+        west, south = self.extent[:2]
+        cs = self.cell_size
+
+        c0 = numpy.floor((boxes[:, 0] - west) / cs).astype('l')
+        r0 = numpy.floor((boxes[:, 1] - south) / cs).astype('l')
+        c1 = numpy.floor((boxes[:, 2] - west) / cs).astype('l')
+        r1 = numpy.floor((boxes[:, 3] - south) / cs).astype('l')
+
+        return (numpy.clip(c0, 0, self.columns - 1),
+                numpy.clip(r0, 0, self.rows - 1),
+                numpy.clip(c1, 0, self.columns - 1),
+                numpy.clip(r1, 0, self.rows - 1))
+
+    def query_bbox(self, bbox):
+        """Find features overlapping bounding box
+
+        Input
+            bbox: Bounding box [West, South, East, North]
+
+        Output
+            Array of indices of features whose bounding boxes overlap bbox
+        """
+
+        if self.extent is None or not overlaps(self.extent, bbox):
+            return numpy.zeros(0, dtype='l')
+
+        # Candidates registered in cells overlapped by bbox
+        c0, r0, c1, r1 = [x[0] for x in
+                          self.get_cells(numpy.array([bbox], dtype='d'))]
+        cells = (numpy.arange(r0, r1 + 1)[:, numpy.newaxis] * self.columns +
+                 numpy.arange(c0, c1 + 1)[numpy.newaxis, :]).ravel()
+        candidates = self.features[
+            expand_ranges(self.cell_offsets[cells],
+                          self.cell_offsets[cells + 1])]
+
+        if self.unique:
+            candidates.sort()
+        else:
+            candidates = numpy.unique(candidates)
+
+        # Exact test against bounding boxes
+        b = self.boxes[candidates]
+        keep = ((b[:, 0] <= bbox[2]) & (b[:, 2] >= bbox[0]) &
+                (b[:, 1] <= bbox[3]) & (b[:, 3] >= bbox[1]))
+
+        return candidates[keep]
+
+    def query_radius(self, point, radius):
+        """Find features within given distance of point
+
+        Input
+            point: Coordinates (x, y)
+            radius: Maximal distance
+
+        Output
+            Array of indices of features within radius of point
+        """
+
+        x, y = point
+        candidates = self.query_bbox([x - radius, y - radius,
+                                      x + radius, y + radius])
+        distances = self.get_distances(point, candidates)
+
+        return candidates[distances <= radius]
+
+    def query_nearest(self, point, k=1):
+        """Find features nearest to point
+
+        Input
+            point: Coordinates (x, y)
+            k: Number of features to find
+
+        Output
+            Array of indices of the k features nearest to point ordered
+            by distance (fewer if there are less than k features with
+            defined coordinates). Ties are ordered by feature index.
+        """
+
+        k = min(k, len(self.valid))
+        if k <= 0:
+            return numpy.zeros(0, dtype='l')
+
+        # Distance from point beyond which all features are found
+        west, south, east, north = self.extent
+        x, y = point
+        farthest = numpy.hypot(max(abs(x - west), abs(x - east)),
+                               max(abs(y - south), abs(y - north)))
+
+        # Search increasing neighbourhoods until k features are found.
+        # All features within the radius are found so the k nearest
+        # are among them.
+        radius = self.cell_size
+        while radius < farthest:
+            candidates = self.query_radius(point, radius)
+            if len(candidates) >= k:
+                break
+            radius *= 2
+        else:
+            candidates = self.valid
+
+        distances = self.get_distances(point, candidates)
+        order = numpy.argsort(distances, kind='mergesort')[:k]
+
+        return candidates[order]
+
+    def get_distances(self, point, indices):
+        """Get distances from point to bounding boxes of features
+
+        Input
+            point: Coordinates (x, y)
+            indices: Array of feature indices
+
+        Output
+            Array of distances, zero for boxes containing the point
+        """
+
+        x, y = point
+        b = self.boxes[indices]
+        dx = numpy.maximum(numpy.maximum(b[:, 0] - x, x - b[:, 2]), 0)
+        dy = numpy.maximum(numpy.maximum(b[:, 1] - y, y - b[:, 3]), 0)
+
+        return numpy.hypot(dx, dy)
+
+
+def overlaps(a, b):
+    """Check if two bounding boxes [West, South, East, North] overlap
+    """
+
+    return a[0] <= b[2] and a[2] >= b[0] and a[1] <= b[3] and a[3] >= b[1]
+
+
+class PolygonIndex:
+    """Index of polygon edges for locating points in polygons
+
+    Edges are registered in horizontal bands holding EDGES_PER_BAND edges
+    on average. A point is inside a polygon if a ray from the point towards
+    east crosses edges of the polygon an odd number of times (even-odd
+    rule). Only edges in the band of the point can cross its ray.
+    """
+
+    def __init__(self, G, edges_per_band=EDGES_PER_BAND):
+        """Build index
+
+        Input
+            G: PackedGeometry of polygons
+            edges_per_band: Average number of edges in each band
+        """
+
+        msg = ('Polygon index requires polygon geometries. '
+               'I got %s' % G.geometry_type)
+        assert G.geometry_type == 'polygon', msg
+
+        self.number_of_polygons = len(G)
+
+        # Edges from each vertex to its successor. Horizontal edges
+        # never cross a ray and are left out.
+        part, successor = G.get_segments()
+        x = G.vertices[:, 0]
+        y = G.vertices[:, 1]
+        edges = numpy.nonzero(y != y[successor])[0]
+
+        self.polygon = G.get_feature_index()[part[edges]]
+        self.x0 = x[edges]
+        self.y0 = y[edges]
+        self.x1 = x[successor[edges]]
+        self.y1 = y[successor[edges]]
+        self.ymin = numpy.minimum(self.y0, self.y1)
+        self.ymax = numpy.maximum(self.y0, self.y1)
+
+        E = len(edges)
+        if E == 0:
+            self.south = self.north = 0.0
+            self.bands = 1
+            self.band_height = 1.0
+            self.edges = numpy.zeros(0, dtype='l')
+            self.band_offsets = numpy.zeros(2, dtype='l')
+            return
+
+        # Bands of equal height covering all edges
+        self.south = numpy.min(self.ymin)
+        self.north = numpy.max(self.ymax)
+        self.bands = max(1, E // edges_per_band)
+        self.band_height = (self.north - self.south) / self.bands
+
+        # Register each edge in all bands it overlaps
+        b0 = self.get_bands(self.ymin)
+        b1 = self.get_bands(self.ymax)
+        counts = b1 - b0 + 1
+        band = expand_ranges(b0, b1 + 1)
+        edge = numpy.repeat(numpy.arange(E), counts)
+
+        order = numpy.argsort(band, kind='mergesort')
+        self.edges = edge[order]
+        self.band_offsets = cumulative_offsets(
+            numpy.bincount(band, minlength=self.bands))
+
+    def get_bands(self, y):
+        """Get band of each latitude clipped to the bands of the index
+        """
+
+        b = numpy.floor((y - self.south) / self.band_height).astype('l')
+        return numpy.clip(b, 0, self.bands - 1)
+
+    def query_points(self, coordinates):
+        """Find polygon containing each point
+
+        Input
+            coordinates: Nx2 array of longitudes and latitudes
+
+        Output
+            Array of N polygon indices. Points outside all polygons get -1.
+            Points inside several (overlapping) polygons get the first one.
+        """
+
+        coordinates = numpy.array(coordinates, dtype='d', copy=False)
+        N = len(coordinates)
+        result = -numpy.ones(N, dtype='l')
+        if N == 0 or len(self.edges) == 0:
+            return result
+
+        x = coordinates[:, 0]
+        y = coordinates[:, 1]
+
+        # Number of candidate edges for each point
+        candidates = numpy.nonzero((y >= self.south) & (y <= self.north))[0]
+        if len(candidates) == 0:
+            return result
+
+        band = self.get_bands(y[candidates])
+        counts = self.band_offsets[band + 1] - self.band_offsets[band]
+
+        # Process points in blocks with a bounded number of point-edge pairs
+        total = numpy.cumsum(counts)
+        splits = numpy.searchsorted(total,
+                                    numpy.arange(PAIRS_PER_BLOCK, total[-1],
+                                                 PAIRS_PER_BLOCK))
+        for points in numpy.array_split(numpy.arange(len(candidates)),
+                                        splits + 1):
+            if len(points) == 0:
+                continue
+
+            # Pairs of point and edge in the band of the point
+            b = band[points]
+            n = counts[points]
+            point = numpy.repeat(candidates[points], n)
+            edge = self.edges[expand_ranges(self.band_offsets[b],
+                                            self.band_offsets[b + 1])]
+
+            # Edges crossing the eastward ray from each point. The half
+            # open latitude range counts vertices on the ray once.
+            px = x[point]
+            py = y[point]
+            crossing = ((self.ymin[edge] <= py) & (py < self.ymax[edge]))
+            point = point[crossing]
+            edge = edge[crossing]
+            py = py[crossing]
+            xc = self.x0[edge] + ((py - self.y0[edge]) *
+                                  (self.x1[edge] - self.x0[edge]) /
+                                  (self.y1[edge] - self.y0[edge]))
+            east = xc > px[crossing]
+
+            # Points with odd number of crossings per polygon are inside
+            keys = (point[east] * self.number_of_polygons +
+                    self.polygon[edge[east]])
+            keys.sort()
+            starts = numpy.nonzero(first_of_runs(keys))[0]
+            odd = numpy.diff(numpy.append(starts, len(keys))) % 2 == 1
+            keys = keys[starts[odd]]
+
+            # Keep first polygon of each point (keys are sorted)
+            point = keys // self.number_of_polygons
+            polygon = keys % self.number_of_polygons
+            first = first_of_runs(point)
+            result[point[first]] = polygon[first]
+
+        return result
+
+
+def first_of_runs(a):
+    """Mark first element of each run of equal values in array
+    """
+
+    first = numpy.ones(len(a), dtype=bool)
+    first[1:] = a[1:] != a[:-1]
+    return first
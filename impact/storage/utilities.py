@@ -20,6 +20,7 @@ LAYER_TYPES = ['.shp', '.asc', '.tif', '.tiff', '.geotif', '.geotiff']
 # Map between extensions and ORG drivers
 DRIVER_MAP = {'.shp': 'ESRI Shapefile',
               '.gml': 'GML',
+              '.gpkg': 'GPKG',
               '.tif': 'GTiff'}
 
 # Map between Python types and OGR field types
@@ -30,6 +31,27 @@ TYPE_MAP = {type(''): ogr.OFTString,
             type(numpy.array([0.0])[0]): ogr.OFTReal,  # numpy.float64
             type(numpy.array([[0.0]])[0]): ogr.OFTReal}  # numpy.ndarray
 
+# Map between OGR field types and numpy data types of attribute columns
+OGR_TYPE_MAP = {ogr.OFTInteger: 'i',
+                ogr.OFTReal: 'd'}
+
+# Map between numpy data types and GDAL raster data types
+GDAL_TYPE_MAP = {'uint8': gdal.GDT_Byte,
+                 'uint16': gdal.GDT_UInt16,
+                 'int16': gdal.GDT_Int16,
+                 'uint32': gdal.GDT_UInt32,
+                 'int32': gdal.GDT_Int32,
+                 'float32': gdal.GDT_Float32,
+                 'float64': gdal.GDT_Float64}
+
+# Numpy data types without a GDAL counterpart and the types they are
+# stored as. 64 bit integers are stored as Float64 for lack of a GDAL type.
+GDAL_TYPE_PROMOTION = {'bool': 'uint8',
+                       'int8': 'int16',
+                       'int64': 'float64',
+                       'uint64': 'float64',
+                       'float16': 'float32'}
+
 
 # Miscellaneous auxiliary functions
 def unique_filename(**kwargs):
@@ -49,6 +71,145 @@ def unique_filename(**kwargs):
 
     return filename
 
+
+def gdal_data_type(dtype):
+    """Find GDAL raster data type for storing numpy data type
+
+    Input
+        dtype: Numpy data type or its name
+
+    Output
+        dtype: Numpy data type that data must be cast to before writing
+        gdal_type: Corresponding GDAL data type, e.g. gdal.GDT_Float32
+    """
+
+    name = numpy.dtype(dtype).name
+    name = GDAL_TYPE_PROMOTION.get(name, name)
+
+    msg = 'Data type %s can not be stored in a GDAL raster' % name
+    assert name in GDAL_TYPE_MAP, msg
+
+    return numpy.dtype(name), GDAL_TYPE_MAP[name]
+
+
+def numpy_data_type(gdal_type):
+    """Find numpy data type of GDAL raster data type
+
+    Input
+        gdal_type: GDAL data type, e.g. gdal.GDT_Float32
+
+    Output
+        dtype: Numpy data type of data read from raster band
+    """
+
+    for name, value in GDAL_TYPE_MAP.items():
+        if value == gdal_type:
+            return numpy.dtype(name)
+
+    msg = ('GDAL data type %s has no numpy counterpart'
+           % gdal.GetDataTypeName(gdal_type))
+    raise Exception(msg)
+
+
+def geotransform_to_axes(geotransform, rows, columns):
+    """Compute longitudes and latitudes of pixel centers for a grid
+
+    Input
+        geotransform: GDAL geotransform (6-tuple).
+                      (top left x, w-e pixel resolution, rotation,
+                       top left y, rotation, n-s pixel resolution).
+        rows, columns: Dimensions of grid
+
+    Output
+        x: Vector of longitudes (west to east)
+        y: Vector of latitudes (south to north)
+    """
+
+    g = geotransform
+
+    lon_ul = g[0]  # Longitude of upper left corner
+    lat_ul = g[3]  # Latitude of upper left corner
+    dx = g[1]      # Longitudinal resolution
+    dy = - g[5]    # Latitudinal resolution (always(?) negative)
+    nx = columns
+    ny = rows
+
+    assert dx > 0
+    assert dy > 0
+
+    # Coordinates of lower left corner
+    lon_ll = lon_ul
+    lat_ll = lat_ul - ny * dy
+
+    # Coordinates of upper right corner
+    lon_ur = lon_ul + nx * dx
+
+    # Define pixel centers along each directions
+    dy2 = dy / 2.0
+    dx2 = dx / 2.0
+
+    # Define longitudes and latitudes for each axes
+    x = numpy.linspace(lon_ll + dx2,
+                       lon_ur - dx2, nx)
+    y = numpy.linspace(lat_ll + dy2,
+                       lat_ul - dy2, ny)
+
+    return x, y
+
+
+def bbox_to_window(geotransform, rows, columns, bbox, margin=0):
+    """Find window of grid cells covering a bounding box
+
+    Input
+        geotransform: GDAL geotransform of grid
+        rows, columns: Dimensions of grid
+        bbox: Bounding box [West, South, East, North]
+        margin: Number of additional cells to include on each side
+
+    Output
+        window: Tuple (xoffset, yoffset, xsize, ysize) in grid cells as
+                used by GDAL's ReadAsArray. The window is clipped to the
+                grid. If bbox does not overlap the grid, None is returned.
+    """
+
+    g = geotransform
+
+    # Fractional cell indices of bbox corners
+    x0 = (bbox[0] - g[0]) / g[1]
+    x1 = (bbox[2] - g[0]) / g[1]
+    y0 = (bbox[3] - g[3]) / g[5]
+    y1 = (bbox[1] - g[3]) / g[5]
+
+    # Cells containing the corners extended by margin and clipped to grid
+    i0 = max(int(numpy.floor(min(y0, y1))) - margin, 0)
+    i1 = min(int(numpy.floor(max(y0, y1))) + margin + 1, rows)
+    j0 = max(int(numpy.floor(min(x0, x1))) - margin, 0)
+    j1 = min(int(numpy.floor(max(x0, x1))) + margin + 1, columns)
+
+    if i0 >= i1 or j0 >= j1:
+        return None
+
+    return (j0, i0, j1 - j0, i1 - i0)
+
+
+def window_geotransform(geotransform, window):
+    """Compute geotransform of a window into a grid
+
+    Input
+        geotransform: GDAL geotransform of grid
+        window: Tuple (xoffset, yoffset, xsize, ysize) in grid cells
+
+    Output
+        geotransform of the window
+    """
+
+    g = geotransform
+    xoff, yoff = window[0], window[1]
+
+    return (g[0] + xoff * g[1] + yoff * g[2], g[1], g[2],
+            g[3] + xoff * g[4] + yoff * g[5], g[4], g[5])
+
+
 # GeoServer utility functions
 
 def is_server_reachable(url):
@@ -3,9 +3,20 @@
 
 import os
 import numpy
+from collections import OrderedDict
 from osgeo import ogr
 from impact.storage.projection import Projection
-from impact.storage.utilities import DRIVER_MAP, TYPE_MAP
+from impact.storage.attributes import AttributeTable, make_column
+from impact.storage.attributes import compare_columns
+from impact.storage.attributes import python_value
+from impact.storage.geometry import PackedGeometry, pack_geometry
+from impact.storage.geometry import get_geometry_type, get_ogr_parts
+from impact.storage.geometry import make_ogr_geometry, OGR_GEOMETRY_MAP
+from impact.storage.spatial_index import SpatialIndex
+from impact.storage.utilities import DRIVER_MAP, TYPE_MAP, OGR_TYPE_MAP
+
+# Number of features written to file in each transaction
+WRITE_CHUNK_SIZE = 10000
 
 
 class Vector:
@@ -13,7 +24,7 @@ class Vector:
     """
 
     def __init__(self, data=None, projection=None, geometry=None,
-                 name='Vector layer', caption=''):
+                 name='Vector layer', caption='', chunk_size=None):
         """Initialise object with either geometry or filename
 
         Input
@@ -21,18 +32,26 @@ class Vector:
                 * a filename of a vector file format known to GDAL
                 * List of dictionaries of fields associated with
                   point coordinates
+                * Dictionary of field names and arrays of values
+                * AttributeTable
                 * None
             projection: Geospatial reference in WKT format.
                         Only used if geometry is provide as a numeric array,
-            geometry: An Nx2 array of point coordinates
+            geometry: An Nx2 array of point coordinates or a
+                      PackedGeometry of lines or polygons
             name: Optional name for layer.
                   Only used if geometry is provide as a numeric array
             caption: Optional text field that describes the layer. This field
                      can for example be used to display text about the layer
                      in a web application.
+            chunk_size: Optional number of features to read at a time.
+                        Only used if data is a filename. If specified,
+                        features are not read until get_chunks is called.
         """
 
         self.caption = caption
+        self.chunk_size = None
+        self.spatial_index = None
         if data is None and projection is None and geometry is None:
             # Instantiate empty object
             self.name = name
@@ -41,27 +60,38 @@ class Vector:
             self.filename = None
             self.data = None
             self.extent = None
+            self.geometry_type = None
             return
 
         if isinstance(data, basestring):
-            self.read_from_file(data)
+            self.read_from_file(data, chunk_size=chunk_size)
         else:
             # Assume that geometry is provided as an array
             # with extra keyword arguments supplying metadata
 
             msg = 'Geometry must be specified'
             assert geometry is not None, msg
-            self.geometry = numpy.array(geometry, dtype='d', copy=False)
+            if isinstance(geometry, PackedGeometry):
+                self.geometry = geometry
+                self.geometry_type = geometry.geometry_type
+            else:
+                self.geometry = numpy.array(geometry, dtype='d', copy=False)
+                self.geometry_type = 'point'
 
             msg = 'Projection must be specified'
             assert projection is not None, msg
             self.projection = Projection(projection)
 
-            self.data = data
+            if data is None:
+                self.data = None
+            else:
+                self.data = AttributeTable(data)
+
             self.name = name
             self.filename = None
 
-            # FIXME: Need to establish extent here
+            # Extent is derived from the geometry by get_bounding_box
+            self.extent = None
 
     def __str__(self):
         return self.name
@@ -70,8 +100,10 @@ class Vector:
         """Size of vector layer defined as number of features
         """
 
-        # FIXME - change to len(self.geometry)
-        return self.geometry.shape[0]
+        if self.chunk_size is not None:
+            return self.number_of_features
+
+        return len(self.geometry)
 
     def __eq__(self, other, rtol=1.0e-5, atol=1.0e-8):
         """Override '==' to allow comparison with other vector objecs
@@ -82,48 +114,88 @@ class Vector:
                        See numpy.allclose for details
         """
 
+        # Vector layers are identical up to the specified tolerance
+        # if no differences are found
+        return len(self.get_differences(other, rtol=rtol, atol=atol)) == 0
+
+    def get_differences(self, other, rtol=1.0e-5, atol=1.0e-8):
+        """Find features and attributes that differ from other vector layer
+
+        Input
+           other: Vector instance to compare to
+           rtol, atol: Relative and absolute tolerance.
+                       See numpy.allclose for details
+
+        Output
+           OrderedDict describing the differences. It is empty if the
+           layers are equal up to the specified tolerance. Keys are
+
+           'projection', 'geometry_type', 'size': Pair of differing
+                                                  values of the layers
+           'attributes': Pair of lists of names of attributes found only
+                         in this layer and only in other respectively
+           'geometry': Array of indices of features with differing geometry
+           Name of attribute: Array of indices of features where values
+                              of the attribute differ
+
+        Geometries and attributes are only compared if the layers have the
+        same geometry type and number of features. Whole columns are
+        compared at a time with the rules of compare_columns.
+        """
+
         # Check type
         if not isinstance(other, Vector):
             msg = ('Vector instance cannot be compared to %s'
                    ' as its type is %s ' % (str(other), type(other)))
             raise TypeError(msg)
 
+        differences = OrderedDict()
+
         # Check projection
         if self.projection != other.projection:
-            return False
+            differences['projection'] = (self.get_projection(),
+                                         other.get_projection())
 
         # Check geometry
-        if not numpy.allclose(self.get_geometry(),
-                              other.get_geometry(),
-                              rtol=rtol, atol=atol):
-            return False
+        if self.geometry_type != other.geometry_type:
+            differences['geometry_type'] = (self.geometry_type,
+                                            other.geometry_type)
+        if len(self) != len(other):
+            differences['size'] = (len(self), len(other))
+        if 'geometry_type' in differences or 'size' in differences:
+            return differences
+
+        x = self.get_geometry()
+        y = other.get_geometry()
+        if self.geometry_type == 'point':
+            differ = ~numpy.isclose(x, y, rtol=rtol,
+                                    atol=atol).all(axis=1)
+        else:
+            differ = x.get_differences(y, rtol=rtol, atol=atol)
+
+        if numpy.any(differ):
+            differences['geometry'] = numpy.nonzero(differ)[0]
 
         # Check keys
         x = self.get_data()
         y = other.get_data()
+        x_keys = [] if x is None else x.keys()
+        y_keys = [] if y is None else y.keys()
 
-        for key in x[0]:
-            for i in range(len(y)):
-                if key not in y[i]:
-                    return False
-
-        for key in y[0]:
-            for i in range(len(x)):
-                if key not in x[i]:
-                    return False
+        only_x = [key for key in x_keys if key not in y_keys]
+        only_y = [key for key in y_keys if key not in x_keys]
+        if only_x or only_y:
+            differences['attributes'] = (only_x, only_y)
 
-        # Check data
-        for i, a in enumerate(x):
-            for key in a:
-                if a[key] != y[i][key]:
-                    # Not equal, try numerical comparison with tolerances
+        # Check data column by column
+        for key in x_keys:
+            if key in y_keys:
+                differ = compare_columns(x.columns[key], y.columns[key],
+                                         rtol=rtol, atol=atol)
+                if numpy.any(differ):
+                    differences[key] = numpy.nonzero(differ)[0]
 
-                    if not numpy.allclose(a[key], y[i][key],
-                                          rtol=rtol, atol=atol):
-                        return False
-
-        # Vector layers are identical up to the specified tolerance
-        return True
+        return differences
 
     def __ne__(self, other):
         """Override '!=' to allow comparison with other projection objecs
@@ -136,12 +208,12 @@ class Vector:
     def get_caption(self):
         return self.caption
 
-    def read_from_file(self, filename):
+    def read_from_file(self, filename, chunk_size=None):
         """ Read and unpack vector data.
 
         It is assumed that the file contains only one layer with the
-        pertinent features. Further it is assumed for the moment that
-        all geometries are points.
+        pertinent features. Further it is assumed that all geometries
+        are of the same type: Points, (multi)lines or (multi)polygons.
 
         * A feature is a geometry and a set of attributes.
         * A geometry refers to location and can be point, line, polygon or
@@ -156,6 +228,9 @@ class Vector:
         * danieljlewis.org/files/2010/09/basicpythonmap.pdf
         * http://invisibleroads.com/tutorials/gdal-shapefile-points-save.html
         * http://www.packtpub.com/article/geospatial-data-python-geometry
+
+        If chunk_size is specified, only the metadata is read here and
+        features are read chunk by chunk by get_chunks.
         """
 
         self.name, _ = os.path.splitext(filename)
@@ -182,201 +257,124 @@ class Vector:
         p = layer.GetSpatialRef()
         self.projection = Projection(p)
 
-        # Get number of features
-        N = layer.GetFeatureCount()
-
-        # Extract coordinates and attributes for all features
-        geometry = []
-        data = []
-        for i in range(N):
-            feature = layer.GetFeature(i)
-            if feature is None:
-                msg = 'Could not get feature %i from %s' % (i, filename)
-                raise Exception(msg)
+        self.filename = filename
 
-            # Record coordinates
-            G = feature.GetGeometryRef()
-            if G is not None and G.GetGeometryType() == ogr.wkbPoint:
-                # Longitude, Latitude
-                geometry.append((G.GetX(), G.GetY()))
+        if chunk_size is None:
+            self.geometry, self.data = read_chunk(layer, filename)
+            if isinstance(self.geometry, PackedGeometry):
+                self.geometry_type = self.geometry.geometry_type
             else:
-                msg = ('Only point geometries are supported. '
-                       'Geometry in filename %s '
-                       'was %s.' % (filename,
-                                    G.GetGeometryType()))
-                raise Exception(msg)
-
-            # Record attributes by name
-            number_of_fields = feature.GetFieldCount()
-            fields = {}
-            for j in range(number_of_fields):
-                name = feature.GetFieldDefnRef(j).GetName()
-
-                # FIXME (Ole): Ascertain the type of each field?
-                #              We need to cast each appropriately?
-                #              This is issue #66
-                feature_type = feature.GetFieldDefnRef(j).GetType()
-                #print 'Field', name, type
-
-                fields[name] = feature.GetField(j)
-
-            data.append(fields)
+                self.geometry_type = 'point'
+        else:
+            msg = ('Chunk size must be a positive integer. '
+                   'I got %s' % chunk_size)
+            assert chunk_size > 0, msg
 
-        # FIXME: When we get to more general geometries, we
-        #        should probably just stay with a list of features.
-        self.geometry = numpy.array(geometry, dtype='d', copy=False)
-        self.data = data
-        self.filename = filename
+            self.chunk_size = chunk_size
+            self.number_of_features = layer.GetFeatureCount()
+            self.geometry_type = get_geometry_type(layer.GetGeomType())
+            self.geometry = None
+            self.data = None
 
-    def write_to_file(self, filename):
-        """Save vector data to file
+    def get_chunks(self, chunk_size=None):
+        """Iterate over features in chunks
 
         Input
-            filename: filename with extension .shp or .gml
-        """
-
-        # Derive layername from filename (excluding preceding dirs)
-        x = os.path.split(filename)[-1]
-        layername, extension = os.path.splitext(x)
-
-        # Check file format
-        msg = ('Invalid file type for file %s. Only extensions '
-               'shp or gml allowed.' % filename)
-        assert extension == '.shp' or extension == '.gml', msg
-        driver = DRIVER_MAP[extension]
-
-        # FIXME (Ole): Tempory flagging of GML issue
-        if extension == '.gml':
-            msg = ('OGR GML driver does not store geospatial reference.'
-                   'This format is disabled for the time being')
-            raise Exception(msg)
-
-        # Get vector data
-        geometry = self.get_geometry()
-        data = self.get_data()
-        N = len(geometry)
-
-        # Clear any previous file of this name (ogr does not overwrite)
-        try:
-            os.remove(filename)
-        except:
-            pass
-
-        # Create new file with one layer
-        drv = ogr.GetDriverByName(driver)
-        if drv is None:
-            msg = 'OGR driver %s not available' % driver
-            raise Exception(msg)
-
-        ds = drv.CreateDataSource(filename)
-        if ds is None:
-            msg = 'Creation of output file %s failed' % filename
-            raise Exception(msg)
+            chunk_size: Maximal number of features in each chunk.
+                        Defaults to the chunk size the layer was read with.
+                        If neither is given, the whole layer is one chunk.
 
-        lyr = ds.CreateLayer(layername,
-                             self.projection.spatial_reference,
-                             ogr.wkbPoint)
-        if lyr is None:
-            msg = 'Could not create layer %s' % layername
-            raise Exception(msg)
+        Output
+            Generator of Vector layers with consecutive features of this
+            layer. Only one chunk is held in memory at a time if the layer
+            was read with a chunk size.
+        """
 
-        # Define attributes if any
-        store_attributes = False
-        if data is not None:
-            if len(data) > 0:
-                try:
-                    fields = data[0].keys()
-                except:
-                    msg = ('Input parameter "attributes" was specified '
-                           'but it does not contain dictionaries with '
-                           'field information as expected. The first'
-                           'element is %s' % data[0])
-                    raise Exception(msg)
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+
+        if self.chunk_size is not None:
+            # Read features sequentially from file
+            fid = ogr.Open(self.filename)
+            if fid is None:
+                msg = 'Could not open %s' % self.filename
+                raise IOError(msg)
+
+            layer = fid.GetLayerByIndex(0)
+            layer.ResetReading()
+            while True:
+                geometry, data = read_chunk(layer, self.filename, chunk_size)
+                if len(geometry) == 0:
+                    break
+
+                yield Vector(data=data,
+                             projection=self.get_projection(),
+                             geometry=geometry,
+                             name=self.name)
+        elif chunk_size is None:
+            yield self
+        else:
+            # Features are in memory, chunks are views of them
+            N = len(self)
+            for start in range(0, N, chunk_size):
+                index = slice(start, min(start + chunk_size, N))
+                if self.data is None:
+                    data = None
                 else:
-                    # Establish OGR types for each element
-                    ogrtypes = {}
-                    for name in fields:
-                        py_type = type(data[0][name])
-                        ogrtypes[name] = TYPE_MAP[py_type]
+                    data = self.data.take(index)
 
-            else:
-                msg = ('Input parameter "data" was specified '
-                       'but appears to be empty')
-                raise Exception(msg)
+                yield Vector(data=data,
+                             projection=self.get_projection(),
+                             geometry=self.geometry[index],
+                             name=self.name)
 
-            # Create attribute fields in layer
-            store_attributes = True
-            for name in fields:
-
-                fd = ogr.FieldDefn(name, ogrtypes[name])
-
-                # FIXME (Ole): Trying to address issue #16
-                #              But it doesn't work and
-                #              somehow changes the values of MMI in test
-                #width = max(128, len(name))
-                #print name, width
-                #fd.SetWidth(width)
-
-                if lyr.CreateField(fd) != 0:
-                    msg = 'Could not create field %s' % name
-                    raise Exception(msg)
-
-        # Store point data
-        for i in range(N):
-            # FIXME (Ole): Need to assign entire vector if at all possible
-
-            # Coordinates
-            x = float(geometry[i, 0])
-            y = float(geometry[i, 1])
-
-            pt = ogr.Geometry(ogr.wkbPoint)
-            pt.SetPoint_2D(0, x, y)
-
-            feature = ogr.Feature(lyr.GetLayerDefn())
-            feature.SetGeometry(pt)
-
-            G = feature.GetGeometryRef()
-            if G is None:
-                msg = 'Could not create GeometryRef for file %s' % filename
-                raise Exception(msg)
+    def write_to_file(self, filename):
+        """Save vector data to file
 
-            # Attributes
-            if store_attributes:
-                for name in fields:
-                    feature.SetField(name, data[i][name])
+        Input
+            filename: filename with extension .shp, .gml or .gpkg
 
-            # Save this feature
-            if lyr.CreateFeature(feature) != 0:
-                msg = 'Failed to create feature %i in file %s' % (i, filename)
-                raise Exception(msg)
+        Features are written in chunks of WRITE_CHUNK_SIZE. For formats
+        supporting transactions, such as GeoPackage, each chunk is written
+        in one transaction.
+        """
 
-            feature.Destroy()
+        writer = VectorWriter(filename, self.projection, self.geometry_type)
+        for V in self.get_chunks():
+            writer.write(V)
+        writer.close()
 
     def get_data(self, attribute=None, index=None):
         """Get vector attributes
 
-        Data is returned as a list where each entry is a dictionary of
-        attributes for one feature. Entries in get_geometry() and
-        get_data() are related as 1-to-1
+        Data is returned as an AttributeTable which behaves as a list
+        where each entry is a dictionary of attributes for one feature.
+        Entries in get_geometry() and get_data() are related as 1-to-1
 
         If optional argument attribute is specified and a valid name,
-        then the list of values for that attribute is returned.
+        then the array of values for that attribute is returned.
+        The array is the one stored in the layer and is not copied.
 
         If optional argument index is specified on the that value will
         be returned. Any value of index is ignored if attribute is None.
+
+        Layers without attributes return None if attribute is None and
+        raise an exception otherwise.
         """
-        if hasattr(self, 'data'):
+
+        self.check_in_memory()
+        if attribute is None or self.data is not None:
             if attribute is None:
                 return self.data
             else:
                 msg = ('Specified attribute %s does not exist in '
                        'vector layer %s. Valid names are %s'
-                       '' % (attribute, self, self.data[0].keys()))
-                assert attribute in self.data[0], msg
+                       '' % (attribute, self, self.data.keys()))
+                assert attribute in self.data.columns, msg
 
                 if index is None:
                     # Return all values for specified attribute
-                    return [x[attribute] for x in self.data]
+                    return self.data.columns[attribute]
                 else:
                     # Return value for specified attribute and index
                     msg = ('Specified index must be either None or '
@@ -388,7 +386,7 @@ class Vector:
                            '' % (self, 0, len(self) - 1))
                     assert 0 <= index < len(self)
 
-                    return self.data[index][attribute]
+                    return python_value(self.data.columns[attribute][index])
         else:
             msg = 'Vector data instance does not have any attributes'
             raise Exception(msg)
@@ -401,12 +399,42 @@ class Vector:
         geometry type     output type
         -----------------------------
         point             coordinates (Nx2 array of longitudes and latitudes)
-        line              TODO
-        polygon           TODO
+        line              PackedGeometry of (multi)lines
+        polygon           PackedGeometry of (multi)polygons
+
+        The geometry type is given by the attribute geometry_type.
 
         """
+
+        self.check_in_memory()
         return self.geometry
 
+    def get_centroids(self):
+        """Get one representative point for each feature
+
+        Output
+            Nx2 array of longitudes and latitudes. These are the points
+            themselves for point data and area or length weighted centroids
+            for polygons and lines. See PackedGeometry.get_centroids.
+        """
+
+        geometry = self.get_geometry()
+        if self.geometry_type == 'point':
+            return geometry
+        else:
+            return geometry.get_centroids()
+
+    def check_in_memory(self):
+        """Check that features of this layer have been read
+
+        Layers read with a chunk size only give access to their
+        features through get_chunks.
+        """
+
+        msg = ('Features of vector layer %s are read in chunks of %s. '
+               'Use get_chunks() to access them.' % (self, self.chunk_size))
+        assert self.chunk_size is None, msg
+
     def get_projection(self, proj4=False):
         """Return projection of this layer as a string
         """
@@ -416,13 +444,66 @@ class Vector:
         """Get bounding box coordinates for vector layer.
 
         Format is [West, South, East, North]
+
+        The bounding box of layers read from file is the extent recorded
+        in the file. For other layers it is derived from the spatial index.
         """
+
+        if self.extent is None:
+            bbox = self.get_spatial_index().get_bounding_box()
+
+            msg = 'Vector layer %s has no features' % self
+            assert bbox is not None, msg
+            return list(bbox)
+
         e = self.extent
         return [e[0],  # West
                 e[2],  # South
                 e[1],  # East
                 e[3]]  # North
 
+    def get_spatial_index(self):
+        """Get spatial index of features
+
+        Output
+            SpatialIndex of the bounding boxes of features. The index is
+            built on first use and kept with the layer. Indices of features
+            returned by its queries refer to the order of get_geometry().
+        """
+
+        if self.spatial_index is None:
+            geometry = self.get_geometry()
+            if self.geometry_type == 'point':
+                boxes = numpy.hstack([geometry, geometry])
+            else:
+                boxes = geometry.get_bounding_boxes()
+
+            self.spatial_index = SpatialIndex(boxes)
+
+        return self.spatial_index
+
+    def clip(self, bbox):
+        """Get features overlapping bounding box
+
+        Input
+            bbox: Bounding box [West, South, East, North]
+
+        Output
+            New vector layer with the features whose bounding boxes overlap
+            bbox, in their original order
+        """
+
+        indices = self.get_spatial_index().query_bbox(bbox)
+        if self.data is None:
+            data = None
+        else:
+            data = self.data.take(indices)
+
+        return Vector(data=data,
+                      projection=self.get_projection(),
+                      geometry=self.geometry[indices],
+                      name=self.name)
+
     def get_extrema(self, attribute=None):
         """Get min and max values from specified attribute
 
@@ -434,7 +515,7 @@ class Vector:
             raise RuntimeError(msg)
 
         x = self.get_data(attribute)
-        return min(x), max(x)
+        return python_value(numpy.min(x)), python_value(numpy.max(x))
 
     def get_topN(self, attribute, N=10):
         """Get top N features
@@ -444,43 +525,86 @@ class Vector:
             N: How many
 
         Output
-            layer: New vector layer with selected features
+            layer: New vector layer with the features having the N largest
+                   values of attribute ordered by increasing value.
+                   Features with missing values (None or NaN) are never
+                   selected so fewer features may be returned.
         """
 
-        # FIXME (Ole): Maybe generalise this to arbitrary expressions
+        check_ranking_arguments(attribute, N)
+        values = self.get_data(attribute)
+        return self.take(select_extremes(values, N, largest=True))
 
-        # Input checks
-        msg = ('Specfied attribute must be a string. '
-               'I got %s' % (type(attribute)))
-        assert isinstance(attribute, basestring), msg
+    def get_bottomN(self, attribute, N=10):
+        """Get bottom N features
 
-        msg = 'Specified attribute was empty'
-        assert attribute != '', msg
+        Input
+            attribute: The name of attribute where values are sought
+            N: How many
 
-        msg = 'N must be a positive number. I got %i' % N
-        assert N > 0, msg
+        Output
+            layer: New vector layer with the features having the N smallest
+                   values of attribute ordered by increasing value.
+                   Features with missing values are never selected.
+        """
 
-        # Create list of values for specified attribute
+        check_ranking_arguments(attribute, N)
         values = self.get_data(attribute)
+        return self.take(select_extremes(values, N, largest=False))
+
+    def select(self, attribute, predicate):
+        """Get features where attribute values satisfy predicate
+
+        Input
+            attribute: The name of attribute to test
+            predicate: Function taking the array of values of attribute
+                       and returning an array of booleans,
+                       e.g. lambda x: x > 1.0
+
+        Output
+            layer: New vector layer with the selected features in their
+                   original order
+        """
+
+        mask = numpy.asarray(predicate(self.get_data(attribute)))
+
+        msg = ('Predicate must return one boolean for each of the %i '
+               'features. I got %s' % (len(self), str(mask)))
+        assert mask.dtype == bool and mask.shape == (len(self),), msg
+
+        return self.take(numpy.nonzero(mask)[0])
+
+    def take(self, indices):
+        """Get new vector layer with selected features
 
-        # Sort and select using Schwarzian transform
-        A = zip(values, self.data, self.geometry)
-        A.sort()
+        Input
+            indices: Slice, array of feature indices or boolean mask
+
+        Output
+            layer: New vector layer with the selected features in the given
+                   order. If indices is a slice, the arrays of point
+                   coordinates and attributes are shared with this layer.
+        """
 
-        # Pick top N and unpack
-        _, data, geometry = zip(*A[-N:])
+        self.check_in_memory()
+
+        if self.data is None:
+            data = None
+        else:
+            data = self.data.take(indices)
 
-        # Create new Vector instance and return
         return Vector(data=data,
                       projection=self.get_projection(),
-                      geometry=geometry)
+                      geometry=self.geometry[indices],
+                      name=self.name)
 
-    def interpolate(self, X, name=None):
+    def interpolate(self, X, name=None, method=None):
         """Interpolate values of this vector layer to other layer
 
         Input
             X: Layer object defining target
             name: Optional name of interpolated layer
+            method: Optional interpolation method
 
         Output
             Y: Layer object with values of this vector layer interpolated to
@@ -497,3 +621,367 @@ class Vector:
     @property
     def is_vector(self):
         return True
+
+
+class VectorWriter:
+    """Incremental writing of vector features to file
+
+    Features are appended one vector layer at a time so that layers
+    computed chunk by chunk can be saved without holding all features
+    in memory. The attribute fields are defined by the first layer
+    written and subsequent layers must have the same fields.
+
+    Example
+        writer = VectorWriter(filename, projection, E.geometry_type)
+        for V in E.get_chunks():
+            writer.write(V)
+        writer.close()
+    """
+
+    def __init__(self, filename, projection, geometry_type='point'):
+        """Create vector file with one empty layer
+
+        Input
+            filename: filename with extension .shp, .gml or .gpkg
+            projection: Geospatial reference in WKT format or Projection
+            geometry_type: One of 'point', 'line' and 'polygon'
+        """
+
+        msg = ('Geometry type must be one of %s. I got %s'
+               % (', '.join(OGR_GEOMETRY_MAP.keys()), geometry_type))
+        assert geometry_type in OGR_GEOMETRY_MAP, msg
+
+        # Derive layername from filename (excluding preceding dirs)
+        x = os.path.split(filename)[-1]
+        layername, extension = os.path.splitext(x)
+
+        # Check file format
+        msg = ('Invalid file type for file %s. Only extensions '
+               'shp, gml or gpkg allowed.' % filename)
+        assert extension in ['.shp', '.gml', '.gpkg'], msg
+        driver = DRIVER_MAP[extension]
+
+        # FIXME (Ole): Tempory flagging of GML issue
+        if extension == '.gml':
+            msg = ('OGR GML driver does not store geospatial reference.'
+                   'This format is disabled for the time being')
+            raise Exception(msg)
+
+        # Clear any previous file of this name (ogr does not overwrite)
+        try:
+            os.remove(filename)
+        except:
+            pass
+
+        # Create new file with one layer
+        drv = ogr.GetDriverByName(driver)
+        if drv is None:
+            msg = 'OGR driver %s not available' % driver
+            raise Exception(msg)
+
+        ds = drv.CreateDataSource(filename)
+        if ds is None:
+            msg = 'Creation of output file %s failed' % filename
+            raise Exception(msg)
+
+        projection = Projection(projection)
+        lyr = ds.CreateLayer(layername,
+                             projection.spatial_reference,
+                             OGR_GEOMETRY_MAP[geometry_type])
+        if lyr is None:
+            msg = 'Could not create layer %s' % layername
+            raise Exception(msg)
+
+        self.filename = filename
+        self.geometry_type = geometry_type
+        self.ds = ds
+        self.lyr = lyr
+        self.fields = None
+        self.number_of_features = 0
+
+        # Reuse one feature and one geometry for all points
+        self.feature = ogr.Feature(lyr.GetLayerDefn())
+        self.point = ogr.Geometry(ogr.wkbPoint)
+
+    def define_fields(self, data):
+        """Create attribute fields in layer from first attribute table
+
+        Input
+            data: AttributeTable or None
+        """
+
+        self.fields = []
+        if data is None:
+            return
+
+        if len(data) == 0:
+            msg = ('Input parameter "data" was specified '
+                   'but appears to be empty')
+            raise Exception(msg)
+
+        for name in data.keys():
+
+            # Establish OGR type for field
+            ogrtype = get_ogr_field_type(data.columns[name])
+            fd = ogr.FieldDefn(name, ogrtype)
+
+            # FIXME (Ole): Trying to address issue #16
+            #              But it doesn't work and
+            #              somehow changes the values of MMI in test
+            #width = max(128, len(name))
+            #print name, width
+            #fd.SetWidth(width)
+
+            if self.lyr.CreateField(fd) != 0:
+                msg = 'Could not create field %s' % name
+                raise Exception(msg)
+
+            self.fields.append(name)
+
+    def write(self, V):
+        """Append features of vector layer to file
+
+        Input
+            V: Vector layer with the geometry type of this file
+
+        Features are written in chunks of WRITE_CHUNK_SIZE. For formats
+        supporting transactions, such as GeoPackage, each chunk is written
+        in one transaction.
+        """
+
+        msg = ('Cannot write %s geometries of vector layer %s to file %s '
+               'of %s geometries' % (V.geometry_type, V, self.filename,
+                                     self.geometry_type))
+        assert V.geometry_type == self.geometry_type, msg
+
+        data = V.get_data()
+        if self.fields is None:
+            self.define_fields(data)
+
+        # Coordinates and values as Python objects converted in bulk
+        geometry = V.get_geometry()
+        N = len(geometry)
+        if self.geometry_type == 'point':
+            coordinates = geometry.tolist()
+
+        fields = []
+        for j, name in enumerate(self.fields):
+            msg = ('Field %s was not found in vector layer %s'
+                   % (name, V))
+            assert data is not None and name in data.columns, msg
+            fields.append((j, data.columns[name].tolist()))
+
+        lyr = self.lyr
+        feature = self.feature
+        pt = self.point
+        transactions = lyr.TestCapability(ogr.OLCTransactions)
+
+        for start in range(0, N, WRITE_CHUNK_SIZE):
+            if transactions:
+                lyr.StartTransaction()
+
+            for i in range(start, min(start + WRITE_CHUNK_SIZE, N)):
+                if self.geometry_type == 'point':
+                    x, y = coordinates[i]
+                    pt.SetPoint_2D(0, x, y)
+                    feature.SetGeometry(pt)
+                else:
+                    k = geometry.feature_offsets[i]
+                    holes = geometry.holes[k:geometry.feature_offsets[i + 1]]
+                    G = make_ogr_geometry(geometry[i], holes,
+                                          self.geometry_type)
+                    feature.SetGeometryDirectly(G)
+
+                # Attributes
+                for j, column in fields:
+                    value = column[i]
+                    if value is None:
+                        feature.UnsetField(j)
+                    else:
+                        feature.SetField(j, value)
+
+                # Save this feature as a new one
+                feature.SetFID(-1)
+                if lyr.CreateFeature(feature) != 0:
+                    msg = ('Failed to create feature %i in file '
+                           '%s' % (self.number_of_features + i,
+                                   self.filename))
+                    raise Exception(msg)
+
+            if transactions:
+                lyr.CommitTransaction()
+
+        self.number_of_features += N
+
+    def close(self):
+        """Flush features to file and close it
+        """
+
+        self.feature.Destroy()
+        self.feature = None
+        self.lyr = None
+        self.ds = None
+
+
+def get_ogr_field_type(column):
+    """Get OGR field type for column of attribute values
+
+    Input
+        column: Numpy array of attribute values
+
+    Output
+        OGR field type. Object columns get the type of their first value
+        which is not None (missing) and string if all values are missing.
+    """
+
+    if column.dtype.kind in 'biu':
+        return ogr.OFTInteger
+    elif column.dtype.kind == 'f':
+        return ogr.OFTReal
+
+    for value in column:
+        if value is not None:
+            return TYPE_MAP[type(value)]
+
+    return ogr.OFTString
+
+
+def read_chunk(layer, filename, N=None):
+    """Read next features of OGR layer sequentially
+
+    Input
+        layer: OGR layer positioned at the first feature to read
+        filename: Name of file the layer was read from (for messages)
+        N: Maximal number of features to read. If None, all remaining
+           features are read.
+
+    Output
+        geometry: Array of point coordinates (longitude, latitude) or
+                  PackedGeometry of lines or polygons
+        data: AttributeTable of features read
+    """
+
+    # Resolve names and types of fields once
+    definition = layer.GetLayerDefn()
+    names = []
+    types = []
+    for j in range(definition.GetFieldCount()):
+        field = definition.GetFieldDefn(j)
+        names.append(field.GetName())
+        types.append(field.GetType())
+
+    # Extract geometries and attributes reading the layer sequentially.
+    # All features must have the geometry type of the first one.
+    geometry_type = None
+    geometry = []
+    holes = []
+    values = [[] for name in names]
+    fields = zip(range(len(names)), values)
+
+    while N is None or len(geometry) < N:
+        feature = layer.GetNextFeature()
+        if feature is None:
+            break
+
+        # Record geometry
+        G = feature.GetGeometryRef()
+        if G is None:
+            feature_type = None
+        else:
+            feature_type = get_geometry_type(G.GetGeometryType())
+
+        if geometry_type is None:
+            geometry_type = feature_type
+
+        if feature_type is None or feature_type != geometry_type:
+            if G is None:
+                ogr_type = None
+            else:
+                ogr_type = G.GetGeometryName()
+
+            msg = ('Only point, line and polygon geometries of one type '
+                   'are supported. Geometry of feature %i in filename %s '
+                   'was %s. Expected %s.' % (feature.GetFID(), filename,
+                                             ogr_type, geometry_type))
+            raise Exception(msg)
+
+        if geometry_type == 'point':
+            # Longitude, Latitude
+            geometry.append((G.GetX(), G.GetY()))
+        else:
+            parts, flags = get_ogr_parts(G)
+            geometry.append(parts)
+            holes.append(flags)
+
+        # Record attributes
+        for j, column in fields:
+            column.append(feature.GetField(j))
+
+    # Cast fields to columns according to their OGR types
+    data = OrderedDict()
+    for name, ogr_type, column in zip(names, types, values):
+        data[name] = make_column(column, OGR_TYPE_MAP.get(ogr_type))
+
+    if geometry_type in ['line', 'polygon']:
+        geometry = pack_geometry(geometry, geometry_type, holes=holes)
+    else:
+        geometry = numpy.array(geometry, dtype='d', copy=False)
+
+    return geometry, AttributeTable(data)
+
+
+def check_ranking_arguments(attribute, N):
+    """Check arguments of Vector.get_topN and Vector.get_bottomN
+    """
+
+    msg = ('Specfied attribute must be a string. '
+           'I got %s' % (type(attribute)))
+    assert isinstance(attribute, basestring), msg
+
+    msg = 'Specified attribute was empty'
+    assert attribute != '', msg
+
+    msg = 'N must be a positive number. I got %i' % N
+    assert N > 0, msg
+
+
+def select_extremes(values, N, largest=True):
+    """Find indices of the N largest or smallest values
+
+    Input
+        values: Array of values, e.g. column of attribute table
+        N: How many
+        largest: If True select the largest values otherwise the smallest
+
+    Output
+        Array of at most N indices ordered by increasing value. Missing
+        values (None or NaN) are left out. Ties are ordered by index.
+
+    Values are partitioned rather than sorted so the cost is linear in the
+    number of values plus N log N for ordering the selection.
+    """
+
+    values = numpy.asarray(values)
+    if values.dtype.kind == 'f':
+        candidates = numpy.nonzero(~numpy.isnan(values))[0]
+    elif values.dtype.kind == 'O':
+        candidates = numpy.array([i for i, value in enumerate(values)
+                                  if value is not None and value == value],
+                                 dtype='l')
+    else:
+        candidates = numpy.arange(len(values))
+
+    values = values[candidates]
+    M = len(values)
+    N = min(N, M)
+    if N == 0:
+        return numpy.zeros(0, dtype='l')
+
+    if largest:
+        selection = numpy.argpartition(values, M - N)[M - N:]
+    else:
+        selection = numpy.argpartition(values, N - 1)[:N]
+
+    selection.sort()
+    order = numpy.argsort(values[selection], kind='mergesort')
+    return candidates[selection[order]]
@@ -0,0 +1,777 @@
+"""Benchmarks for the Risk in a Box impact engine
+
+Each benchmark times a computation before and after it was optimised.
+At the sizes used below they take a long time to run, so run them from
+the command line using e.g.
+
+python benchmarks.py
+
+and compare the timings before and after changes to the engine. The
+unit test suite runs all benchmarks with small sizes (see
+test_benchmarks.py) so that they keep working as the engine changes.
+"""
+
+import os
+import time
+import resource
+import traceback
+import numpy
+from osgeo import ogr
+
+from impact.storage.raster import Raster
+from impact.storage.vector import Vector
+from impact.storage.utilities import DEFAULT_PROJECTION
+from impact.storage.utilities import unique_filename
+from impact.storage.geometry import pack_geometry
+from impact.storage.spatial_index import SpatialIndex
+from impact.storage.io import read_layer
+from impact.engine.core import calculate_impact
+from impact.engine.core import FEATURE_CHUNK_SIZE
+from impact.engine.interpolation import interpolate_raster_points
+from impact.engine.interpolation import INTERPOLATION_METHODS
+from impact.engine.interpolation import RESAMPLING_METHODS
+from impact.engine.aggregation import zonal_statistics, Zones
+from impact.engine.aggregation import aggregate_points
+from impact.plugins import get_plugins
+from impact.plugins.core import compatible_layers, requirements_collect
+from impact.plugins.core import LayerIndex
+from impact.plugins.utilities import Damage_curve
+from impact.tests.utilities import tsunami_building_loss_by_loop
+
+
+def synthetic_raster(rows, columns, dtype='d'):
+    """Create in-memory raster layer with a smooth surface
+
+    The raster covers [100, 110] x [-5, 5] degrees.
+    """
+
+    lon_ul = 100.0
+    lat_ul = 5.0
+    dx = 10.0 / columns
+    dy = 10.0 / rows
+
+    x = numpy.linspace(0, 1, columns)
+    y = numpy.linspace(0, 1, rows)
+    A = numpy.sin(6 * x)[numpy.newaxis, :] + numpy.cos(4 * y)[:, numpy.newaxis]
+
+    return Raster(A.astype(dtype),
+                  projection=DEFAULT_PROJECTION,
+                  geotransform=(lon_ul, dx, 0, lat_ul, 0, -dy),
+                  name='Synthetic raster')
+
+
+def random_points(N, bbox=(100, -5, 110, 5)):
+    """Generate Nx2 array of random points within bbox
+
+    Bounding box format is [West, South, East, North]
+    """
+
+    coordinates = numpy.empty((N, 2))
+    coordinates[:, 0] = numpy.random.uniform(bbox[0], bbox[2], N)
+    coordinates[:, 1] = numpy.random.uniform(bbox[1], bbox[3], N)
+    return coordinates
+
+
+def timeit(func, *args, **kwargs):
+    """Return result of func(*args, **kwargs) and elapsed time in seconds
+    """
+
+    t0 = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - t0
+
+
+def benchmark_interpolation(sizes=(10 ** 3, 10 ** 4, 10 ** 5,
+                                   10 ** 6, 10 ** 7),
+                            methods=INTERPOLATION_METHODS):
+    """Scaling of raster to point interpolation with number of points
+    """
+
+    print
+    print 'Raster to point interpolation (300 x 400 grid)'
+    print '%12s %12s %12s %16s' % ('method', 'points', 'time [s]', 'points/s')
+
+    R = synthetic_raster(300, 400)
+    for method in methods:
+        for N in sizes:
+            coordinates = random_points(N)
+            _, t = timeit(interpolate_raster_points, R, coordinates, method)
+            print '%12s %12i %12.3f %16.0f' % (method, N, t,
+                                               N / max(t, 1.0e-9))
+
+
+def benchmark_large_grid(rows=10000, columns=10000, N=10 ** 6):
+    """Grid interpolation methods on a large grid
+
+    The spline method is left out as fitting it to a grid of this size
+    is prohibitively expensive.
+    """
+
+    print
+    print 'Raster to point interpolation (%i x %i grid)' % (rows, columns)
+    print '%12s %12s %12s %16s' % ('method', 'points', 'time [s]', 'points/s')
+
+    R = synthetic_raster(rows, columns, dtype='f')
+    coordinates = random_points(N)
+    for method in ['nearest', 'bilinear']:
+        _, t = timeit(interpolate_raster_points, R, coordinates, method)
+        print '%12s %12i %12.3f %16.0f' % (method, N, t, N / max(t, 1.0e-9))
+
+
+def benchmark_resampling(rows=5000, columns=5000):
+    """Resampling between misaligned grids of similar resolution
+    """
+
+    print
+    print 'Raster to raster resampling (%i x %i grids)' % (rows, columns)
+    print '%12s %12s %12s' % ('method', 'cells', 'time [s]')
+
+    R = synthetic_raster(rows, columns, dtype='f')
+    X = Raster(numpy.zeros((rows, columns), dtype='f'),
+               projection=DEFAULT_PROJECTION,
+               geotransform=(100.3, 9.7 / columns, 0,
+                             4.8, 0, -9.6 / rows))
+
+    for method in RESAMPLING_METHODS:
+        _, t = timeit(R.interpolate, X, method=method)
+        print '%12s %12i %12.3f' % (method, rows * columns, t)
+
+
+def peak_memory(func, *args, **kwargs):
+    """Run func(*args, **kwargs) in a child process
+
+    Output
+        result: Value returned by func converted to float
+        rss: Peak resident set size of the child process in MB
+
+    The child is forked so that memory held by earlier benchmarks does
+    not count. Peak memory of an empty function is the baseline.
+    """
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # Child process. It must never return to the caller, also
+        # when func fails.
+        os.close(read)
+        try:
+            result = func(*args, **kwargs)
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            os.write(write, '%r %r' % (float(result or 0), rss))
+        except:
+            traceback.print_exc()
+        os._exit(0)
+
+    os.close(write)
+    output = os.read(read, 128)
+    os.close(read)
+    os.waitpid(pid, 0)
+
+    msg = 'Benchmark %s failed in child process' % func
+    assert output != '', msg
+    result, rss = output.split()
+
+    # Linux reports kilobytes
+    return float(result), float(rss) / 1024
+
+
+def population_workload(rows, columns, dtype, compute_dtype=None):
+    """Fatality type calculation on a synthetic national population grid
+
+    Input
+        rows, columns: Grid dimensions
+        dtype: Data type the population grid is held in
+        compute_dtype: Data type requested from get_data
+    """
+
+    H = synthetic_raster(rows, columns, dtype='f')
+    P = Raster(numpy.random.uniform(0, 1000, (rows, columns)).astype(dtype),
+               projection=DEFAULT_PROJECTION,
+               geotransform=H.get_geotransform())
+
+    I = H.get_data(nan=0, dtype=compute_dtype)
+    F = I * P.get_data(nan=0, dtype=compute_dtype)
+    return numpy.sum(F)
+
+
+def benchmark_memory(rows=5000, columns=4000):
+    """Peak memory of a fatality calculation with float64 and native data
+
+    The grid size corresponds to a national population grid at 30 arc
+    seconds. The float64 case corresponds to Raster coercing all data to
+    double precision.
+    """
+
+    print
+    print 'Peak memory (%i x %i grid)' % (rows, columns)
+    print '%24s %12s' % ('case', 'peak [MB]')
+
+    _, baseline = peak_memory(lambda: None)
+    for label, dtype, compute_dtype in [('float64', 'd', 'd'),
+                                        ('float32 native', 'f', None)]:
+        _, rss = peak_memory(population_workload, rows, columns,
+                             dtype, compute_dtype)
+        print '%24s %12.1f' % (label, rss - baseline)
+
+
+def replace_nodata_with_where(R, NAN):
+    """NODATA replacement as done before masks were used for comparison
+    """
+
+    A = R.get_data()
+    NaN = numpy.ones(A.shape, A.dtype) * NAN
+    return numpy.where(A == R.get_nodata_value(), NaN, A)
+
+
+def benchmark_nodata(rows=20000, columns=20000):
+    """Time and peak memory of NODATA replacement on a large grid
+
+    The grid is single precision with 1% NODATA values.
+    """
+
+    def workload(func):
+        R = synthetic_raster(rows, columns, dtype='f')
+        R.data[::10, ::10] = R.get_nodata_value()
+        _, t = timeit(func, R)
+        return t
+
+    print
+    print 'NODATA replacement (%i x %i grid)' % (rows, columns)
+    print '%24s %12s %12s' % ('method', 'time [s]', 'peak [MB]')
+
+    _, baseline = peak_memory(lambda: None)
+    for label, func in [('where', lambda R: replace_nodata_with_where(R, 0)),
+                        ('mask', lambda R: R.get_data(nan=0))]:
+        t, rss = peak_memory(workload, func)
+        print '%24s %12.3f %12.1f' % (label, t, rss - baseline)
+
+
+def building_records(N):
+    """Generate N dictionaries of building attributes
+    """
+
+    wall_types = ['Brick', 'Timber', 'Concrete']
+    return [{'STR_VALUE': 1000.0 * i, 'CONT_VALUE': 100.0 * i,
+             'NEXIS_PEOP': i % 10, 'WALL_TYPE': wall_types[i % 3],
+             'SHORE_DIST': 10.0 * (i % 100)}
+            for i in xrange(N)]
+
+
+def attribute_values(data, name):
+    """Values of attribute from list of dictionaries
+    """
+
+    return [x[name] for x in data]
+
+
+def resident_memory():
+    """Current resident set size of this process in MB (Linux only)
+    """
+
+    pages = int(open('/proc/self/statm').read().split()[1])
+    return pages * resource.getpagesize() / 1024.0 ** 2
+
+
+def benchmark_vector_attributes(N=10 ** 6):
+    """Memory held by attributes of a vector layer with N buildings
+    and time taken to access one attribute for all buildings
+    """
+
+    def workload(columnar):
+        coordinates = random_points(N)
+        before = resident_memory()
+
+        data = building_records(N)
+        if columnar:
+            V = Vector(data=data, projection=DEFAULT_PROJECTION,
+                       geometry=coordinates)
+            del data
+            _, t = timeit(V.get_data, 'STR_VALUE')
+        else:
+            # List of dictionaries as held before columns were used
+            _, t = timeit(attribute_values, data, 'STR_VALUE')
+
+        print '%12.6f' % t,
+        return resident_memory() - before
+
+    print
+    print 'Vector attributes (%i features)' % N
+    print '%24s %12s %12s' % ('storage', 'access [s]', 'held [MB]')
+
+    for label, columnar in [('list of dictionaries', False),
+                            ('columns', True)]:
+        print '%24s' % label,
+        held, _ = peak_memory(workload, columnar)
+        print '%12.1f' % held
+
+
+def read_features_by_index(filename):
+    """Read point layer the way Vector did before reading sequentially
+
+    Features are fetched by index and fields are looked up per feature.
+    """
+
+    fid = ogr.Open(filename)
+    layer = fid.GetLayerByIndex(0)
+
+    geometry = []
+    data = []
+    for i in range(layer.GetFeatureCount()):
+        feature = layer.GetFeature(i)
+        G = feature.GetGeometryRef()
+        geometry.append((G.GetX(), G.GetY()))
+
+        fields = {}
+        for j in range(feature.GetFieldCount()):
+            name = feature.GetFieldDefnRef(j).GetName()
+            fields[name] = feature.GetField(j)
+        data.append(fields)
+
+    return geometry, data
+
+
+def benchmark_vector_reading(N=10 ** 5):
+    """Features read per second from a shapefile with N buildings
+    """
+
+    filename = unique_filename(suffix='.shp')
+    V = Vector(data=building_records(N), projection=DEFAULT_PROJECTION,
+               geometry=random_points(N))
+    V.write_to_file(filename)
+
+    print
+    print 'Vector reading (%i features)' % N
+    print '%24s %12s %16s' % ('reader', 'time [s]', 'features/s')
+
+    for label, func in [('by index', read_features_by_index),
+                        ('sequential', Vector)]:
+        _, t = timeit(func, filename)
+        print '%24s %12.3f %16.0f' % (label, t, N / max(t, 1.0e-9))
+
+
+def benchmark_vector_writing(N=10 ** 5):
+    """Features written per second for N buildings in each format
+    """
+
+    V = Vector(data=building_records(N), projection=DEFAULT_PROJECTION,
+               geometry=random_points(N))
+
+    print
+    print 'Vector writing (%i features)' % N
+    print '%24s %12s %16s' % ('format', 'time [s]', 'features/s')
+
+    for extension in ['.shp', '.gpkg']:
+        filename = unique_filename(suffix=extension)
+        _, t = timeit(V.write_to_file, filename)
+        print '%24s %12.3f %16.0f' % (extension, t, N / max(t, 1.0e-9))
+
+
+def write_buildings(N, filename):
+    """Write shapefile with N buildings at random locations
+    """
+
+    V = Vector(data=building_records(N), projection=DEFAULT_PROJECTION,
+               geometry=random_points(N))
+    V.write_to_file(filename)
+
+
+def benchmark_chunked_impact(N=10 ** 5, chunk_size=FEATURE_CHUNK_SIZE):
+    """Time and peak memory of tsunami building loss for N buildings
+    computed with all buildings in memory and chunk by chunk
+    """
+
+    from impact.plugins.tsunami.NEXIS_building_impact_model import \
+        TsunamiBuildingLossFunction
+
+    filename = unique_filename(suffix='.shp')
+    peak_memory(write_buildings, N, filename)
+
+    def workload(chunk_size):
+        H = synthetic_raster(300, 400)
+        E = read_layer(filename, chunk_size=chunk_size)
+        _, t = timeit(calculate_impact, [H, E], TsunamiBuildingLossFunction)
+        return t
+
+    print
+    print 'Tsunami building loss (%i buildings)' % N
+    print '%24s %12s %12s' % ('features', 'time [s]', 'peak [MB]')
+
+    _, baseline = peak_memory(lambda: None)
+    for label, size in [('all', None),
+                        ('chunks of %i' % chunk_size, chunk_size)]:
+        t, rss = peak_memory(workload, size)
+        print '%24s %12.3f %12.1f' % (label, t, rss - baseline)
+
+
+def random_footprints(N, vertices=6):
+    """Generate N random convex polygons resembling building footprints
+    """
+
+    centres = random_points(N)
+    angles = numpy.linspace(0, 2 * numpy.pi, vertices, endpoint=False)
+    radii = numpy.random.uniform(1.0e-4, 1.0e-3, N)
+
+    footprints = []
+    for (x, y), r in zip(centres, radii):
+        ring = zip(x + r * numpy.cos(angles), y + r * numpy.sin(angles))
+        footprints.append([ring])
+    return footprints
+
+
+def footprint_areas_and_centroids(footprints):
+    """Areas and centroids computed one polygon at a time
+    """
+
+    areas = []
+    centroids = []
+    for parts in footprints:
+        ring = parts[0]
+        a = cx = cy = 0.0
+        for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+            c = x0 * y1 - x1 * y0
+            a += c
+            cx += (x0 + x1) * c
+            cy += (y0 + y1) * c
+        areas.append(abs(a) / 2)
+        centroids.append((cx / (3 * a), cy / (3 * a)))
+    return areas, centroids
+
+
+def benchmark_polygon_geometry(N=10 ** 6):
+    """Areas and centroids of N building footprints
+    """
+
+    footprints = random_footprints(N)
+    G = pack_geometry(footprints, 'polygon')
+
+    print
+    print 'Polygon areas and centroids (%i polygons)' % N
+    print '%24s %12s %16s' % ('method', 'time [s]', 'polygons/s')
+
+    def packed_areas_and_centroids(G):
+        return G.get_areas(), G.get_centroids()
+
+    for label, func, geometry in [('per polygon',
+                                   footprint_areas_and_centroids, footprints),
+                                  ('packed', packed_areas_and_centroids, G)]:
+        _, t = timeit(func, geometry)
+        print '%24s %12.3f %16.0f' % (label, t, N / max(t, 1.0e-9))
+
+
+def bbox_by_exhaustive_search(coordinates, bboxes):
+    """Features within each bounding box found by testing all points
+    """
+
+    x = coordinates[:, 0]
+    y = coordinates[:, 1]
+    return [numpy.nonzero((x >= w) & (x <= e) & (y >= s) & (y <= n))[0]
+            for w, s, e, n in bboxes]
+
+
+def bbox_by_index(index, bboxes):
+    """Features within each bounding box found using spatial index
+    """
+
+    return [index.query_bbox(bbox) for bbox in bboxes]
+
+
+def benchmark_spatial_index(N=10 ** 6, queries=1000):
+    """Bounding box queries of 0.1 x 0.1 degrees among N points
+    """
+
+    coordinates = random_points(N)
+    corners = random_points(queries)
+    bboxes = numpy.hstack([corners, corners + 0.1])
+
+    print
+    print 'Bounding box queries (%i points, %i queries)' % (N, queries)
+    print '%24s %12s %16s' % ('method', 'time [s]', 'queries/s')
+
+    _, t = timeit(bbox_by_exhaustive_search, coordinates, bboxes)
+    print '%24s %12.3f %16.0f' % ('exhaustive', t, queries / max(t, 1.0e-9))
+
+    index, t = timeit(SpatialIndex, numpy.hstack([coordinates, coordinates]))
+    print '%24s %12.3f' % ('build index', t)
+
+    _, t = timeit(bbox_by_index, index, bboxes)
+    print '%24s %12.3f %16.0f' % ('index', t, queries / max(t, 1.0e-9))
+
+
+def district_polygons(K, vertices_per_side=25, bbox=(100, -5, 110, 5)):
+    """Tile bounding box with K x K square districts
+
+    Each side has the given number of vertices to resemble the detail
+    of administrative boundaries.
+    """
+
+    west, south, east, north = bbox
+    dx = float(east - west) / K
+    dy = float(north - south) / K
+    t = numpy.linspace(0, 1, vertices_per_side, endpoint=False)
+
+    features = []
+    for i in range(K):
+        for j in range(K):
+            x0 = west + j * dx
+            y0 = south + i * dy
+            x = numpy.concatenate([x0 + t * dx, x0 + dx + 0 * t,
+                                   x0 + dx - t * dx, x0 + 0 * t])
+            y = numpy.concatenate([y0 + 0 * t, y0 + t * dy,
+                                   y0 + dy + 0 * t, y0 + dy - t * dy])
+            features.append([zip(x, y)])
+
+    G = pack_geometry(features, 'polygon')
+    return Vector(data={'ID': numpy.arange(K * K)},
+                  projection=DEFAULT_PROJECTION, geometry=G)
+
+
+def benchmark_zonal_statistics(rows=10000, columns=10000, K=50):
+    """Aggregation of a raster by K x K districts
+
+    The first run includes rasterization of the districts. The second
+    run reuses the rasterization.
+    """
+
+    R = synthetic_raster(rows, columns, dtype='f')
+    zones = Zones(district_polygons(K))
+
+    print
+    print 'Zonal statistics (%i x %i grid, %i regions)' % (rows, columns,
+                                                           K * K)
+    print '%24s %12s' % ('run', 'time [s]')
+
+    for label in ['rasterize and aggregate', 'aggregate']:
+        _, t = timeit(zonal_statistics, R, zones)
+        print '%24s %12.3f' % (label, t)
+
+
+def regions_by_ray_casting(coordinates, G):
+    """Region of each point found by testing every ring of every region
+    """
+
+    region = -numpy.ones(len(coordinates), dtype='l')
+    for i, (x, y) in enumerate(coordinates):
+        for k in range(len(G)):
+            inside = False
+            for ring in G[k]:
+                for j in range(len(ring)):
+                    x0, y0 = ring[j - 1]
+                    x1, y1 = ring[j]
+                    if (y0 <= y) != (y1 <= y):
+                        if x < x0 + (y - y0) * (x1 - x0) / (y1 - y0):
+                            inside = not inside
+            if inside:
+                region[i] = k
+                break
+    return region
+
+
+def benchmark_point_aggregation(N=10 ** 6, K=50, sample=100):
+    """Aggregation of N points by K x K districts
+
+    Point in polygon tests of a point at a time are too slow for all
+    points and are timed for a sample only.
+    """
+
+    V = district_polygons(K)
+    coordinates = random_points(N)
+    P = Vector(data={'LOSS': numpy.random.uniform(0, 1000, N)},
+               projection=DEFAULT_PROJECTION, geometry=coordinates)
+
+    print
+    print 'Point aggregation (%i points, %i regions)' % (N, K * K)
+    print '%24s %12s %16s' % ('method', 'time [s]', 'points per sec')
+
+    _, t = timeit(regions_by_ray_casting, coordinates[:sample],
+                  V.get_geometry())
+    print '%24s %12.3f %16.0f' % ('loop over points', t,
+                                  sample / max(t, 1.0e-9))
+
+    _, t = timeit(aggregate_points, P, V)
+    print '%24s %12.3f %16.0f' % ('aggregate_points', t, N / max(t, 1.0e-9))
+
+
+def compare_records(V, W, rtol=1.0e-5, atol=1.0e-8):
+    """Compare attributes of vector layers a value at a time
+
+    This is how Vector.__eq__ compared attributes before whole columns
+    were compared.
+    """
+
+    x = V.get_data()
+    y = W.get_data()
+    for i, a in enumerate(x):
+        for key in a:
+            if a[key] != y[i][key]:
+                if not numpy.allclose(a[key], y[i][key],
+                                      rtol=rtol, atol=atol):
+                    return False
+    return True
+
+
+def benchmark_vector_comparison(N=10 ** 6):
+    """Comparison of two vector layers with N buildings
+    """
+
+    coordinates = random_points(N)
+    V = Vector(data=building_records(N), projection=DEFAULT_PROJECTION,
+               geometry=coordinates)
+    W = Vector(data=building_records(N), projection=DEFAULT_PROJECTION,
+               geometry=coordinates.copy())
+
+    print
+    print 'Vector comparison (%i features)' % N
+    print '%24s %12s' % ('method', 'time [s]')
+
+    for label, func in [('value by value', compare_records),
+                        ('column by column', Vector.__eq__)]:
+        equal, t = timeit(func, V, W)
+        assert equal
+        print '%24s %12.3f' % (label, t)
+
+
+def benchmark_tsunami_loss(N=10 ** 6, sample=10 ** 4):
+    """Tsunami building loss for N buildings
+
+    Losses computed one building at a time are too slow for all buildings
+    and are timed for a sample only.
+    """
+
+    from impact.plugins.tsunami import NEXIS_building_impact_model
+
+    H = synthetic_raster(1000, 1000)
+    E = Vector(data=building_records(N), projection=DEFAULT_PROJECTION,
+               geometry=random_points(N))
+
+    plugin_name = 'Tsunami Building Loss Function'
+    IF = get_plugins(plugin_name)[0][plugin_name]
+
+    print
+    print 'Tsunami building loss (%i buildings)' % N
+    print '%24s %12s %20s' % ('method', 'time [s]', 'buildings per sec')
+
+    depths = H.interpolate(E).get_data(H.get_name())
+    loop, t = timeit(tsunami_building_loss_by_loop, depths[:sample], E)
+    print '%24s %12.3f %20.0f' % ('loop over buildings', t,
+                                  sample / max(t, 1.0e-9))
+
+    I, t = timeit(IF.run, [H, E])
+    print '%24s %12.3f %20.0f' % ('whole arrays', t, N / max(t, 1.0e-9))
+
+    # Both methods give the same losses
+    coordinates = E.get_geometry()[:sample]
+    reference = Vector(data=loop, projection=DEFAULT_PROJECTION,
+                       geometry=coordinates)
+    assert I.take(slice(0, sample)) == reference
+
+
+def benchmark_damage_curves(N=10 ** 6):
+    """Evaluation of a damage curve for N depths
+    """
+
+    from scipy.interpolate import interp1d
+
+    points = numpy.array([[0.0, 0.016], [0.1, 0.169], [0.3, 0.445],
+                          [0.5, 0.472], [1.0, 0.618], [1.5, 0.629],
+                          [2.0, 0.633], [2.5, 0.694], [10.0, 0.694]])
+    curve = Damage_curve(points)
+    table = curve.tabulate(0.0, 10.0, 0.01)
+    depths = numpy.round(numpy.random.uniform(0, 10, N), 2)
+
+    print
+    print 'Damage curve (%i depths)' % N
+    print '%24s %12s' % ('method', 'time [s]')
+
+    for label, func in [('interp1d', interp1d(points[:, 0], points[:, 1])),
+                        ('numpy.interp', curve),
+                        ('lookup table', table)]:
+        _, t = timeit(func, depths)
+        print '%24s %12.3f' % (label, t)
+
+
+def requirement_check_by_exec(params, require_str):
+    """Check requirement by compiling source code with the keywords
+
+    This is how requirements were checked before they were compiled once.
+    """
+
+    execstr = 'def check():\n'
+    for key in params.keys():
+        execstr += '  %s = "%s" \n' % (key.strip(), params[key])
+    execstr += '  return ' + require_str
+
+    try:
+        exec(compile(execstr, '<string>', 'exec'))
+        return check()
+    except NameError:
+        return False
+
+
+def compatible_layers_by_exec(func, layers_data):
+    """Compatible layers found by requirement_check_by_exec
+    """
+
+    requirements = requirements_collect(func)
+    return [name for name, params in layers_data
+            if len(requirements) == 0 or
+            any([requirement_check_by_exec(params, requires)
+                 for requires in requirements])]
+
+
+def benchmark_plugin_requirements(N=10000):
+    """Matching of all plugins against N layers
+    """
+
+    categories = [('hazard', 'earthquake', 'raster'),
+                  ('hazard', 'tsunami', 'raster'),
+                  ('exposure', 'population', 'raster'),
+                  ('exposure', 'building', 'feature')]
+    layers = []
+    for i in range(N):
+        category, subcategory, layer_type = categories[i % 4]
+        layers.append(('layer%i' % i, {'category': category,
+                                       'subcategory': subcategory,
+                                       'layer_type': layer_type,
+                                       'unit': 'm',
+                                       'title': 'Layer %i' % i}))
+
+    plugins = get_plugins().values()
+
+    print
+    print 'Plugin requirements (%i plugins, %i layers)' % (len(plugins), N)
+    print '%24s %12s' % ('method', 'time [s]')
+
+    def match_all(func):
+        return [func(plugin, layers) for plugin in plugins]
+
+    def match_all_by_index():
+        index = LayerIndex(layers)
+        return [index.compatible_layers(plugin) for plugin in plugins]
+
+    for label, func in [('exec for each layer', compatible_layers_by_exec),
+                        ('compiled once', compatible_layers)]:
+        _, t = timeit(match_all, func)
+        print '%24s %12.3f' % (label, t)
+
+    _, t = timeit(match_all_by_index)
+    print '%24s %12.3f' % ('keyword index', t)
+
+
+if __name__ == '__main__':
+    benchmark_interpolation()
+    benchmark_large_grid()
+    benchmark_resampling()
+    benchmark_memory()
+    benchmark_nodata()
+    benchmark_vector_attributes()
+    benchmark_vector_reading()
+    benchmark_vector_writing()
+    benchmark_chunked_impact()
+    benchmark_polygon_geometry()
+    benchmark_spatial_index()
+    benchmark_zonal_statistics()
+    benchmark_point_aggregation()
+    benchmark_vector_comparison()
+    benchmark_tsunami_loss()
+    benchmark_damage_curves()
+    benchmark_plugin_requirements()
@@ -0,0 +1,81 @@
+import unittest
+import numpy
+import sys
+from StringIO import StringIO
+
+from impact.tests import benchmarks
+
+
+def run_benchmark(func, **kwargs):
+    """Run benchmark and return the table it prints
+    """
+
+    stdout = sys.stdout
+    try:
+        sys.stdout = StringIO()
+        func(**kwargs)
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+class Test_Benchmarks(unittest.TestCase):
+    """Benchmarks run with small sizes
+
+    Full sizes are run from the command line (see benchmarks.py).
+    """
+
+    def setUp(self):
+        numpy.random.seed(31)
+
+    def test_raster_benchmarks(self):
+        """Raster benchmarks run
+        """
+
+        run_benchmark(benchmarks.benchmark_interpolation, sizes=(100,))
+        run_benchmark(benchmarks.benchmark_large_grid,
+                      rows=100, columns=100, N=100)
+        run_benchmark(benchmarks.benchmark_resampling, rows=50, columns=50)
+        run_benchmark(benchmarks.benchmark_memory, rows=50, columns=40)
+        run_benchmark(benchmarks.benchmark_nodata, rows=100, columns=100)
+        run_benchmark(benchmarks.benchmark_zonal_statistics,
+                      rows=100, columns=100, K=3)
+
+    def test_vector_benchmarks(self):
+        """Vector benchmarks run
+        """
+
+        run_benchmark(benchmarks.benchmark_vector_attributes, N=100)
+        run_benchmark(benchmarks.benchmark_polygon_geometry, N=100)
+        run_benchmark(benchmarks.benchmark_spatial_index,
+                      N=1000, queries=10)
+        run_benchmark(benchmarks.benchmark_point_aggregation,
+                      N=1000, K=3, sample=10)
+        run_benchmark(benchmarks.benchmark_vector_comparison, N=100)
+
+    def test_vector_file_benchmarks(self):
+        """Benchmarks of vector files run
+        """
+
+        run_benchmark(benchmarks.benchmark_vector_reading, N=100)
+        run_benchmark(benchmarks.benchmark_vector_writing, N=100)
+        run_benchmark(benchmarks.benchmark_chunked_impact,
+                      N=100, chunk_size=30)
+
+    def test_plugin_benchmarks(self):
+        """Plugin benchmarks run and agree with the computations they time
+        """
+
+        output = run_benchmark(benchmarks.benchmark_tsunami_loss,
+                               N=1000, sample=100)
+        assert 'loop over buildings' in output
+        assert 'whole arrays' in output
+
+        run_benchmark(benchmarks.benchmark_damage_curves, N=1000)
+        run_benchmark(benchmarks.benchmark_plugin_requirements, N=20)
+
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_Benchmarks, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
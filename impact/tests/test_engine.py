@@ -4,16 +4,34 @@ import sys
 import os
 
 from impact.engine.core import calculate_impact
+from impact.engine.core import calculate_impact_with_aggregation
+from impact.engine.core import align_raster_layers
+from impact.engine.aggregation import zonal_statistics, Zones
+from impact.engine.aggregation import aggregate_points
+from impact.engine.aggregation import get_zones
+from impact.engine import interpolation
 from impact.engine.interpolation import raster_spline
+from impact.engine.interpolation import raster_interpolator
+from impact.engine.interpolation import interpolate_raster_points
+from impact.engine.interpolation import points_window
+from impact.engine.interpolation import InterpolatorCache
 from impact.storage.io import read_layer
+from impact.storage import raster
+from impact.storage import spatial_index
+from impact.storage.raster import Raster
+from impact.storage.vector import Vector
+from impact.storage.geometry import pack_geometry
 
 from impact.storage.utilities import unique_filename
+from impact.storage.utilities import DEFAULT_PROJECTION
+from impact.storage.utilities import window_geotransform
 from impact.storage.io import write_point_data
 from impact.storage.io import write_raster_data
 from impact.plugins import get_plugins
 
 from impact.tests.utilities import TESTDATA
 from impact.tests.utilities import DEMODATA
+from impact.tests.utilities import tsunami_building_loss_by_loop
 
 
 def linear_function(x, y):
@@ -23,6 +41,19 @@ def linear_function(x, y):
     return x + y / 2.
 
 
+def inside_rings(x, y, rings):
+    """Auxiliary function testing if point is inside rings (even-odd rule)
+    """
+
+    inside = False
+    for ring in rings:
+        for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+            if (y0 <= y) != (y1 <= y):
+                if x < x0 + (y - y0) * (x1 - x0) / float(y1 - y0):
+                    inside = not inside
+    return inside
+
+
 def lembang_damage_function(x):
     if x < 6.0:
         value = 0.0
@@ -507,6 +538,150 @@ class Test_Engine(unittest.TestCase):
             if depth > 0 and contents_damage > 0:
                 assert contents_damage != structural_damage
 
+    def test_tsunami_loss_in_chunks(self):
+        """Building loss from tsunami computed in chunks matches full run
+        """
+
+        from impact.plugins.tsunami import NEXIS_building_impact_model
+
+        hazard_filename = ('%s/tsunami_max_inundation_depth_BB_'
+                           'geographic.asc' % TESTDATA)
+        exposure_filename = ('%s/tsunami_exposure_BB.shp' % TESTDATA)
+
+        plugin_name = 'Tsunami Building Loss Function'
+        IF = get_plugins(plugin_name)[0][plugin_name]
+        assert IF.supports_chunks
+
+        H = read_layer(hazard_filename)
+        E = read_layer(exposure_filename)
+        impact_filename = calculate_impact(layers=[H, E],
+                                           impact_function=IF)
+        I = read_layer(impact_filename)
+
+        N = len(E)
+        for chunk_size in [1, 17, N]:
+            E = read_layer(exposure_filename, chunk_size=chunk_size)
+            chunk_filename = calculate_impact(layers=[H, E],
+                                              impact_function=IF)
+            assert os.path.isfile(chunk_filename.replace('.shp', '.sld'))
+
+            C = read_layer(chunk_filename)
+            assert len(C) == N
+
+            # Style is the same as for the full run
+            style = open(chunk_filename.replace('.shp', '.sld')).read()
+            assert style == open(impact_filename.replace('.shp',
+                                                         '.sld')).read()
+            assert numpy.allclose(C.get_geometry(), I.get_geometry())
+
+            # Compare values allowing for NaN where depth is unknown
+            for name in I.get_data().keys():
+                x = I.get_data(name)
+                y = C.get_data(name)
+                msg = 'Values of %s differ when computed in chunks' % name
+                assert numpy.all((x == y) | ((x != x) & (y != y))), msg
+
+        # Exposure without features gives no result
+        empty_filename = unique_filename(suffix='.shp')
+        read_layer(exposure_filename).take(slice(0, 0)).write_to_file(
+            empty_filename)
+        E0 = read_layer(empty_filename, chunk_size=10)
+        try:
+            calculate_impact(layers=[H, E0], impact_function=IF)
+        except AssertionError:
+            pass
+        else:
+            msg = 'Exposure layer without features should have raised error'
+            raise Exception(msg)
+
+        # Losses summed over west and east halves of exposure data
+        west, south, east, north = E.get_bounding_box()
+        middle = (west + east) / 2.
+        halves = [[[(west - 1, south - 1), (middle, south - 1),
+                    (middle, north + 1), (west - 1, north + 1)]],
+                  [[(middle, south - 1), (east + 1, south - 1),
+                    (east + 1, north + 1), (middle, north + 1)]]]
+        V = Vector(data={'NAME': ['west', 'east']},
+                   projection=E.get_projection(),
+                   geometry=pack_geometry(halves, 'polygon'))
+
+        impact_filename, aggregation_filename = \
+            calculate_impact_with_aggregation(layers=[H, E],
+                                              impact_function=IF,
+                                              aggregation_layer=V)
+        A = read_layer(aggregation_filename)
+        assert len(A) == 2
+        assert sum(A.get_data('COUNT')) == N
+
+        reference = aggregate_points(I, V)
+        for name in reference.get_data().keys():
+            if name != 'NAME':
+                assert numpy.allclose(A.get_data(name),
+                                      reference.get_data(name)), name
+
+    def test_tsunami_loss_vectorized(self):
+        """Tsunami building loss matches computation for each building
+        """
+
+        from impact.plugins.tsunami import NEXIS_building_impact_model
+
+        numpy.random.seed(23)
+
+        # Inundation depths with NODATA in some cells
+        numlon = 100
+        numlat = 50
+        A = numpy.random.uniform(-0.5, 3.0, (numlat, numlon))
+        A[::7, ::3] = -9999
+
+        # Blocks of 3 x 3 cells of given depth including NODATA (which
+        # interpolates as zero), thresholds and depths beyond the points
+        # of the damage curves
+        fixed_depths = [-9999, -5.0, 0.0, 0.01, 0.3, 0.31, 1.0, 2.5,
+                        30.0, 1.0e6]
+        for k, depth in enumerate(fixed_depths):
+            A[44:47, 4 * k + 10:4 * k + 13] = depth
+
+        H = Raster(A, projection=DEFAULT_PROJECTION,
+                   geotransform=(100, 0.1, 0, 0, 0, -0.1))
+
+        # Buildings of all wall types, some outside the hazard grid where
+        # depth is NaN, and buildings in the centres of the blocks of given
+        # depth. Some wall types are unknown or missing.
+        N = 2000
+        M = len(fixed_depths)
+        coordinates = numpy.zeros((N + M, 2))
+        coordinates[:N, 0] = numpy.random.uniform(99.5, 110, N)
+        coordinates[:N, 1] = numpy.random.uniform(-5, 0.5, N)
+        coordinates[N:N + M, 0] = 100.05 + 0.1 * (4 * numpy.arange(M) + 11)
+        coordinates[N:N + M, 1] = -4.55
+        N = len(coordinates)
+        wall_types = ['Double brick', 'Brick veneer', 'Timber', 'Concrete',
+                      None]
+        data = {'NEXIS_PEOP': numpy.random.randint(0, 20, N),
+                'WALL_TYPE': [wall_types[i % 5] for i in range(N)],
+                'CONT_VALUE': numpy.random.uniform(0, 1.0e5, N),
+                'STR_VALUE': numpy.random.uniform(0, 1.0e6, N),
+                'SHORE_DIST': numpy.random.uniform(0, 1000, N)}
+        E = Vector(data=data, projection=DEFAULT_PROJECTION,
+                   geometry=coordinates)
+
+        plugin_name = 'Tsunami Building Loss Function'
+        IF = get_plugins(plugin_name)[0][plugin_name]
+        I = IF.run([H, E])
+
+        depths = H.interpolate(E).get_data(H.get_name())
+        assert numpy.allclose(depths[-M:], [0] + fixed_depths[1:],
+                              rtol=1.0e-12, atol=1.0e-12)
+        assert numpy.any(numpy.isnan(depths))
+
+        reference = Vector(data=tsunami_building_loss_by_loop(depths, E),
+                           projection=DEFAULT_PROJECTION,
+                           geometry=coordinates)
+        differences = I.get_differences(reference, rtol=1.0e-12,
+                                        atol=1.0e-12)
+        msg = 'Vectorized losses differ from reference: %s' % differences
+        assert len(differences) == 0, msg
+
     def test_tephra_load_impact(self):
         """Hypothetical tephra load scenario can be computed
 
@@ -645,6 +820,607 @@ class Test_Engine(unittest.TestCase):
         # FIXME (Ole): Need test for values outside grid.
         #              They should be NaN or something
 
+    def test_interpolation_wrapper_vectorised(self):
+        """Interpolation library works for arrays of points
+        """
+
+        # Create test data
+        numlon = 8    # Number of longitudes
+        numlat = 5    # Number of latitudes
+        lon_ll = 100  # Longitude of lower left corner
+        lat_ll = 5    # Latitude of lower left corner
+
+        longitudes = numpy.linspace(lon_ll + 0.5,
+                                    lon_ll + numlon - 0.5, numlon)
+        latitudes = numpy.linspace(lat_ll + 0.5,
+                                   lat_ll + numlat - 0.5, numlat)
+
+        A = numpy.zeros((numlat, numlon))
+        for i in range(numlat):
+            for j in range(numlon):
+                A[numlat - 1 - i, j] = linear_function(longitudes[j],
+                                                       latitudes[i])
+
+        F = raster_spline(longitudes, latitudes, A)
+
+        # Interpolate a batch of points, some of which are outside the grid
+        xis = numpy.linspace(lon_ll - 1, lon_ll + numlon + 1, 37)
+        etas = numpy.linspace(lat_ll - 1, lat_ll + numlat + 1, 37)
+        values = F(xis, etas)
+        assert values.shape == xis.shape
+
+        for i, (xi, eta) in enumerate(zip(xis, etas)):
+            if (longitudes[0] <= xi <= longitudes[-1] and
+                latitudes[0] <= eta <= latitudes[-1]):
+                assert numpy.allclose(values[i], linear_function(xi, eta),
+                                      rtol=1e-12, atol=1e-12)
+
+                # Batch result must agree with pointwise evaluation
+                assert numpy.allclose(values[i], F(xi, eta),
+                                      rtol=1e-12, atol=1e-12)
+            else:
+                assert numpy.isnan(values[i])
+                assert numpy.isnan(F(xi, eta))
+
+    def test_interpolation_methods(self):
+        """Nearest, bilinear and spline interpolation methods are correct
+        """
+
+        # Create test data
+        lon_ul = 100  # Longitude of upper left corner
+        lat_ul = 10   # Latitude of upper left corner
+        numlon = 8    # Number of longitudes
+        numlat = 5    # Number of latitudes
+        dlon = 1
+        dlat = -1
+
+        lon_ll = lon_ul
+        lat_ll = lat_ul - numlat
+
+        longitudes = numpy.linspace(lon_ll + 0.5,
+                                    lon_ll + numlon - 0.5, numlon)
+        latitudes = numpy.linspace(lat_ll + 0.5,
+                                   lat_ll + numlat - 0.5, numlat)
+
+        A = numpy.zeros((numlat, numlon))
+        for i in range(numlat):
+            for j in range(numlon):
+                A[numlat - 1 - i, j] = linear_function(longitudes[j],
+                                                       latitudes[i])
+
+        geotransform = (lon_ul, dlon, 0, lat_ul, 0, dlat)
+        R = Raster(A, projection=DEFAULT_PROJECTION,
+                   geotransform=geotransform)
+
+        # Points inside and outside the pixel centers
+        xis = numpy.linspace(lon_ll - 0.7, lon_ll + numlon + 0.7, 23)
+        etas = numpy.linspace(lat_ll - 0.7, lat_ll + numlat + 0.7, 23)
+        coordinates = [(xi, eta) for xi in xis for eta in etas]
+        V = Vector(data=None, projection=DEFAULT_PROJECTION,
+                   geometry=coordinates)
+
+        for method in ['nearest', 'bilinear', 'spline']:
+            I = R.interpolate(V, name='value', method=method)
+            Icoordinates = I.get_geometry()
+            values = I.get_data('value')
+            assert numpy.allclose(Icoordinates, coordinates)
+
+            for i, (xi, eta) in enumerate(Icoordinates):
+                within_centers = (longitudes[0] <= xi <= longitudes[-1] and
+                                  latitudes[0] <= eta <= latitudes[-1])
+                within_grid = (lon_ll <= xi <= lon_ll + numlon and
+                               lat_ll <= eta <= lat_ll + numlat)
+
+                if method == 'nearest':
+                    if within_grid:
+                        # Value of the pixel containing the point
+                        col = min(int(xi - lon_ll), numlon - 1)
+                        row = min(int(lat_ul - eta), numlat - 1)
+                        assert values[i] == A[row, col]
+                    else:
+                        assert numpy.isnan(values[i])
+                else:
+                    if within_centers:
+                        assert numpy.allclose(values[i],
+                                              linear_function(xi, eta),
+                                              rtol=1e-12)
+                    else:
+                        assert numpy.isnan(values[i])
+
+        # Unknown methods are rejected
+        try:
+            R.interpolate(V, method='cubic convolution')
+        except AssertionError:
+            pass
+        else:
+            msg = 'Unknown interpolation method should have raised exception'
+            raise Exception(msg)
+
+    def test_interpolation_to_polygons(self):
+        """Raster values are interpolated to centroids of polygons and lines
+        """
+
+        # Linear function on grid covering [100, 110] x [-5, 5]
+        geotransform = (100, 0.1, 0, 5, 0, -0.1)
+        longitudes, latitudes = numpy.meshgrid(
+            numpy.linspace(100.05, 109.95, 100),
+            numpy.linspace(4.95, -4.95, 100))
+        R = Raster(linear_function(longitudes, latitudes),
+                   projection=DEFAULT_PROJECTION,
+                   geotransform=geotransform)
+
+        footprints = [[[(101, 1), (103, 1), (103, 3), (101, 3)]],
+                      [[(105, -2), (106, -2), (105, -4)]]]
+        for geometry_type in ['polygon', 'line']:
+            G = pack_geometry(footprints, geometry_type)
+            V = Vector(projection=DEFAULT_PROJECTION, geometry=G)
+
+            I = R.interpolate(V, name='value')
+            assert I.geometry_type == geometry_type
+            assert I.get_geometry().allclose(G)
+
+            centroids = G.get_centroids()
+            assert numpy.allclose(I.get_data('value'),
+                                  linear_function(centroids[:, 0],
+                                                  centroids[:, 1]))
+
+    def test_windowed_interpolation(self):
+        """Interpolation only uses the part of the raster covering the points
+        """
+
+        # Create smooth test grid covering [100, 120] x [-10, 0]
+        numlon = 200
+        numlat = 100
+        geotransform = (100, 0.1, 0, 0, 0, -0.1)
+        x = numpy.linspace(0, 1, numlon)
+        y = numpy.linspace(0, 1, numlat)
+        A = (numpy.sin(4 * x)[numpy.newaxis, :] *
+             numpy.cos(3 * y)[:, numpy.newaxis])
+        R = Raster(A, projection=DEFAULT_PROJECTION,
+                   geotransform=geotransform)
+
+        # Points in a small corner of the raster
+        coordinates = numpy.array([(101.03, -1.27), (101.5, -1.9),
+                                   (101.77, -1.02), (102.45, -2.33)])
+
+        for method in ['nearest', 'bilinear', 'spline']:
+            window = points_window(R, coordinates, method)
+            xoff, yoff, xsize, ysize = window
+
+            # Window is small
+            assert xsize < numlon / 5
+            assert ysize < numlat / 4
+
+            # Window covers all points
+            g = window_geotransform(geotransform, window)
+            assert g[0] <= numpy.min(coordinates[:, 0])
+            assert g[0] + xsize * g[1] >= numpy.max(coordinates[:, 0])
+            assert g[3] >= numpy.max(coordinates[:, 1])
+            assert g[3] + ysize * g[5] <= numpy.min(coordinates[:, 1])
+
+            # Results agree with interpolation from the full grid
+            values = interpolate_raster_points(R, coordinates, method)
+            F = raster_interpolator(R, method)
+            ref = F(coordinates[:, 0], coordinates[:, 1])
+
+            if method == 'spline':
+                assert numpy.allclose(values, ref, rtol=1.0e-6)
+            else:
+                assert numpy.allclose(values, ref, rtol=1.0e-12)
+
+        # Points not overlapping the raster are all NaN
+        values = interpolate_raster_points(R, [(90, 5), (91, 6)])
+        assert numpy.alltrue(numpy.isnan(values))
+
+        # Points with undefined coordinates get NaN
+        coordinates = numpy.array([(101.03, -1.27), (numpy.nan, -1.9),
+                                   (101.77, -1.02), (90, 5)])
+        V = Vector(data=None, projection=DEFAULT_PROJECTION,
+                   geometry=coordinates)
+        for method in ['nearest', 'bilinear', 'spline']:
+            values = R.interpolate(V, name='value',
+                                   method=method).get_data('value')
+            assert numpy.isnan(values[1])
+            assert numpy.isnan(values[3])
+            assert numpy.allclose(values[[0, 2]],
+                                  interpolate_raster_points(
+                                      R, coordinates[[0, 2]], method))
+
+    def test_interpolator_cache(self):
+        """Fitted interpolators are reused and bounded by memory budget
+        """
+
+        numlon = 40
+        numlat = 30
+        geotransform = (100, 0.1, 0, 0, 0, -0.1)
+        x = numpy.linspace(0, 1, numlon)
+        y = numpy.linspace(0, 1, numlat)
+        A = (numpy.sin(4 * x)[numpy.newaxis, :] *
+             numpy.cos(3 * y)[:, numpy.newaxis])
+        R = Raster(A, projection=DEFAULT_PROJECTION,
+                   geotransform=geotransform)
+
+        cache = InterpolatorCache()
+        window = (2, 3, 10, 12)
+
+        # First request fits, second reuses
+        f = cache.get(R, 'spline', window)
+        g = cache.get(R, 'spline', window)
+        assert f is g
+        assert cache.hits == 1
+        assert cache.misses == 1
+        assert len(cache) == 1
+        assert cache.nbytes == f.nbytes
+
+        # Equal content in another object is recognised
+        S = Raster(A.copy(), projection=DEFAULT_PROJECTION,
+                   geotransform=geotransform)
+        assert cache.get(S, 'spline', window) is f
+        assert cache.hits == 2
+
+        # Different window, data or method is not
+        assert cache.get(R, 'spline', (2, 3, 10, 13)) is not f
+        S.data[5, 5] += 1
+        assert cache.get(S, 'spline', window) is not f
+        assert cache.misses == 3
+        assert len(cache) == 3
+
+        # Grid interpolators for in-memory rasters are not cached
+        cache.get(R, 'bilinear', window)
+        assert len(cache) == 3
+
+        # Least recently used interpolators are discarded beyond budget
+        cache.clear()
+        cache.max_bytes = int(f.nbytes * 2.5)
+        f1 = cache.get(R, 'spline', (0, 0, 10, 12))
+        f2 = cache.get(R, 'spline', (1, 0, 10, 12))
+        assert cache.get(R, 'spline', (0, 0, 10, 12)) is f1
+        cache.get(R, 'spline', (2, 0, 10, 12))
+        assert len(cache) == 2
+        assert cache.nbytes <= cache.max_bytes
+        assert cache.get(R, 'spline', (0, 0, 10, 12)) is f1
+        assert cache.get(R, 'spline', (1, 0, 10, 12)) is not f2
+
+        # Caching can be disabled
+        cache = InterpolatorCache(max_bytes=0)
+        cache.get(R, 'spline', window)
+        assert len(cache) == 0
+
+        # Raster files are identified by name and modification time and
+        # grid interpolators can be reused for smaller windows
+        filename = unique_filename(suffix='.tif')
+        R.write_to_file(filename)
+        F = read_layer(filename)
+
+        cache = InterpolatorCache()
+        f = cache.get(F, 'bilinear', (0, 0, 20, 20))
+        assert cache.get(F, 'bilinear', (5, 5, 10, 10)) is f
+        assert cache.get(F, 'bilinear', (5, 5, 20, 20)) is not f
+        assert cache.get(F, 'nearest', (5, 5, 10, 10)) is not f
+
+        values = interpolate_raster_points(F, [(100.72, -0.83)])
+        ref = raster_interpolator(R)(100.72, -0.83)
+        assert numpy.allclose(values, ref)
+
+        os.remove(filename)
+
+    def test_raster_to_raster_resampling(self):
+        """Rasters can be resampled onto the grid of another raster
+        """
+
+        # Source grid covering [100, 110] x [-5, 5] with 1 degree cells
+        # holding a linear function of pixel centers.
+        lon = numpy.arange(100.5, 110)
+        lat = numpy.arange(4.5, -5, -1)
+        A = linear_function(lon[numpy.newaxis, :], lat[:, numpy.newaxis])
+        R = Raster(A, projection=DEFAULT_PROJECTION,
+                   geotransform=(100, 1, 0, 5, 0, -1), name='source')
+
+        # Finer target grid offset from the source and extending beyond it
+        gt = (99.3, 0.3, 0, 5.6, 0, -0.4)
+        X = Raster(numpy.zeros((30, 40)), projection=DEFAULT_PROJECTION,
+                   geotransform=gt)
+        x = gt[0] + (numpy.arange(40) + 0.5) * gt[1]
+        y = gt[3] + (numpy.arange(30) + 0.5) * gt[5]
+
+        # Bilinear resampling is exact for linear functions
+        Y = R.interpolate(X)
+        assert Y.get_geotransform() == gt
+        assert Y.get_data().shape == (30, 40)
+        assert Y.get_name() == 'source'
+
+        B = Y.get_data()
+        inside = numpy.isfinite(B)
+        assert numpy.sum(inside) > 0
+        ref = linear_function(x[numpy.newaxis, :], y[:, numpy.newaxis])
+        assert numpy.allclose(B[inside], ref[inside], rtol=1.0e-12)
+
+        # Target cells beyond source pixel centers are NaN
+        outside = ((x[numpy.newaxis, :] < lon[0]) |
+                   (y[:, numpy.newaxis] > lat[0]))
+        assert numpy.alltrue(numpy.isnan(B[outside]))
+
+        # Agrees with interpolation to the target pixel centers as points
+        for method in ['nearest', 'bilinear']:
+            Y = R.interpolate(X, method=method)
+            P = numpy.array([(xi, yi) for yi in y for xi in x])
+            ref = interpolate_raster_points(R, P, method).reshape((30, 40))
+            B = Y.get_data()
+            assert numpy.allclose(B[numpy.isfinite(ref)],
+                                  ref[numpy.isfinite(ref)], rtol=1.0e-12)
+            assert numpy.alltrue(numpy.isnan(B[numpy.isnan(ref)]))
+
+        # Result does not depend on block size
+        N = interpolation.POINTS_PER_BLOCK
+        try:
+            for method in interpolation.RESAMPLING_METHODS:
+                ref = R.interpolate(X, method=method).get_data()
+                interpolation.POINTS_PER_BLOCK = 7
+                B = R.interpolate(X, method=method).get_data()
+                interpolation.POINTS_PER_BLOCK = N
+
+                assert numpy.allclose(B[numpy.isfinite(ref)],
+                                      ref[numpy.isfinite(ref)])
+                assert numpy.alltrue(numpy.isnan(B[numpy.isnan(ref)]))
+        finally:
+            interpolation.POINTS_PER_BLOCK = N
+
+        # Summing onto a coarser grid covering the source preserves totals
+        X = Raster(numpy.zeros((5, 4)), projection=DEFAULT_PROJECTION,
+                   geotransform=(99.5, 3, 0, 6.5, 0, -2.5))
+        Y = R.interpolate(X, method='sum')
+        assert numpy.allclose(numpy.nansum(Y.get_data()), numpy.sum(A))
+
+        # Average of constant grid is constant where defined
+        C = Raster(numpy.ones(A.shape) * 3.0, projection=DEFAULT_PROJECTION,
+                   geotransform=R.get_geotransform())
+        B = C.interpolate(X, method='average').get_data()
+        assert numpy.allclose(B[numpy.isfinite(B)], 3.0)
+
+        # NODATA does not contribute to sums
+        D = A.copy()
+        D[2, 3] = -9999
+        S = Raster(D, projection=DEFAULT_PROJECTION,
+                   geotransform=R.get_geotransform())
+        Y = S.interpolate(X, method='sum')
+        assert numpy.allclose(numpy.nansum(Y.get_data()),
+                              numpy.sum(A) - A[2, 3])
+
+        # Aligned rasters are returned as is
+        assert R.interpolate(C) is R
+
+        # Raster layers are aligned to the grid of the last raster layer
+        H, E = align_raster_layers([R, X])
+        assert E is X
+        assert H.get_geotransform() == X.get_geotransform()
+
+        # Unknown method
+        try:
+            R.interpolate(X, method='cubic')
+        except AssertionError:
+            pass
+        else:
+            msg = 'Unknown resampling method should have raised an exception'
+            raise Exception(msg)
+
+    def test_zonal_statistics(self):
+        """Raster values are aggregated by polygon regions
+        """
+
+        # Grid covering [100, 110] x [-5, 0] with NODATA in some cells
+        numlon = 100
+        numlat = 50
+        geotransform = (100, 0.1, 0, 0, 0, -0.1)
+        A = numpy.random.uniform(0, 100, (numlat, numlon))
+        A[::7, ::3] = -9999
+        R = Raster(A, projection=DEFAULT_PROJECTION,
+                   geotransform=geotransform)
+
+        # Regions: Triangle, square with hole, multipolygon partly
+        # outside grid and a region outside grid
+        triangle = [(101, -1), (104.33, -1.5), (102, -4.2)]
+        square = [(105, -4), (109, -4), (109, -0.5), (105, -0.5)]
+        hole = [(106, -3), (106, -1.5), (108, -1.5), (108, -3)]
+        left = [(99, -4.9), (100.55, -4.9), (100.55, -3.1), (99, -3.1)]
+        right = [(103.05, -0.35), (104.95, -0.35), (104, 2)]
+        outside = [(120, 10), (121, 10), (121, 11)]
+        features = [[triangle], [square, hole], [left, right], [outside]]
+        G = pack_geometry(features, 'polygon',
+                          holes=[[False], [False, True], [False, False],
+                                 [False]])
+        V = Vector(data={'NAME': ['a', 'b', 'c', 'd']},
+                   projection=DEFAULT_PROJECTION, geometry=G)
+
+        # Reference values from cell centres inside each region
+        longitudes = 100.05 + 0.1 * numpy.arange(numlon)
+        latitudes = -0.05 - 0.1 * numpy.arange(numlat)
+        reference = []
+        for rings in features:
+            values = [A[i, j] for i, y in enumerate(latitudes)
+                      for j, x in enumerate(longitudes)
+                      if inside_rings(x, y, rings) and A[i, j] != -9999]
+            reference.append(values)
+
+        block_cells = raster.BLOCK_CELLS
+        try:
+            for raster.BLOCK_CELLS in [block_cells, 1, 1000]:
+                zones = Zones(V)
+                I = zonal_statistics(R, zones)
+                assert len(I) == 4
+                assert I.get_geometry().allclose(G)
+                assert list(I.get_data('NAME')) == ['a', 'b', 'c', 'd']
+
+                for i, values in enumerate(reference):
+                    assert I.get_data('COUNT', i) == len(values)
+                    if len(values) == 0:
+                        for name in ['SUM', 'MEAN', 'MIN', 'MAX']:
+                            assert numpy.isnan(I.get_data(name, i))
+                        continue
+
+                    assert numpy.allclose(I.get_data('SUM', i),
+                                          numpy.sum(values))
+                    assert numpy.allclose(I.get_data('MEAN', i),
+                                          numpy.mean(values))
+                    assert I.get_data('MIN', i) == numpy.min(values)
+                    assert I.get_data('MAX', i) == numpy.max(values)
+        finally:
+            raster.BLOCK_CELLS = block_cells
+
+        # Every region but the last has cells
+        counts = [len(values) for values in reference]
+        assert min(counts[:3]) > 0 and counts[3] == 0
+
+        # Rasterization is done once per grid
+        I = zonal_statistics(R, zones, statistics=['sum'], prefix='POP_')
+        assert I.get_data().keys() == ['NAME', 'POP_SUM']
+        assert len(zones.spans) == 1
+
+        # Attributes of regions are not overwritten
+        V = Vector(data={'NAME': ['a', 'b', 'c', 'd'], 'SUM': range(4)},
+                   projection=DEFAULT_PROJECTION, geometry=G)
+        try:
+            zonal_statistics(R, V)
+        except AssertionError:
+            pass
+        else:
+            msg = 'Clash of attribute names should have raised exception'
+            raise Exception(msg)
+
+        I = zonal_statistics(R, V, statistics=['sum'], prefix='POP_')
+        assert list(I.get_data('SUM')) == range(4)
+        assert sorted(I.get_data().keys()) == ['NAME', 'POP_SUM', 'SUM']
+
+    def test_zones_cache(self):
+        """Zones of regions read from file are kept across calls
+        """
+
+        square = [(105, -4), (109, -4), (109, -0.5), (105, -0.5)]
+        G = pack_geometry([[square]], 'polygon')
+        V = Vector(data={'NAME': ['a']},
+                   projection=DEFAULT_PROJECTION, geometry=G)
+
+        # Layers in memory get new zones
+        zones = get_zones(V)
+        assert isinstance(zones, Zones)
+        assert get_zones(zones) is zones
+        assert get_zones(V) is not zones
+
+        # Layers read from file share zones until the file changes
+        filename = unique_filename(suffix='.shp')
+        V.write_to_file(filename)
+        zones = get_zones(read_layer(filename))
+        assert get_zones(read_layer(filename)) is zones
+
+        R = Raster(numpy.ones((50, 100)), projection=DEFAULT_PROJECTION,
+                   geotransform=(100, 0.1, 0, 0, 0, -0.1))
+        zonal_statistics(R, read_layer(filename))
+        assert len(zones.spans) == 1
+
+        mtime = os.path.getmtime(filename)
+        os.utime(filename, (mtime + 10, mtime + 10))
+        assert get_zones(read_layer(filename)) is not zones
+
+    def test_point_aggregation(self):
+        """Point attributes are aggregated by polygon regions
+        """
+
+        # Regions: Triangle, square with hole, multipolygon and a region
+        # without points
+        triangle = [(101, -1), (104.33, -1.5), (102, -4.2)]
+        square = [(105, -4), (109, -4), (109, -0.5), (105, -0.5)]
+        hole = [(106, -3), (106, -1.5), (108, -1.5), (108, -3)]
+        left = [(99, -4.9), (100.55, -4.9), (100.55, -3.1), (99, -3.1)]
+        right = [(103.05, -0.35), (104.95, -0.35), (104, 2)]
+        outside = [(120, 10), (121, 10), (121, 11)]
+        features = [[triangle], [square, hole], [left, right], [outside]]
+        G = pack_geometry(features, 'polygon',
+                          holes=[[False], [False, True], [False, False],
+                                 [False]])
+        V = Vector(data={'NAME': ['a', 'b', 'c', 'd']},
+                   projection=DEFAULT_PROJECTION, geometry=G)
+
+        # Random points with some missing values
+        N = 2000
+        points = numpy.zeros((N, 2))
+        points[:, 0] = numpy.random.uniform(99, 110, N)
+        points[:, 1] = numpy.random.uniform(-5, 2, N)
+        loss = numpy.random.uniform(0, 100, N)
+        loss[::11] = numpy.nan
+        P = Vector(data={'LOSS': loss, 'FLOORS': numpy.ones(N, dtype='i')},
+                   projection=DEFAULT_PROJECTION, geometry=points)
+
+        # Reference regions by testing every point against every region
+        reference = -numpy.ones(N, dtype='i')
+        for i, (x, y) in enumerate(points):
+            for k, rings in enumerate(features):
+                if inside_rings(x, y, rings):
+                    reference[i] = k
+                    break
+
+        zones = Zones(V)
+        index = zones.get_polygon_index()
+        assert numpy.all(index.query_points(points) == reference)
+
+        # Same result with small blocks of pairs of points and edges
+        pairs_per_block = spatial_index.PAIRS_PER_BLOCK
+        try:
+            spatial_index.PAIRS_PER_BLOCK = 7
+            assert numpy.all(index.query_points(points) == reference)
+        finally:
+            spatial_index.PAIRS_PER_BLOCK = pairs_per_block
+
+        # Aggregate entire layer and in chunks
+        for chunk_size in [None, 1, 333]:
+            P.chunk_size = chunk_size
+            for statistic, reduction in [('sum', numpy.sum),
+                                         ('mean', numpy.mean),
+                                         ('min', numpy.min),
+                                         ('max', numpy.max),
+                                         ('count', len)]:
+                I = aggregate_points(P, zones, statistic=statistic)
+                assert len(I) == 4
+                assert I.get_geometry().allclose(G)
+                assert I.get_data().keys() == ['NAME', 'LOSS', 'FLOORS',
+                                               'COUNT']
+
+                for k in range(4):
+                    count = numpy.sum(reference == k)
+                    values = loss[(reference == k) & ~numpy.isnan(loss)]
+                    assert I.get_data('COUNT', k) == count
+                    if len(values) == 0 and statistic in ['mean', 'min',
+                                                          'max']:
+                        assert numpy.isnan(I.get_data('LOSS', k))
+                    else:
+                        assert numpy.allclose(I.get_data('LOSS', k),
+                                              reduction(values))
+
+        # Every region but the last has points
+        counts = I.get_data('COUNT')
+        assert min(counts[:3]) > 0 and counts[3] == 0
+        assert numpy.all(I.get_data('FLOORS') == counts)
+
+        # Chosen attributes only
+        I = aggregate_points(P, V, attributes=['FLOORS'])
+        assert I.get_data().keys() == ['NAME', 'FLOORS', 'COUNT']
+
+        # Attributes of regions are not overwritten
+        W = Vector(data={'FLOORS': range(4)}, projection=V.get_projection(),
+                   geometry=V.get_geometry())
+        for attributes in [['FLOORS'], None]:
+            try:
+                aggregate_points(P, W, attributes=attributes)
+            except AssertionError:
+                pass
+            else:
+                msg = 'Clash of attribute names should have raised exception'
+                raise Exception(msg)
+
+        I = aggregate_points(P, W, attributes=['FLOORS'], prefix='B_')
+        assert list(I.get_data('FLOORS')) == range(4)
+        assert sorted(I.get_data().keys()) == ['B_COUNT', 'B_FLOORS',
+                                               'FLOORS']
+        assert numpy.all(I.get_data('B_COUNT') == counts)
+
     def test_riab_interpolation(self):
         """Interpolation using Raster and Vector objects
         """
@@ -2,9 +2,15 @@ import unittest
 import numpy
 import os
 import impact
+from osgeo import ogr
 
+from impact.storage import raster
+from impact.storage import vector
 from impact.storage.raster import Raster
 from impact.storage.vector import Vector
+from impact.storage.attributes import AttributeTable
+from impact.storage.geometry import PackedGeometry, pack_geometry
+from impact.storage.spatial_index import SpatialIndex
 from impact.storage.projection import Projection
 from impact.storage.io import read_layer
 from impact.storage.io import write_point_data
@@ -13,6 +19,11 @@ from impact.storage.utilities import unique_filename
 from impact.storage.io import get_bounding_box
 from impact.tests.utilities import same_API
 from impact.storage.utilities import DEFAULT_PROJECTION
+from impact.storage.utilities import bbox_to_window
+from impact.storage.utilities import window_geotransform
+from impact.storage.utilities import geotransform_to_axes
+from impact.storage.utilities import gdal_data_type
+from impact.storage.utilities import numpy_data_type
 from impact.tests.utilities import TESTDATA
 
 
@@ -161,6 +172,127 @@ class Test_IO(unittest.TestCase):
             lon = layer.get_data(attribute='LONGITUDE')
             assert numpy.allclose(lon, coords[:, 0])
 
+    def test_vector_selection(self):
+        """Features of vector layers can be selected by attribute values
+        """
+
+        # Squares with values including ties and missing values
+        N = 100
+        values = numpy.random.randint(0, 20, N).astype('d')
+        values[::9] = numpy.nan
+        names = [None if i % 7 == 0 else 'x%i' % (i % 13) for i in range(N)]
+        features = [[[(i, 0), (i + 1, 0), (i + 1, 1), (i, 1)]]
+                    for i in range(N)]
+        G = pack_geometry(features, 'polygon')
+        V = Vector(data={'VALUE': values, 'NAME': names},
+                   projection=DEFAULT_PROJECTION, geometry=G)
+
+        # Reference ranking of features with values by full sort
+        valid = [i for i in range(N) if not numpy.isnan(values[i])]
+        ranked = sorted(valid, key=lambda i: values[i])
+        for n in [1, 5, 17, len(valid), N + 1]:
+            L = V.get_topN('VALUE', n)
+            assert len(L) == min(n, len(valid))
+            assert L.get_projection() == V.get_projection()
+            assert numpy.all(L.get_data('VALUE') ==
+                             values[ranked[-n:]])
+
+            # Geometry follows the attributes
+            for k in range(len(L)):
+                i = int(L.get_geometry()[k][0][0, 0])
+                assert values[i] == L.get_data('VALUE', k)
+                assert names[i] == L.get_data('NAME', k)
+
+            L = V.get_bottomN('VALUE', n)
+            assert len(L) == min(n, len(valid))
+            assert numpy.all(L.get_data('VALUE') == values[ranked[:n]])
+
+        # Missing strings are never selected
+        L = V.get_topN('NAME', 3)
+        reference = sorted([name for name in names if name is not None])
+        assert list(L.get_data('NAME')) == reference[-3:]
+
+        # Selection by predicate keeps original order
+        L = V.select('VALUE', lambda x: x >= 10)
+        reference = [i for i in range(N) if values[i] >= 10]
+        assert len(L) == len(reference)
+        assert numpy.all(L.get_data('VALUE') == values[reference])
+        assert L.get_geometry().allclose(G[numpy.array(reference)])
+
+        # Contiguous selections share arrays with the layer
+        P = Vector(data={'VALUE': values}, projection=DEFAULT_PROJECTION,
+                   geometry=numpy.random.uniform(0, 1, (N, 2)))
+        L = P.take(slice(10, 20))
+        assert len(L) == 10
+        assert numpy.may_share_memory(L.get_data('VALUE'), values)
+        assert numpy.may_share_memory(L.get_geometry(), P.get_geometry())
+
+    def test_vector_differences(self):
+        """Differences between vector layers are reported by feature
+        """
+
+        N = 1000
+        coordinates = numpy.random.uniform(0, 10, (N, 2))
+        depth = numpy.random.uniform(0, 5, N)
+        depth[::10] = numpy.nan
+        data = {'DEPTH': depth,
+                'FLOORS': numpy.random.randint(1, 4, N),
+                'NAME': ['b%i' % (i % 17) for i in range(N)]}
+        V = Vector(data=data, projection=DEFAULT_PROJECTION,
+                   geometry=coordinates)
+
+        # Copy with small perturbations and missing values is equal
+        W = Vector(data={'DEPTH': depth * (1 + 1.0e-9),
+                         'FLOORS': data['FLOORS'].copy(),
+                         'NAME': list(data['NAME'])},
+                   projection=DEFAULT_PROJECTION,
+                   geometry=coordinates + 1.0e-10)
+        assert V == W
+        assert len(V.get_differences(W)) == 0
+
+        # Changes are reported for the features and attributes concerned
+        W.get_geometry()[3] += 1
+        W.get_data('DEPTH')[[5, 7]] += 0.1
+        W.get_data('DEPTH')[9] = numpy.nan
+        W.get_data('FLOORS')[11] += 1
+        W.get_data('NAME')[13] = 'x'
+        differences = V.get_differences(W)
+        assert V != W
+        assert differences.keys() == ['geometry', 'DEPTH', 'FLOORS',
+                                      'NAME']
+        assert list(differences['geometry']) == [3]
+        assert list(differences['DEPTH']) == [5, 7, 9]
+        assert list(differences['FLOORS']) == [11]
+        assert list(differences['NAME']) == [13]
+
+        # Tolerances are applied to whole columns
+        differences = V.get_differences(W, atol=0.2)
+        assert list(differences['DEPTH']) == [9]
+
+        # Differences in attributes and size
+        W = Vector(data={'DEPTH': depth, 'TYPE': data['NAME']},
+                   projection=DEFAULT_PROJECTION, geometry=coordinates)
+        differences = V.get_differences(W)
+        assert differences['attributes'] == (['FLOORS', 'NAME'], ['TYPE'])
+        differences = V.get_differences(V.take(slice(0, 10)))
+        assert differences.keys() == ['size']
+        assert differences['size'] == (N, 10)
+
+        # Polygons differing in vertices and in structure
+        square = [(0, 0), (1, 0), (1, 1), (0, 1)]
+        triangle = [(0, 0), (1, 0), (1, 1)]
+        hole = [(0.2, 0.2), (0.2, 0.5), (0.5, 0.5)]
+        moved = [(0, 0), (1, 0), (1, 1.5), (0, 1)]
+        G = pack_geometry([[square], [square, hole], [triangle],
+                           [square]], 'polygon',
+                          holes=[[False], [False, True], [False], [False]])
+        H = pack_geometry([[moved], [square, hole], [square], [square]],
+                          'polygon',
+                          holes=[[False], [False, False], [False],
+                                 [False]])
+        assert list(numpy.nonzero(G.get_differences(H))[0]) == [0, 1, 2]
+        assert not numpy.any(G.get_differences(G))
+
     def test_analysis_of_vector_data_top_N(self):
         """Analysis of vector data - get top N of an attribute
         """
@@ -203,6 +335,465 @@ class Test_IO(unittest.TestCase):
                 else:
                     raise Exception
 
+    def test_attribute_table(self):
+        """Attributes are stored in columns and viewed as dictionaries
+        """
+
+        records = [{'ID': 1, 'NAME': 'school', 'AREA': 12.5,
+                    'FLAG': True, 'NOTE': None},
+                   {'ID': 2, 'NAME': 'hospital', 'AREA': 30.0,
+                    'FLAG': False, 'NOTE': 'closed'},
+                   {'ID': 3, 'NAME': 'school', 'AREA': 7,
+                    'FLAG': False, 'NOTE': None}]
+
+        T = AttributeTable(records)
+        assert len(T) == 3
+        assert set(T.keys()) == set(records[0].keys())
+
+        # Numeric fields are typed columns
+        assert T.columns['ID'].dtype.kind == 'i'
+        assert T.columns['AREA'].dtype.kind == 'f'
+        assert T.columns['FLAG'].dtype.kind == 'b'
+        assert T.columns['NAME'].dtype == object
+        assert T.columns['NOTE'].dtype == object
+
+        # Repeated strings share memory
+        assert T.columns['NAME'][0] is T.columns['NAME'][2]
+
+        # Table behaves like list of dictionaries of Python values
+        for i, fields in enumerate(T):
+            assert fields == records[i]
+            assert T[i] == records[i]
+        assert T[-1] == records[2]
+        assert T[1:] == records[1:]
+        assert type(T[0]['ID']) == type(0)
+        assert type(T[0]['AREA']) == type(0.0)
+
+        try:
+            T[3]
+        except IndexError:
+            pass
+        else:
+            msg = 'Index out of range should have raised IndexError'
+            raise Exception(msg)
+
+        # Dictionaries are copies
+        T[0]['ID'] = 10
+        assert T[0]['ID'] == 1
+
+        # Tables from columns and from other tables
+        S = AttributeTable({'ID': [1, 2, 3], 'AREA': numpy.ones(3)})
+        assert S[2] == {'ID': 3, 'AREA': 1.0}
+        assert AttributeTable(S).columns['AREA'] is S.columns['AREA']
+
+        S = T.take([2, 0])
+        assert S[0] == records[2]
+        assert S[1] == records[0]
+
+        # Fields must have equal length
+        try:
+            AttributeTable({'ID': [1, 2, 3], 'AREA': [1.0]})
+        except AssertionError:
+            pass
+        else:
+            msg = 'Unequal field lengths should have raised an exception'
+            raise Exception(msg)
+
+        # Vector layers hold columns
+        V = Vector(data=records, projection=DEFAULT_PROJECTION,
+                   geometry=[(100, 0), (101, 1), (102, 2)])
+        area = V.get_data('AREA')
+        assert isinstance(area, numpy.ndarray)
+        assert V.get_data('AREA') is area
+        assert numpy.allclose(area, [12.5, 30.0, 7])
+        assert V.get_data('NAME', 1) == 'hospital'
+        assert V.get_data()[1]['NOTE'] == 'closed'
+        assert V.get_extrema('AREA') == (7, 30.0)
+
+        W = Vector(data={'ID': [1, 2, 3]}, projection=DEFAULT_PROJECTION,
+                   geometry=[(100, 0), (101, 1), (102, 2)])
+        assert W.get_data('ID', 2) == 3
+
+        # Layers without attributes
+        W = Vector(data=None, projection=DEFAULT_PROJECTION,
+                   geometry=[(100, 0), (101, 1), (102, 2)])
+        assert W.get_data() is None
+        try:
+            W.get_data('ID')
+        except Exception, e:
+            assert 'does not have any attributes' in str(e), str(e)
+        else:
+            msg = 'Missing attributes should have raised an exception'
+            raise Exception(msg)
+
+    def test_vector_field_types(self):
+        """Fields of vector files are cast according to their OGR types
+        """
+
+        for vectorname in ['lembang_schools.shp',
+                           'tsunami_exposure_BB.shp']:
+
+            filename = '%s/%s' % (TESTDATA, vectorname)
+            V = read_layer(filename)
+
+            # Compare with field definitions in file
+            layer = ogr.Open(filename).GetLayerByIndex(0)
+            definition = layer.GetLayerDefn()
+            assert definition.GetFieldCount() == len(V.get_data().keys())
+            assert len(V) == layer.GetFeatureCount()
+
+            for j in range(definition.GetFieldCount()):
+                field = definition.GetFieldDefn(j)
+                column = V.get_data(field.GetName())
+                if None in column.tolist():
+                    # Missing values are kept as None
+                    assert column.dtype == object
+                elif field.GetType() == ogr.OFTInteger:
+                    assert column.dtype.kind == 'i'
+                elif field.GetType() == ogr.OFTReal:
+                    assert column.dtype.kind == 'f'
+                else:
+                    assert column.dtype == object
+
+            # Features are read in order
+            feature = layer.GetFeature(len(V) - 1)
+            G = feature.GetGeometryRef()
+            assert numpy.allclose(V.get_geometry()[-1], (G.GetX(), G.GetY()))
+
+    def test_vector_file_formats(self):
+        """Vector layers can be written to shapefiles and GeoPackages
+        """
+
+        N = 25
+        geometry = numpy.zeros((N, 2))
+        geometry[:, 0] = numpy.linspace(100, 101, N)
+        geometry[:, 1] = numpy.linspace(-5, -4, N)
+
+        # Fields with missing values in between other values
+        data = []
+        for i in range(N):
+            fields = {'ID': i, 'DEPTH': 0.1 * i, 'NAME': 'feature %i' % i}
+            if i % 4 == 1:
+                fields['NAME'] = None
+            data.append(fields)
+
+        V = Vector(data=data, projection=DEFAULT_PROJECTION,
+                   geometry=geometry)
+
+        chunk_size = vector.WRITE_CHUNK_SIZE
+        try:
+            # Write in several chunks
+            vector.WRITE_CHUNK_SIZE = 7
+
+            for extension in ['.shp', '.gpkg']:
+                filename = unique_filename(suffix=extension)
+                V.write_to_file(filename)
+
+                W = read_layer(filename)
+                assert W == V
+                assert W.get_data('NAME', 1) is None
+                assert W.get_data('NAME', 2) == 'feature 2'
+        finally:
+            vector.WRITE_CHUNK_SIZE = chunk_size
+
+    def test_vector_chunks(self):
+        """Vector layers can be read and written in chunks of features
+        """
+
+        N = 25
+        geometry = numpy.zeros((N, 2))
+        geometry[:, 0] = numpy.linspace(100, 101, N)
+        geometry[:, 1] = numpy.linspace(-5, -4, N)
+        data = {'ID': numpy.arange(N), 'DEPTH': numpy.linspace(0, 2, N)}
+
+        V = Vector(data=data, projection=DEFAULT_PROJECTION,
+                   geometry=geometry)
+
+        # Chunks of layer in memory
+        chunks = list(V.get_chunks(7))
+        assert [len(C) for C in chunks] == [7, 7, 7, 4]
+        assert numpy.allclose(numpy.concatenate([C.get_geometry()
+                                                 for C in chunks]),
+                              geometry)
+        assert numpy.allclose(numpy.concatenate([C.get_data('ID')
+                                                 for C in chunks]),
+                              data['ID'])
+
+        # Without chunk size the layer is one chunk
+        chunks = list(V.get_chunks())
+        assert len(chunks) == 1
+        assert chunks[0] is V
+
+        # Chunks of layer in file
+        filename = unique_filename(suffix='.shp')
+        V.write_to_file(filename)
+
+        for chunk_size in [1, 7, 25, 100]:
+            L = read_layer(filename, chunk_size=chunk_size)
+            assert len(L) == N
+
+            # Features are only available through chunks
+            try:
+                L.get_data()
+            except AssertionError:
+                pass
+            else:
+                msg = 'Should have raised AssertionError'
+                raise Exception(msg)
+
+            chunks = list(L.get_chunks())
+            assert len(chunks) == (N + chunk_size - 1) // chunk_size
+            for C in chunks:
+                assert 0 < len(C) <= chunk_size
+
+            # Write chunks incrementally and compare to original
+            out_filename = unique_filename(suffix='.shp')
+            writer = vector.VectorWriter(out_filename, L.get_projection())
+            for C in chunks:
+                writer.write(C)
+            writer.close()
+
+            assert read_layer(out_filename) == V
+
+        # Field types of object columns come from values that are present
+        names = numpy.array([None, None, 'a', None, 'b'], dtype=object)
+        floors = numpy.array([None, 2, None, 3, 1], dtype=object)
+        missing = numpy.array([None] * 5, dtype=object)
+        assert vector.get_ogr_field_type(names) == ogr.OFTString
+        assert vector.get_ogr_field_type(floors) == ogr.OFTInteger
+        assert vector.get_ogr_field_type(missing) == ogr.OFTString
+
+        V = Vector(data={'NAME': names, 'MISSING': missing},
+                   projection=DEFAULT_PROJECTION, geometry=geometry[:5])
+        filename = unique_filename(suffix='.shp')
+        V.write_to_file(filename)
+        L = read_layer(filename)
+        assert list(L.get_data('NAME')) == list(names)
+        assert list(L.get_data('MISSING')) == list(missing)
+
+    def test_packed_geometry(self):
+        """Areas, lengths, centroids and bounding boxes of polygons and lines
+        """
+
+        # Square with a hole, multipolygon of two squares and a
+        # clockwise triangle with its first vertex repeated at the end
+        square = [(0, 0), (2, 0), (2, 2), (0, 2)]
+        hole = [(0.5, 0.5), (0.5, 1.5), (1.5, 1.5), (1.5, 0.5)]
+        left = [(10, 10), (11, 10), (11, 11), (10, 11)]
+        right = [(12, 10), (13, 10), (13, 11), (12, 11)]
+        triangle = [(0, 0), (0, 3), (4, 0), (0, 0)]
+
+        G = pack_geometry([[square, hole], [left, right], [triangle]],
+                          'polygon',
+                          holes=[[False, True], [False, False], [False]])
+        assert len(G) == 3
+        assert numpy.allclose(G.get_areas(), [3, 2, 6])
+        assert numpy.allclose(G.get_lengths(), [12, 8, 12])
+        assert numpy.allclose(G.get_centroids(),
+                              [[1, 1], [11.5, 10.5], [4.0 / 3, 1]])
+        assert numpy.allclose(G.get_bounding_boxes(),
+                              [[0, 0, 2, 2], [10, 10, 13, 11], [0, 0, 4, 3]])
+
+        # Parts of one feature
+        parts = G[0]
+        assert len(parts) == 2
+        assert numpy.allclose(parts[1], hole)
+
+        # Selection of features
+        for index in [[2, 0], numpy.array([False, True, True]),
+                      slice(1, None)]:
+            S = G[index]
+            assert isinstance(S, PackedGeometry)
+            assert numpy.allclose(S.get_areas(), G.get_areas()[index])
+            assert numpy.allclose(S.get_centroids(),
+                                  G.get_centroids()[index])
+        assert G.take(range(3)).allclose(G)
+        assert not G.take([1, 0, 2]).allclose(G)
+
+        # Lines including a multiline and a degenerate line
+        G = pack_geometry([[[(0, 0), (2, 0), (2, 2)]],
+                           [[(0, 0), (1, 0)], [(0, 1), (0, 3)]],
+                           [[(5, 5)]]], 'line')
+        assert numpy.allclose(G.get_areas(), 0)
+        assert numpy.allclose(G.get_lengths(), [4, 3, 0])
+        assert numpy.allclose(G.get_centroids(),
+                              [[1.5, 0.5], [1.0 / 6, 4.0 / 3], [5, 5]])
+
+        # Features without vertices (first, between others and last)
+        # have undefined bounding boxes
+        G = pack_geometry([[], [square], [], [[]], [left, right], []],
+                          'line')
+        boxes = G.get_bounding_boxes()
+        assert numpy.all(numpy.isnan(boxes[[0, 2, 3, 5]]))
+        assert numpy.allclose(boxes[[1, 4]], [[0, 0, 2, 2],
+                                              [10, 10, 13, 11]])
+        boxes = pack_geometry([[], []], 'line').get_bounding_boxes()
+        assert numpy.all(numpy.isnan(boxes))
+        assert pack_geometry([], 'line').get_bounding_boxes().shape == (0, 4)
+
+        # Vector layers of polygons
+        V = Vector(data={'ID': [1, 2, 3]}, projection=DEFAULT_PROJECTION,
+                   geometry=pack_geometry([[square], [left], [triangle]],
+                                          'polygon'))
+        assert len(V) == 3
+        assert V.geometry_type == 'polygon'
+        assert numpy.allclose(V.get_centroids(),
+                              [[1, 1], [10.5, 10.5], [4.0 / 3, 1]])
+
+        chunks = list(V.get_chunks(2))
+        assert [len(C) for C in chunks] == [2, 1]
+        assert chunks[1].get_geometry().allclose(V.get_geometry()[2:])
+
+        # Points are their own centroids
+        P = Vector(projection=DEFAULT_PROJECTION, geometry=square)
+        assert P.geometry_type == 'point'
+        assert numpy.allclose(P.get_centroids(), square)
+
+    def test_polygon_vector_files(self):
+        """Polygon and line layers can be written and read
+        """
+
+        square = [(0, 0), (0, 2), (2, 2), (2, 0), (0, 0)]
+        hole = [(0.5, 0.5), (1.5, 0.5), (1.5, 1.5), (0.5, 1.5), (0.5, 0.5)]
+        left = [(10, 10), (10, 11), (11, 11), (11, 10), (10, 10)]
+        right = [(12, 10), (12, 11), (13, 11), (13, 10), (12, 10)]
+
+        polygons = pack_geometry([[square, hole], [left, right]], 'polygon',
+                                 holes=[[False, True], [False, False]])
+        lines = pack_geometry([[square], [left, right]], 'line')
+
+        for geometry in [polygons, lines]:
+            V = Vector(data={'ID': [1, 2]}, projection=DEFAULT_PROJECTION,
+                       geometry=geometry)
+
+            for extension in ['.shp', '.gpkg']:
+                filename = unique_filename(suffix=extension)
+                V.write_to_file(filename)
+
+                # Ring orientation may be changed by the file format
+                # so compare derived quantities
+                W = read_layer(filename)
+                assert W.geometry_type == V.geometry_type
+                assert len(W) == 2
+                G = W.get_geometry()
+                assert numpy.array_equal(G.holes, geometry.holes)
+                assert numpy.allclose(G.get_areas(), geometry.get_areas())
+                assert numpy.allclose(G.get_lengths(),
+                                      geometry.get_lengths())
+                assert numpy.allclose(G.get_centroids(),
+                                      geometry.get_centroids())
+                assert numpy.allclose(W.get_data('ID'), [1, 2])
+
+                # Chunks of file
+                L = read_layer(filename, chunk_size=1)
+                assert L.geometry_type == V.geometry_type
+                chunks = list(L.get_chunks())
+                assert len(chunks) == 2
+                assert numpy.allclose(chunks[1].get_centroids(),
+                                      geometry.get_centroids()[1:])
+
+    def test_spatial_index(self):
+        """Spatial index queries agree with exhaustive search
+        """
+
+        numpy.random.seed(17)
+        N = 1000
+        points = numpy.zeros((N, 2))
+        points[:, 0] = numpy.random.uniform(100, 110, N)
+        points[:, 1] = numpy.random.uniform(-5, 0, N)
+
+        # Boxes of points and of squares with up to 1 degree sides
+        sizes = numpy.random.uniform(0, 1, (N, 1))
+        for boxes in [numpy.hstack([points, points]),
+                      numpy.hstack([points, points + sizes])]:
+            index = SpatialIndex(boxes)
+            assert len(index) == N
+
+            bbox = index.get_bounding_box()
+            assert numpy.allclose(bbox, [boxes[:, 0].min(),
+                                         boxes[:, 1].min(),
+                                         boxes[:, 2].max(),
+                                         boxes[:, 3].max()])
+
+            for query in [[102, -4, 103, -3], [95, -10, 120, 10],
+                          [104.5, -2, 104.5, -2], [111, 1, 112, 2]]:
+                expected = numpy.nonzero((boxes[:, 0] <= query[2]) &
+                                         (boxes[:, 2] >= query[0]) &
+                                         (boxes[:, 1] <= query[3]) &
+                                         (boxes[:, 3] >= query[1]))[0]
+                assert numpy.array_equal(index.query_bbox(query), expected)
+
+            for point in [(105, -2.5), (100, 0), (90, 20)]:
+                distances = index.get_distances(point, numpy.arange(N))
+
+                for radius in [0.1, 1, 100]:
+                    expected = numpy.nonzero(distances <= radius)[0]
+                    assert numpy.array_equal(index.query_radius(point,
+                                                                radius),
+                                             expected)
+
+                for k in [1, 5, N + 1]:
+                    nearest = index.query_nearest(point, k)
+                    assert len(nearest) == min(k, N)
+                    expected = numpy.argsort(distances,
+                                             kind='mergesort')[:k]
+                    assert numpy.allclose(distances[nearest],
+                                          distances[expected])
+
+        # Degenerate layers
+        index = SpatialIndex(numpy.zeros((0, 4)))
+        assert index.get_bounding_box() is None
+        assert len(index.query_bbox([0, 0, 1, 1])) == 0
+        assert len(index.query_nearest((0, 0))) == 0
+
+        index = SpatialIndex([[numpy.nan, 0, numpy.nan, 0]])
+        assert index.get_bounding_box() is None
+        assert len(index.query_bbox([0, 0, 1, 1])) == 0
+        assert len(index.query_nearest((0, 0))) == 0
+
+        # Features with undefined coordinates are never found
+        boxes = numpy.hstack([points, points])
+        boxes[[3, 500], 1] = numpy.nan
+        boxes[[3, 500], 3] = numpy.nan
+        index = SpatialIndex(boxes)
+        assert len(index) == N
+        assert numpy.allclose(index.get_bounding_box(),
+                              [numpy.nanmin(boxes[:, 0]),
+                               numpy.nanmin(boxes[:, 1]),
+                               numpy.nanmax(boxes[:, 2]),
+                               numpy.nanmax(boxes[:, 3])])
+        found = index.query_bbox([95, -10, 120, 10])
+        assert numpy.array_equal(found, numpy.setdiff1d(numpy.arange(N),
+                                                        [3, 500]))
+        assert len(index.query_nearest((105, -2.5), N)) == N - 2
+
+        index = SpatialIndex([[1, 2, 1, 2]] * 20)
+        assert numpy.array_equal(index.query_bbox([0, 0, 1, 2]),
+                                 numpy.arange(20))
+        assert len(index.query_nearest((0, 0), 3)) == 3
+
+        # Spatial index of vector layers
+        data = {'ID': numpy.arange(N)}
+        V = Vector(data=data, projection=DEFAULT_PROJECTION, geometry=points)
+        assert numpy.allclose(V.get_bounding_box(),
+                              [points[:, 0].min(), points[:, 1].min(),
+                               points[:, 0].max(), points[:, 1].max()])
+
+        C = V.clip([102, -4, 103, -3])
+        inside = ((points[:, 0] >= 102) & (points[:, 0] <= 103) &
+                  (points[:, 1] >= -4) & (points[:, 1] <= -3))
+        assert len(C) == numpy.sum(inside)
+        assert numpy.allclose(C.get_geometry(), points[inside])
+        assert numpy.array_equal(C.get_data('ID'), numpy.nonzero(inside)[0])
+
+        square = [(0, 0), (2, 0), (2, 2), (0, 2)]
+        triangle = [(5, 5), (6, 5), (5, 7)]
+        G = pack_geometry([[square], [triangle]], 'polygon')
+        V = Vector(projection=DEFAULT_PROJECTION, geometry=G)
+        assert V.get_bounding_box() == [0, 0, 6, 7]
+        assert len(V.clip([1, 1, 4, 4])) == 1
+        assert V.clip([5.5, 6, 9, 9]).get_geometry().allclose(G[1:])
+
     def test_vector_class(self):
         """Consistency of vector class for point data
         """
@@ -600,6 +1191,55 @@ class Test_IO(unittest.TestCase):
 
                     i0 = i1
 
+    def test_streaming_statistics(self):
+        """Statistics and bins are computed block by block
+        """
+
+        geotransform = (100, 0.1, 0, 10, 0, -0.1)
+        A = numpy.random.lognormal(size=(200, 300))
+        A[::7, ::3] = -9999
+        R = Raster(A, DEFAULT_PROJECTION, geotransform)
+
+        B = A[A != -9999]
+        B.sort()
+
+        block_cells = raster.BLOCK_CELLS
+        exact_cells = raster.QUANTILE_EXACT_CELLS
+        try:
+            raster.BLOCK_CELLS = 1000
+
+            min, max, count = R.get_statistics()
+            assert min == B[0]
+            assert max == B[-1]
+            assert count == len(B)
+            assert R.get_extrema() == (min, max)
+
+            # Exact quantiles agree with sorting
+            for N in [2, 5, 10]:
+                bins = R.get_bins(N=N, quantiles=True)
+                d = float(len(B) + 0.5) / N
+                for i in range(N):
+                    assert bins[i] == B[int(i * d)]
+                assert bins[-1] == max
+
+            # Histogram estimates are close
+            raster.QUANTILE_EXACT_CELLS = 1000
+            ranks = [0, 100, len(B) / 2, len(B) - 1]
+            values = R.get_ranked_values(ranks)
+            width = (max - min) / raster.HISTOGRAM_BINS
+            assert numpy.allclose(values, B[ranks], rtol=0, atol=2 * width)
+        finally:
+            raster.BLOCK_CELLS = block_cells
+            raster.QUANTILE_EXACT_CELLS = exact_cells
+
+        # Statistics of raster files are cached
+        filename = '%s/test_grid.asc' % TESTDATA
+        R = read_layer(filename)
+        bins = R.get_bins(N=5, quantiles=True)
+        assert R.statistics[('bins', 5, True)] == bins
+        assert R.get_bins(N=5, quantiles=True) == bins
+        assert R.statistics['extrema'] == R.get_statistics()
+
     def test_get_bounding_box(self):
         """Bounding box is correctly extracted from file.
 
@@ -651,13 +1291,280 @@ class Test_IO(unittest.TestCase):
             bbox = get_bounding_box(os.path.join(TESTDATA, filename))
             assert numpy.allclose(bbox, ref_bbox[filename])
 
+    def test_raster_windows(self):
+        """Windows of raster data can be located and read
+        """
+
+        # Create test data
+        lon_ul = 100  # Longitude of upper left corner
+        lat_ul = 10   # Latitude of upper left corner
+        numlon = 8    # Number of longitudes
+        numlat = 5    # Number of latitudes
+        geotransform = (lon_ul, 0.5, 0, lat_ul, 0, -0.5)
+
+        A = numpy.arange(numlat * numlon, dtype='d').reshape(numlat, numlon)
+        R = Raster(A, DEFAULT_PROJECTION, geotransform)
+
+        # Window covering a bounding box [West, South, East, North]
+        window = bbox_to_window(geotransform, numlat, numlon,
+                                [101.2, 8.1, 102.4, 9.4])
+        assert window == (2, 1, 3, 3)
+
+        B = R.get_data(window=window)
+        assert numpy.allclose(B, A[1:4, 2:5])
+
+        # Margins are added and the window is clipped to the grid
+        window = bbox_to_window(geotransform, numlat, numlon,
+                                [101.2, 8.1, 102.4, 9.4], margin=2)
+        assert window == (0, 0, 7, 5)
+
+        window = bbox_to_window(geotransform, numlat, numlon,
+                                [90, 0, 200, 20])
+        assert window == (0, 0, numlon, numlat)
+        assert numpy.allclose(R.get_data(window=window), A)
+
+        # Bounding boxes outside the grid have no window
+        window = bbox_to_window(geotransform, numlat, numlon,
+                                [110, 0, 120, 5])
+        assert window is None
+
+        # Geotransform of window
+        window = (2, 1, 3, 3)
+        g = window_geotransform(geotransform, window)
+        assert numpy.allclose(g, (101, 0.5, 0, 9.5, 0, -0.5))
+
+        # Pixel centers of window agree with those of the full grid
+        x, y = R.get_geometry()
+        wx, wy = geotransform_to_axes(g, 3, 3)
+        assert numpy.allclose(wx, x[2:5])
+        assert numpy.allclose(wy, y[1:4])
+
+        # Windows must lie within the grid
+        try:
+            R.get_data(window=(6, 0, 3, 2))
+        except AssertionError:
+            pass
+        else:
+            msg = 'Window outside grid should have raised AssertionError'
+            raise Exception(msg)
+
+    def test_raster_blocks(self):
+        """Raster data can be read block by block and is cached
+        """
+
+        numlon = 8
+        numlat = 5
+        geotransform = (100, 0.5, 0, 10, 0, -0.5)
+        A = numpy.arange(numlat * numlon, dtype='d').reshape(numlat, numlon)
+        A[3, 2] = -9999
+        R = Raster(A, DEFAULT_PROJECTION, geotransform)
+
+        assert len(R) == numlat * numlon
+        assert R.get_block_size() == (numlon, 1)
+
+        # Blocks are strips of rows covering the grid
+        N = raster.BLOCK_CELLS
+        try:
+            raster.BLOCK_CELLS = 2 * numlon
+            blocks = list(R.get_blocks(nan=0))
+            assert len(blocks) == 3
+            assert blocks[0][0] == (0, 0, numlon, 2)
+            assert blocks[-1][0] == (0, 4, numlon, 1)
+
+            B = numpy.concatenate([block for _, block in blocks])
+            assert numpy.allclose(B, R.get_data(nan=0))
+
+            # Extrema and comparisons are done block by block
+            assert R.get_extrema() == (0, numlat * numlon - 1)
+            assert R == Raster(A.copy(), DEFAULT_PROJECTION, geotransform)
+
+            C = A.copy()
+            C[4, 7] += 1
+            assert R != Raster(C, DEFAULT_PROJECTION, geotransform)
+        finally:
+            raster.BLOCK_CELLS = N
+
+        # Raster files are read once and kept until released
+        filename = '%s/%s' % (TESTDATA, 'Lembang_Earthquake_Scenario.asc')
+        R = read_layer(filename)
+        A = R.get_data(copy=False)
+        assert R.get_data(copy=False) is A
+        assert not A.flags.writeable
+
+        # By default a copy is returned which can be modified
+        B = R.get_data()
+        assert B is not A
+        assert numpy.array_equal(A, B)
+        B[0, 0] += 1
+        assert not numpy.array_equal(R.get_data(), B)
+        assert R.get_data(window=(0, 0, 2, 2)).flags.writeable
+
+        B = numpy.concatenate([block for _, block in R.get_blocks()])
+        assert numpy.allclose(A, B)
+
+        R.release()
+        assert R.get_data() is not A
+        assert numpy.allclose(R.get_data(), A)
+
+        # Windows of released rasters are read from file
+        R.release()
+        window = (2, 3, 4, 5)
+        assert numpy.allclose(R.get_data(window=window), A[3:8, 2:6])
+
+    def test_raster_data_types(self):
+        """Raster data keeps its data type from array to file and back
+        """
+
+        geotransform = (100, 0.5, 0, 10, 0, -0.5)
+        for dtype in ['uint8', 'int16', 'int32', 'float32', 'float64']:
+            A = numpy.arange(20).reshape(4, 5).astype(dtype)
+            R = Raster(A, DEFAULT_PROJECTION, geotransform)
+            assert R.get_data().dtype == numpy.dtype(dtype)
+            assert R.get_data_type() == numpy.dtype(dtype)
+
+            # Opt in to single precision computations
+            assert R.get_data(dtype='f').dtype == numpy.float32
+            assert numpy.allclose(R.get_data(dtype='f'), A)
+
+            # Integer data can hold NaN only as floating point
+            B = R.get_data(nan=True)
+            assert B.dtype.kind == 'f'
+
+            # Data is stored with matching GDAL type
+            filename = unique_filename(suffix='.tif')
+            R.write_to_file(filename)
+            R2 = read_layer(filename)
+            assert R2.get_data_type() == numpy.dtype(dtype)
+            assert R2.get_data().dtype == numpy.dtype(dtype)
+            assert numpy.allclose(R2.get_data(), A)
+            os.remove(filename)
+
+        # Types without GDAL counterpart are stored as wider types
+        dtype, _ = gdal_data_type('int8')
+        assert dtype == numpy.int16
+        dtype, _ = gdal_data_type(numpy.int64)
+        assert dtype == numpy.float64
+        dtype, _ = gdal_data_type(bool)
+        assert dtype == numpy.uint8
+
+        # GDAL types map back to the numpy types they store
+        for dtype in ['uint8', 'int16', 'uint32', 'float32', 'float64']:
+            _, gdal_type = gdal_data_type(dtype)
+            assert numpy_data_type(gdal_type) == numpy.dtype(dtype)
+
+    def test_nodata_replacement(self):
+        """NODATA values are replaced without modifying raster data
+        """
+
+        geotransform = (100, 0.5, 0, 10, 0, -0.5)
+        A = numpy.arange(20, dtype='f').reshape(4, 5)
+        A[1, 2] = A[3, 0] = -9999
+        R = Raster(A, DEFAULT_PROJECTION, geotransform)
+
+        mask = R.get_nodata_mask()
+        assert mask.dtype == bool
+        assert numpy.sum(mask) == 2
+        assert mask[1, 2] and mask[3, 0]
+        assert numpy.alltrue(R.get_nodata_mask((1, 1, 3, 2)) ==
+                             mask[1:3, 1:4])
+
+        # Replacement keeps data type and leaves raster data untouched
+        B = R.get_data(nan=0)
+        assert B.dtype == numpy.float32
+        assert B[1, 2] == 0 and B[3, 0] == 0
+        assert A[1, 2] == -9999
+        assert numpy.allclose(B[numpy.logical_not(mask)],
+                              A[numpy.logical_not(mask)])
+
+        B = R.get_data(nan=True, window=(2, 1, 2, 3))
+        assert numpy.isnan(B[0, 0])
+        assert numpy.sum(numpy.isnan(B)) == 1
+
+        # Integer data becomes floating point only if NaN is needed
+        R = Raster(A.astype('int16'), DEFAULT_PROJECTION, geotransform)
+        assert R.get_data(nan=0).dtype == numpy.int16
+        B = R.get_data(nan=True)
+        assert B.dtype == numpy.float64
+        assert numpy.sum(numpy.isnan(B)) == 2
+
+        # Mask of raster file is computed once
+        filename = '%s/%s' % (TESTDATA, 'Population_2010_clip.tif')
+        R = read_layer(filename)
+        mask = R.get_nodata_mask()
+        assert R.get_nodata_mask() is mask
+
+        A = R.get_data()
+        B = R.get_data(nan=True)
+        assert numpy.alltrue(numpy.isnan(B) == (mask | numpy.isnan(A)))
+
+        R.release()
+        assert R.get_nodata_mask() is not mask
+
+    def test_raster_creation_options(self):
+        """Rasters can be written compressed, tiled and with overviews
+        """
+
+        numlon = 600
+        numlat = 520
+        geotransform = (100, 0.01, 0, 10, 0, -0.01)
+        x = numpy.linspace(0, 1, numlon)
+        y = numpy.linspace(0, 1, numlat)
+        A = (numpy.sin(4 * x)[numpy.newaxis, :] *
+             numpy.cos(3 * y)[:, numpy.newaxis]).astype('f')
+
+        for B in [A, (A * 100).astype('int16')]:
+            R = Raster(B, DEFAULT_PROJECTION, geotransform)
+
+            for compression in [None, 'DEFLATE', 'LZW']:
+                filename = unique_filename(suffix='.tif')
+                R.write_to_file(filename, compression=compression,
+                                tiled=True, overviews=True)
+
+                R2 = read_layer(filename)
+                assert numpy.allclose(R2.get_data(), B)
+                assert R2.get_geotransform() == geotransform
+
+                # Structure of file
+                assert R2.get_block_size() == (256, 256)
+                assert R2.band.GetOverviewCount() == 1
+                metadata = R2.fid.GetMetadata('IMAGE_STRUCTURE')
+                if compression is None:
+                    assert 'COMPRESSION' not in metadata
+                else:
+                    assert metadata['COMPRESSION'] == compression
+
+                os.remove(filename)
+
+            # Explicit overview factors
+            filename = unique_filename(suffix='.tif')
+            R.write_to_file(filename, overviews=[2, 4, 8])
+            R2 = read_layer(filename)
+            assert R2.band.GetOverviewCount() == 3
+            os.remove(filename)
+
+        # Unknown compression
+        try:
+            R.write_to_file(unique_filename(suffix='.tif'),
+                            compression='JPEG2000')
+        except AssertionError:
+            pass
+        else:
+            msg = 'Unknown compression should have raised an exception'
+            raise Exception(msg)
+
     def test_layer_API(self):
         """Vector and Raster instances have a similar API
         """
 
         # Exceptions
         exclude = ['get_topN', 'get_bins',
-                   'get_geotransform', 'get_nodata_value']
+                   'get_geotransform', 'get_nodata_value',
+                   'get_block_size', 'get_blocks', 'release',
+                   'get_data_type', 'get_nodata_mask',
+                   'get_statistics', 'get_ranked_values',
+                   'get_chunks', 'check_in_memory', 'get_centroids',
+                   'get_spatial_index', 'clip', 'get_bottomN',
+                   'select', 'take', 'get_differences']
 
         V = Vector()  # Empty vector instance
         R = Raster()  # Empty raster instance
@@ -1,5 +1,18 @@
 import unittest
+import numpy
+import pickle
+import sys
+import os
 from impact import plugins
+from impact.plugins import core
+from impact.plugins import manifest
+from impact.plugins.utilities import Damage_curve, Damage_curve_family
+from impact.plugins.core import compatible_layers, get_requirements
+from impact.plugins.core import requirement_check, requirement_terms
+from impact.plugins.core import LayerIndex, get_layer_index
+from impact.plugins.core import LazyPlugin, FunctionProvider
+from impact.plugins.core import pretty_function_name
+from impact.storage.utilities import unique_filename
 
 DEFAULT_PLUGINS = ('Earthquake Fatality Function',)
 
@@ -25,6 +38,213 @@ class Test_Functions(unittest.TestCase):
         msg = ('No plugins were found matching %s' % plugin_name)
         assert len(plugin_list) > 0, msg
 
+    def test_requirements(self):
+        """Layers are matched against compiled plugin requirements
+        """
+
+        class Function:
+            """Plugin like class which is not registered
+
+            :param requires category=="hazard" and \
+                            subcategory.startswith("tsunami")
+            :param requires category in ["exposure", "impact"] and \
+                            not unit == 'people'
+            """
+
+        layers = [('depth', {'category': 'hazard',
+                             'subcategory': 'tsunami_max'}),
+                  ('shaking', {'category': 'hazard',
+                               'subcategory': 'earthquake'}),
+                  ('buildings', {'category': 'exposure', 'unit': 'count',
+                                 'title': 'Quotes " and \' are fine'}),
+                  ('people', {'category': 'exposure', 'unit': 'people'}),
+                  ('no keywords', {}),
+                  ('wrong type', {'category': 'hazard', 'subcategory': 1})]
+
+        assert compatible_layers(Function, layers) == ['depth', 'buildings']
+
+        # Requirements are compiled once
+        requirements = get_requirements(Function)
+        assert len(requirements) == 2
+        assert get_requirements(Function) is requirements
+
+        # Only simple expressions are allowed
+        assert requirement_check({'unit': ' MMI '},
+                                 'unit.strip().lower() == "mmi"')
+        for expression in ['__import__("os").getcwd()',
+                           'category.__class__',
+                           'category == "hazard" or open("x")',
+                           'category ==']:
+            try:
+                requirement_check({'category': 'hazard'}, expression)
+            except SyntaxError:
+                pass
+            else:
+                msg = 'Requirement %s should have failed' % expression
+                raise Exception(msg)
+
+    def test_layer_index(self):
+        """Layers matched using index agree with matching every layer
+        """
+
+        terms = requirement_terms('category == "hazard" and '
+                                  'subcategory.startswith("tsunami") and '
+                                  '"raster" == layer_type and '
+                                  'unit in ["m", "cm"] and '
+                                  '(title == "a" or title == "b")')
+        assert terms == {'category': set(['hazard']),
+                         'layer_type': set(['raster']),
+                         'unit': set(['m', 'cm'])}
+        assert requirement_terms('not category == "hazard"') == {}
+
+        categories = [('hazard', 'earthquake', 'raster'),
+                      ('hazard', 'tsunami', 'raster'),
+                      ('hazard', 'flood', 'raster'),
+                      ('exposure', 'population', 'raster'),
+                      ('exposure', 'building', 'feature'),
+                      ('impact', 'building', 'feature')]
+        layers = []
+        for i in range(60):
+            category, subcategory, layer_type = categories[i % 6]
+            params = {'category': category,
+                      'subcategory': subcategory,
+                      'layer_type': layer_type,
+                      'unit': ['m', 'mmi', 'people'][i % 3],
+                      'title': ['population_2010', 'other'][i % 2]}
+            if i % 7 == 0:
+                del params['unit']
+            layers.append(('layer%i' % i, params))
+
+        index = LayerIndex(layers)
+        assert len(index) == 60
+
+        plugin_list = plugins.get_plugins()
+        matched = 0
+        for name, f in plugin_list.items():
+            reference = compatible_layers(f, layers)
+            assert index.compatible_layers(f) == reference, name
+            matched += len(reference)
+        assert matched > 0
+
+        # Index is reused while layers are unchanged
+        index = get_layer_index(layers)
+        assert get_layer_index(list(layers)) is index
+        layers[0][1]['unit'] = 'cm'
+        assert get_layer_index(layers) is not index
+
+    def test_plugin_manifest(self):
+        """Plugin manifest describes plugins without importing them
+        """
+
+        # Manifest agrees with plugins registered by their modules
+        entries = manifest.build_manifest()
+        assert len(entries) > 0
+        for entry in entries:
+            __import__(entry['module'])
+            classes = [p for p in FunctionProvider.plugins
+                       if (p.__module__ == entry['module'] and
+                           p.__name__ == entry['class_name'])]
+            assert len(classes) == 1
+            plugin = classes[0]
+
+            assert entry['name'] == pretty_function_name(plugin)
+            assert entry['doc'] == plugin.__doc__
+            assert entry['supports_chunks'] == plugin.supports_chunks
+
+        # Manifest can be written and read
+        filename = unique_filename(suffix='.json')
+        manifest.write_manifest(filename)
+        assert manifest.read_manifest(filename) == entries
+        os.remove(filename)
+        assert manifest.read_manifest(filename) is None
+
+        # Plugin not imported by its package is listed from the manifest
+        module = 'impact.plugins.earthquake.haji_fatality_model'
+        filename = os.path.join(manifest.PLUGINS_DIR, 'earthquake',
+                                'haji_fatality_model.py')
+        entry = manifest.find_plugins(filename, module)[0]
+        assert module not in sys.modules
+
+        lazy_plugins = list(core.LAZY_PLUGINS)
+        registered = list(FunctionProvider.plugins)
+        try:
+            core.LAZY_PLUGINS[:] = [LazyPlugin(entry)]
+            name = 'Empirical Fatality Function'
+            plugin = plugins.get_plugins(name)[0][name]
+            assert plugin.__doc__ == entry['doc']
+            assert not plugin.supports_chunks
+
+            # Requirements are matched without importing the module
+            layers = [('a', {'category': 'doesnotexist'}),
+                      ('b', {'category': 'hazard'})]
+            assert compatible_layers(plugin, layers) == ['a']
+            assert get_layer_index(layers).compatible_layers(plugin) == ['a']
+            assert module not in sys.modules
+
+            # Module is imported when the plugin is used
+            plugin_class = plugin.load()
+            assert module in sys.modules
+            assert plugin_class.__name__ == 'EmpiricalFatalityFunction'
+            assert plugins.get_plugins(name)[0][name] is plugin_class
+        finally:
+            core.LAZY_PLUGINS[:] = lazy_plugins
+            FunctionProvider.plugins[:] = registered
+
+    def test_damage_curves(self):
+        """Damage curves are evaluated for arrays and by category
+        """
+
+        points = [[0.0, 0.0], [0.3, 0.4], [1.0, 0.8], [3.0, 1.0]]
+        curve = Damage_curve(points)
+
+        # Piecewise linear between points for scalars and arrays
+        assert numpy.allclose(curve(0.15), 0.2)
+        x = numpy.array([0.0, 0.15, 0.3, 0.65, 2.0, 3.0, numpy.nan])
+        y = curve(x)
+        assert numpy.allclose(y[:-1], [0.0, 0.2, 0.4, 0.6, 0.9, 1.0])
+        assert numpy.isnan(y[-1])
+
+        # Values outside the curve are an error
+        for x in [-0.1, 3.1, [1.0, 4.0]]:
+            try:
+                curve(x)
+            except ValueError:
+                pass
+            else:
+                msg = 'Value %s outside curve should have failed' % x
+                raise Exception(msg)
+
+        # Lookup table is exact for inputs on its grid
+        table = curve.tabulate(0.0, 3.0, 0.01)
+        x = numpy.arange(301) * 0.01
+        assert numpy.allclose(table(x), curve(x), rtol=0, atol=1.0e-12)
+        assert numpy.allclose(table(0.15), 0.2)
+        assert numpy.isnan(table([numpy.nan]))[0]
+
+        # Family of curves by category with default for other categories
+        flat = Damage_curve([[0.0, 0.5], [3.0, 0.5]])
+        family = Damage_curve_family({'Timber': curve, 'Brick': flat},
+                                     default='Brick')
+        x = numpy.array([0.15, 0.15, 0.15, 2.0])
+        categories = numpy.array(['Timber', 'Brick', 'Concrete', 'Timber'],
+                                 dtype=object)
+        assert numpy.allclose(family(x, categories), [0.2, 0.5, 0.5, 0.9])
+        assert family['Timber'] is curve
+
+        family = Damage_curve_family({'Timber': curve})
+        try:
+            family(x, categories)
+        except AssertionError:
+            pass
+        else:
+            msg = 'Category without curve should have failed'
+            raise Exception(msg)
+
+        # Curves can be pickled e.g. to be sent to worker processes
+        family = pickle.loads(pickle.dumps(family))
+        assert numpy.allclose(family(x[[0, 3]], categories[[0, 3]]),
+                              [0.2, 0.9])
+
 
 if __name__ == '__main__':
     suite = unittest.makeSuite(Test_Functions, 'test')
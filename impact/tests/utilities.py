@@ -46,3 +46,67 @@ def same_API(X, Y, exclude=None):
     _same_API(Y, X, exclude=exclude)
 
     return True
+
+
+def tsunami_building_loss_by_loop(depths, E):
+    """Tsunami building loss computed one building at a time
+
+    Input
+        depths: Inundation depth at each building
+        E: Vector layer of buildings
+
+    Output
+        List of dictionaries of impact attributes, one per building, as
+        computed by TsunamiBuildingLossFunction before it was vectorized.
+        Used as reference in tests and benchmarks.
+    """
+
+    from impact.plugins.tsunami.NEXIS_building_impact_model import \
+        struct_damage_curve, contents_damage_curve
+
+    impact = []
+    for i, depth in enumerate(depths):
+        depth = float(depth)
+        number_of_people_in_building = int(E.get_data('NEXIS_PEOP', i))
+        wall_type = E.get_data('WALL_TYPE', i)
+        contents_value = E.get_data('CONT_VALUE', i)
+        structure_value = E.get_data('STR_VALUE', i)
+
+        if 0.01 < depth < 1.0:
+            people_affected = number_of_people_in_building
+        else:
+            people_affected = 0
+
+        if depth >= 1.0:
+            people_severely_affected = number_of_people_in_building
+        else:
+            people_severely_affected = 0
+
+        depth_floor = depth - 0.3
+        if depth_floor >= 0.0:
+            buildings_inundated = 1
+        else:
+            buildings_inundated = 0
+
+        if depth_floor < 0.0:
+            structural_damage = contents_damage = 0.0
+        else:
+            if wall_type in struct_damage_curve:
+                curve = struct_damage_curve[wall_type]
+            else:
+                curve = struct_damage_curve['Brick veneer']
+
+            structural_damage = float(curve(depth_floor))
+            contents_damage = float(contents_damage_curve(depth_floor))
+
+        impact.append({'NEXIS_PEOP': number_of_people_in_building,
+                       'PEOPLE_AFFECTED': people_affected,
+                       'PEOPLE_SEV_AFFECTED': people_severely_affected,
+                       'STRUCT_INUNDATED': buildings_inundated,
+                       'STRUCT_DAMAGE_fraction': structural_damage,
+                       'CONTENTS_DAMAGE_fraction': contents_damage,
+                       'STRUCT_LOSS_AUD': structural_damage * structure_value,
+                       'CONTENTS_LOSS_AUD': contents_damage * contents_value,
+                       'DEPTH': depth})
+
+    return impact
@@ -31,8 +31,9 @@ from django.http import HttpResponse
 from django.conf import settings
 
 from impact.storage.io import dummy_save, download, get_layers_metadata
-from impact.plugins.core import get_plugins, compatible_layers
+from impact.plugins.core import get_plugins, get_layer_index
 from impact.engine.core import calculate_impact
+from impact.engine.core import FEATURE_CHUNK_SIZE
 from impact.models import Calculation, Workspace
 from impact.auth import get_guaranteed_valid_user
 
@@ -84,7 +85,8 @@ def calculate(request, save_output=dummy_save):
     H = download(hazard_server, hazard_layer, bbox)
     logger.info('- Downloading exposure layer %s from %s' % (exposure_layer,
                                                              exposure_server))
-    E = download(exposure_server, exposure_layer, bbox)
+    E = download(exposure_server, exposure_layer, bbox,
+                 chunk_size=FEATURE_CHUNK_SIZE)
 
     # Calculate result using specified impact function
     logger.info('- Calculating impact using %s' % impact_function)
@@ -157,9 +159,10 @@ def functions(request):
  
     # For each plugin return all layers that meet the requirements
     # an empty layer is returned where the plugin cannot run
+    layer_index = get_layer_index(layers_metadata)
     annotated_plugins = []
     for name, f in plugin_list.items():
-        layers =  compatible_layers(f, layers_metadata)
+        layers = layer_index.compatible_layers(f)
 
         annotated_plugins.append({
          'name': name,
@@ -125,8 +125,8 @@ def save_file_to_geonode(filename, user=None, title=None,
                    '%s' % (filename, prjname))
             raise RisikoException(msg)
 
-        # Convert ASCII file to GeoTIFF
-        cmd = ('gdal_translate -ot Float64 -of GTiff -co "PROFILE=GEOTIFF" '
+        # Convert ASCII file to GeoTIFF keeping its data type
+        cmd = ('gdal_translate -of GTiff -co "PROFILE=GEOTIFF" '
                '%s %s' % (filename, upload_filename))
 
         run(cmd,
@@ -2,10 +2,12 @@
 # -*- coding: utf-8 -*-
 #from distutils.core import setup, Command
 from setuptools import setup, Command
+from setuptools.command.build_py import build_py
 from distutils.command.install_data import install_data
 from distutils.command.install import INSTALL_SCHEMES
 import os
 import sys
+import imp
 import codecs
 
 
@@ -105,6 +107,52 @@ class RunTests(Command):
         os.chdir(this_dir)
 
 
+def load_plugin_manifest_module():
+    """Load impact.plugins.manifest without importing the plugins
+    """
+
+    return imp.load_source('plugin_manifest',
+                           os.path.join('impact', 'plugins', 'manifest.py'))
+
+
+class PluginManifest(Command):
+    """Write manifest of plugins into the source tree
+    """
+
+    description = 'Write manifest of impact plugins (impact/plugins).'
+
+    user_options = []
+
+    def initialize_options(self):
+        pass
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        manifest = load_plugin_manifest_module()
+        manifest.write_manifest(os.path.join('impact', 'plugins',
+                                             'plugin_manifest.json'),
+                                os.path.join('impact', 'plugins'))
+
+
+class build_py_with_plugin_manifest(build_py):
+    """Build Python modules and the manifest of plugins
+
+    With the manifest plugin modules are only imported when used.
+    """
+
+    def run(self):
+        build_py.run(self)
+
+        if not self.dry_run:
+            manifest = load_plugin_manifest_module()
+            manifest.write_manifest(os.path.join(self.build_lib, 'impact',
+                                                 'plugins',
+                                                 'plugin_manifest.json'),
+                                    os.path.join('impact', 'plugins'))
+
+
 if os.path.exists('README.rst'):
     long_description = codecs.open('README.rst', 'r', 'utf-8').read()
 else:
@@ -142,7 +190,9 @@ setup(
 
         # for improving source code quality
         'pylint', 'pep8'],
-    cmdclass = {'test': RunTests},
+    cmdclass = {'test': RunTests,
+                'build_py': build_py_with_plugin_manifest,
+                'plugin_manifest': PluginManifest},
     scripts = ['scripts/risiko-clean',
                'scripts/risiko-stop',
                'scripts/risiko-start',